@@ -1,11 +1,9 @@
 import os
 from enum import Enum
 
-import mlflow
 import pendulum
 from airflow.decorators import dag, task
 from airflow.operators.bash import BashOperator
-from airflow.providers.docker.operators.docker import DockerOperator
 
 MLFLOW_TRACKING_URI_local = "http://127.0.0.1:5008/"
 MLFLOW_TRACKING_URI = "http://host.docker.internal:5008"
@@ -15,31 +13,12 @@ AWS_REGION = os.getenv("AWS_REGION")
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_ROLE_NAME = os.getenv("AWS_ROLE_NAME")
-skin_cancer_container_image = "seblum/cnn-skin-cancer-model:latest"
-
-
-mlflow.set_tracking_uri(MLFLOW_TRACKING_URI_local)
-
-
-def make_mlflow() -> str:
-    try:
-        # Creating an experiment
-        mlflow_experiment_id = mlflow.create_experiment(EXPERIMENT_NAME)
-    except:
-        pass
-    # Setting the environment with the created experiment
-    mlflow_experiment_id = mlflow.set_experiment(EXPERIMENT_NAME).experiment_id
-    return mlflow_experiment_id
-
-
-# when dag is loaded, mlflow experiment is created
-# COMMENTED FOR DOCKER TO SHOW IN WEBSERVER
-# mlflow_experiment_id = make_mlflow()
-
-
-# when dag is loaded, mlflow experiment is created
-mlflow_experiment_id = make_mlflow()
-# mlflow_experiment_id = "234"
+# role-specific images, see Docker/
+# the images are mutable tags and no digest is passed on as IMAGE_DIGEST, so every task runs with `use_cache=False`,
+# as the stage fingerprints would not change with a rebuilt image
+preprocess_container_image = "seblum/cnn-skin-cancer-model:preprocess"
+train_container_image = "seblum/cnn-skin-cancer-model:train"
+compare_deploy_container_image = "seblum/cnn-skin-cancer-model:compare-deploy"
 
 
 class Model_Class(Enum):
@@ -61,7 +40,6 @@ dag_default_args = {
 
 kwargs_env_data = {
     "MLFLOW_TRACKING_URI": MLFLOW_TRACKING_URI,
-    "MLFLOW_EXPERIMENT_ID": mlflow_experiment_id,
     "AWS_ACCESS_KEY_ID": AWS_ACCESS_KEY_ID,
     "AWS_SECRET_ACCESS_KEY": AWS_SECRET_ACCESS_KEY,
     "AWS_BUCKET": AWS_BUCKET,
@@ -70,13 +48,13 @@ kwargs_env_data = {
 }
 
 model_params = {
-    "num_classes": 2,
+    "num_classes": 2,  # overridden by the number of class folders in data/train
     "input_shape": (224, 224, 3),
     "activation": "relu",
     "kernel_initializer_glob": "glorot_uniform",
     "kernel_initializer_norm": "normal",
     "optimizer": "adam",
-    "loss": "binary_crossentropy",
+    "loss": "sparse_categorical_crossentropy",
     "metrics": ["accuracy"],
     "validation_split": 0.2,
     "epochs": 2,
@@ -84,6 +62,15 @@ model_params = {
     "learning_rate": 1e-5,
     "pooling": "avg",  # needed for resnet50
     "verbose": 2,
+    "class_balancing": "resample",  # "resample", "class_weight", or "none"
+    # applied per batch during training only, set to None to disable
+    "augmentation": {
+        "flip": "horizontal_and_vertical",
+        "rotation": 0.1,
+        "crop_fraction": 0.9,
+        "brightness": 0.1,
+        "contrast": 0.1,
+    },
 }
 
 
@@ -94,12 +81,33 @@ model_params = {
     max_active_runs=1,
 )
 def cnn_skin_cancer_workflow():
+    @task(task_id="mlflow_experiment_op")
+    def mlflow_experiment_op(tracking_uri: str) -> str:
+        """
+        Look up or create the MLflow experiment at runtime, so parsing the DAG does not hit the tracking server.
+
+        The task runs on the Airflow worker, which has mlflow but not `src` installed.
+
+        Args:
+            tracking_uri (str): The URI of the MLflow tracking server.
+
+        Returns:
+            str: The MLflow experiment ID.
+        """
+        import mlflow
+
+        client = mlflow.MlflowClient(tracking_uri=tracking_uri)
+        experiment = client.get_experiment_by_name(EXPERIMENT_NAME)
+        if experiment is not None:
+            return experiment.experiment_id
+        return client.create_experiment(EXPERIMENT_NAME)
+
     @task.docker(
-        image=skin_cancer_container_image,
+        image=preprocess_container_image,
         multiple_outputs=True,
         environment=kwargs_env_data,
         working_dir="/app",
-        force_pull=True,
+        force_pull=False,
         network_mode="bridge",
     )
     def preprocessing_op(mlflow_experiment_id):
@@ -123,7 +131,7 @@ def cnn_skin_cancer_workflow():
             y_train_data_path,
             X_test_data_path,
             y_test_data_path,
-        ) = data_preprocessing(mlflow_experiment_id=mlflow_experiment_id, aws_bucket=aws_bucket)
+        ) = data_preprocessing(mlflow_experiment_id=mlflow_experiment_id, aws_bucket=aws_bucket, use_cache=False)
 
         # Create dictionary with S3 paths to return
         return_dict = {
@@ -135,11 +143,11 @@ def cnn_skin_cancer_workflow():
         return return_dict
 
     @task.docker(
-        image=skin_cancer_container_image,
+        image=train_container_image,
         multiple_outputs=True,
         environment=kwargs_env_data,
         working_dir="/app",
-        force_pull=True,
+        force_pull=False,
         network_mode="bridge",
     )
     def model_training_op(mlflow_experiment_id, model_class, model_params, input):
@@ -166,6 +174,7 @@ def cnn_skin_cancer_workflow():
             model_params=model_params,
             aws_bucket=aws_bucket,
             import_dict=input,
+            use_cache=False,
         )
 
         return_dict = {
@@ -177,17 +186,18 @@ def cnn_skin_cancer_workflow():
         return return_dict
 
     @task.docker(
-        image=skin_cancer_container_image,
+        image=compare_deploy_container_image,
         multiple_outputs=True,
         environment=kwargs_env_data,
-        force_pull=True,
+        force_pull=False,
         network_mode="bridge",
     )
-    def compare_models_op(train_data_basic, train_data_resnet50, train_data_crossval):
+    def compare_models_op(mlflow_experiment_id, train_data_basic, train_data_resnet50, train_data_crossval):
         """
         Compare trained models.
 
         Args:
+            mlflow_experiment_id (str): The MLflow experiment ID.
             train_data_basic (dict): A dictionary containing the results of training the basic model.
             train_data_resnet50 (dict): A dictionary containing the results of training the ResNet50 model.
             train_data_crossval (dict): A dictionary containing the results of training the CrossVal model.
@@ -200,11 +210,22 @@ def cnn_skin_cancer_workflow():
             train_data_resnet50["model_name"]: train_data_resnet50["run_id"],
             train_data_crossval["model_name"]: train_data_crossval["run_id"],
         }
+        # the versions registered by the trainings, also if a training was reused from the stage cache
+        model_versions = {
+            train_data_basic["model_name"]: train_data_basic["model_version"],
+            train_data_resnet50["model_name"]: train_data_resnet50["model_version"],
+            train_data_crossval["model_name"]: train_data_crossval["model_version"],
+        }
 
         print(compare_dict)
         from src.compare_models import compare_models
 
-        serving_model_name, serving_model_uri, serving_model_version = compare_models(input_dict=compare_dict)
+        serving_model_name, serving_model_uri, serving_model_version = compare_models(
+            input_dict=compare_dict,
+            mlflow_experiment_id=mlflow_experiment_id,
+            use_cache=False,
+            model_versions=model_versions,
+        )
         return_dict = {
             "serving_model_name": serving_model_name,
             "serving_model_uri": serving_model_uri,
@@ -224,6 +245,7 @@ def cnn_skin_cancer_workflow():
 
     # CREATE PIPELINE
 
+    mlflow_experiment_id = mlflow_experiment_op(tracking_uri=MLFLOW_TRACKING_URI_local)
     preprocessed_data = preprocessing_op(
         mlflow_experiment_id=mlflow_experiment_id,
     )
@@ -245,7 +267,9 @@ def cnn_skin_cancer_workflow():
         model_params=model_params,
         input=preprocessed_data,
     )
-    compare_models_dict = compare_models_op(train_data_basic, train_data_resnet50, train_data_crossval)
+    compare_models_dict = compare_models_op(
+        mlflow_experiment_id, train_data_basic, train_data_resnet50, train_data_crossval
+    )
 
     compare_models_dict >> serve_fastapi_app_op >> serve_streamlit_app_op
 
@@ -0,0 +1,152 @@
+import pendulum
+from airflow.decorators import dag, task
+from airflow.kubernetes.secret import Secret
+from kubernetes.client import models as k8s
+
+################################################################################
+#
+# SET VARIOUS PARAMETERS
+#
+# the train image contains tensorflow to run the model inside the pod
+batch_scoring_container_image = "seblum/cnn-skin-cancer-model:train"
+
+# airflow variables are rendered at runtime, so parsing the DAG does not query the metadata database
+MLFLOW_TRACKING_URI = "{{ var.value.MLFLOW_TRACKING_URI }}"
+
+# secrets to pass on to k8s pod
+secret_name = "airflow-aws-account-information"
+SECRET_AWS_REGION = Secret(deploy_type="env", deploy_target="AWS_REGION", secret=secret_name, key="AWS_REGION")
+
+secret_name = "airflow-s3-data-bucket-access-credentials"
+SECRET_AWS_BUCKET = Secret(deploy_type="env", deploy_target="AWS_BUCKET", secret=secret_name, key="AWS_BUCKET")
+SECRET_AWS_ACCESS_KEY_ID = Secret(
+    deploy_type="env",
+    deploy_target="AWS_ACCESS_KEY_ID",
+    secret=secret_name,
+    key="AWS_ACCESS_KEY_ID",
+)
+SECRET_AWS_SECRET_ACCESS_KEY = Secret(
+    deploy_type="env",
+    deploy_target="AWS_SECRET_ACCESS_KEY",
+    secret=secret_name,
+    key="AWS_SECRET_ACCESS_KEY",
+)
+SECRET_AWS_ROLE_NAME = Secret(
+    deploy_type="env",
+    deploy_target="AWS_ROLE_NAME",
+    secret=secret_name,
+    key="AWS_ROLE_NAME",
+)
+
+# node_selector and toleration to schedule batch scoring on specific nodes
+tolerations = [k8s.V1Toleration(key="dedicated", operator="Equal", value="t3_large", effect="NoSchedule")]
+node_selector = {"role": "t3_large"}
+
+# node-local cache of registered model artifacts and metadata, shared by the pods scheduled on a node
+# repeated loads of a model version, e.g. of the deployed baseline in every shadow evaluation, are read from disk
+model_cache_params = {
+    "host_path": "/var/cache/cnn-skin-cancer-models",
+    "mount_path": "/mnt/model-cache",
+    "max_bytes": 10 * 1024**3,
+}
+
+model_cache_volume_name = "model-cache"
+model_cache_volume = k8s.V1Volume(
+    name=model_cache_volume_name,
+    host_path=k8s.V1HostPathVolumeSource(path=model_cache_params["host_path"], type="DirectoryOrCreate"),
+)
+model_cache_volume_mount = k8s.V1VolumeMount(name=model_cache_volume_name, mount_path=model_cache_params["mount_path"])
+model_cache_env_vars = {
+    "MODEL_CACHE_DIR": model_cache_params["mount_path"],
+    "MODEL_CACHE_MAX_BYTES": str(model_cache_params["max_bytes"]),
+}
+
+# Set batch scoring params
+# the images below "input_prefix" are scored in a single pod instead of one endpoint call per image
+# every chunk of "chunk_size" images is written as one Parquet file below "output_prefix"
+batch_scoring_params = {
+    "model_name": "Basic",
+    "model_stage": "Staging",
+    "input_prefix": "data/test",
+    "output_prefix": "predictions",
+    "chunk_size": 4096,
+    "batch_size": 256,
+    "max_workers": 16,
+}
+
+
+################################################################################
+#
+# AIRFLOW DAG
+#
+@dag(
+    dag_id="cnn_skin_cancer_batch_scoring",
+    default_args={
+        "owner": "seblum",
+        "depends_on_past": False,
+        "start_date": pendulum.datetime(2021, 1, 1, tz="Europe/Amsterdam"),
+        "tags": ["Batch scoring of images on S3 with the CNN model"],
+    },
+    schedule_interval=None,
+    max_active_runs=1,
+)
+def cnn_skin_cancer_batch_scoring():
+    """
+    Apache Airflow DAG for scoring all images below an S3 prefix in batches.
+    """
+
+    @task.kubernetes(
+        image=batch_scoring_container_image,
+        task_id="batch_scoring_op",
+        namespace="airflow",
+        env_vars={"MLFLOW_TRACKING_URI": MLFLOW_TRACKING_URI, **model_cache_env_vars},
+        volumes=[model_cache_volume],
+        volume_mounts=[model_cache_volume_mount],
+        in_cluster=True,
+        get_logs=True,
+        do_xcom_push=True,
+        startup_timeout_seconds=300,
+        node_selector=node_selector,
+        tolerations=tolerations,
+        service_account_name="airflow-sa",
+        secrets=[
+            SECRET_AWS_BUCKET,
+            SECRET_AWS_REGION,
+            SECRET_AWS_ACCESS_KEY_ID,
+            SECRET_AWS_SECRET_ACCESS_KEY,
+            SECRET_AWS_ROLE_NAME,
+        ],
+    )
+    def batch_scoring_op(batch_scoring_params: dict) -> dict:
+        """
+        Score the images below an S3 prefix and write the predictions as Parquet to S3.
+
+        Args:
+            batch_scoring_params (dict): A dictionary containing the model, the S3 prefixes, and the batch sizes.
+
+        Returns:
+            dict: A dictionary containing the model version, the number of scored images, and the output paths.
+        """
+        import os
+
+        from src.batch_scoring import batch_score
+
+        return batch_score(
+            model_name=batch_scoring_params["model_name"],
+            model_stage=batch_scoring_params["model_stage"],
+            aws_bucket=os.getenv("AWS_BUCKET"),
+            input_prefix=batch_scoring_params["input_prefix"],
+            output_prefix=batch_scoring_params["output_prefix"],
+            chunk_size=batch_scoring_params["chunk_size"],
+            batch_size=batch_scoring_params["batch_size"],
+            max_workers=batch_scoring_params["max_workers"],
+        )
+
+    ################################################################################
+    #
+    # CREATE PIPELINE
+    #
+    batch_scoring_op(batch_scoring_params=batch_scoring_params)
+
+
+cnn_skin_cancer_batch_scoring()
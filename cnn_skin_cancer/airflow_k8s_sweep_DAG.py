@@ -0,0 +1,463 @@
+from enum import Enum
+
+import pendulum
+from airflow.decorators import dag, task
+from airflow.kubernetes.secret import Secret
+from kubernetes.client import models as k8s
+
+################################################################################
+#
+# SET VARIOUS PARAMETERS
+#
+EXPERIMENT_NAME = "cnn_skin_cancer"  # mlflow experiment name
+# role-specific images for k8s pods, see Docker/
+# the tags move with every build, so the images are pinned by the digests the Docker CI publishes as airflow
+# variables, and the pinned references are passed on as IMAGE_DIGEST to key the stage cache
+container_repository = "seblum/cnn-skin-cancer-model"
+preprocess_container_image = container_repository + ":preprocess@{{ var.value.IMAGE_DIGEST_PREPROCESS }}"
+train_container_image = container_repository + ":train@{{ var.value.IMAGE_DIGEST_TRAIN }}"
+compare_deploy_container_image = container_repository + ":compare-deploy@{{ var.value.IMAGE_DIGEST_COMPARE_DEPLOY }}"
+
+# airflow variables are rendered at runtime, so parsing the DAG does not query the metadata database
+MLFLOW_TRACKING_URI = "{{ var.value.MLFLOW_TRACKING_URI }}"
+
+# secrets to pass on to k8s pod
+secret_name = "airflow-aws-account-information"
+SECRET_AWS_REGION = Secret(deploy_type="env", deploy_target="AWS_REGION", secret=secret_name, key="AWS_REGION")
+
+secret_name = "airflow-s3-data-bucket-access-credentials"
+SECRET_AWS_BUCKET = Secret(deploy_type="env", deploy_target="AWS_BUCKET", secret=secret_name, key="AWS_BUCKET")
+SECRET_AWS_ACCESS_KEY_ID = Secret(
+    deploy_type="env",
+    deploy_target="AWS_ACCESS_KEY_ID",
+    secret=secret_name,
+    key="AWS_ACCESS_KEY_ID",
+)
+SECRET_AWS_SECRET_ACCESS_KEY = Secret(
+    deploy_type="env",
+    deploy_target="AWS_SECRET_ACCESS_KEY",
+    secret=secret_name,
+    key="AWS_SECRET_ACCESS_KEY",
+)
+SECRET_AWS_ROLE_NAME = Secret(
+    deploy_type="env",
+    deploy_target="AWS_ROLE_NAME",
+    secret=secret_name,
+    key="AWS_ROLE_NAME",
+)
+
+# node_selector and toleration to schedule model training on specific nodes
+tolerations = [k8s.V1Toleration(key="dedicated", operator="Equal", value="t3_large", effect="NoSchedule")]
+node_selector = {"role": "t3_large"}
+
+# shared volume the preprocessed data is written to once and memory-mapped by all training pods
+# if "claim_name" is None, a node-local hostPath cache is used instead of a PVC
+# training pods fall back to S3 if the data is not available on the volume
+shared_volume_params = {
+    "enabled": True,
+    "claim_name": "cnn-skin-cancer-preprocessed-data",
+    "host_path": "/var/cache/cnn-skin-cancer",
+    "mount_path": "/mnt/preprocessed",
+}
+
+shared_volume_name = "preprocessed-data"
+if shared_volume_params["claim_name"]:
+    shared_volume = k8s.V1Volume(
+        name=shared_volume_name,
+        persistent_volume_claim=k8s.V1PersistentVolumeClaimVolumeSource(claim_name=shared_volume_params["claim_name"]),
+    )
+else:
+    shared_volume = k8s.V1Volume(
+        name=shared_volume_name,
+        host_path=k8s.V1HostPathVolumeSource(path=shared_volume_params["host_path"], type="DirectoryOrCreate"),
+    )
+
+if shared_volume_params["enabled"]:
+    SHARED_VOLUME_DIR = shared_volume_params["mount_path"]
+    shared_volumes = [shared_volume]
+    shared_volume_mounts_write = [k8s.V1VolumeMount(name=shared_volume_name, mount_path=SHARED_VOLUME_DIR)]
+    shared_volume_mounts_read = [
+        k8s.V1VolumeMount(name=shared_volume_name, mount_path=SHARED_VOLUME_DIR, read_only=True)
+    ]
+else:
+    SHARED_VOLUME_DIR = ""
+    shared_volumes, shared_volume_mounts_write, shared_volume_mounts_read = [], [], []
+
+# node-local spool of MLflow entries the training could not send during a tracking outage, see src/mlflow_logging.py
+# the spool outlives the pods, so the next pod logging on the node sends the spooled entries
+mlflow_spool_params = {
+    "host_path": "/var/spool/cnn-skin-cancer-mlflow",
+    "mount_path": "/mnt/mlflow-spool",
+}
+
+mlflow_spool_volume_name = "mlflow-spool"
+mlflow_spool_volume = k8s.V1Volume(
+    name=mlflow_spool_volume_name,
+    host_path=k8s.V1HostPathVolumeSource(path=mlflow_spool_params["host_path"], type="DirectoryOrCreate"),
+)
+mlflow_spool_volume_mount = k8s.V1VolumeMount(
+    name=mlflow_spool_volume_name, mount_path=mlflow_spool_params["mount_path"]
+)
+mlflow_spool_env_vars = {"MLFLOW_SPOOL_DIR": mlflow_spool_params["mount_path"]}
+
+
+# Enum Class to distiguish models
+class Model_Class(Enum):
+    """This enum includes different models."""
+
+    Basic = "Basic"
+    CrossVal = "CrossVal"
+    ResNet50 = "ResNet50"
+
+
+# Set preprocessing params
+# streaming processes the images in batches bounded by the memory budget (MiB) and writes the chunks as it goes,
+# for data sets larger than the memory of the preprocessing pod
+preprocessing_params = {
+    "streaming": False,
+    "memory_budget_mb": 2048,
+}
+
+# Set various model params, the search space overrides the base params per trial
+model_params = {
+    "num_classes": 2,  # overridden by the number of class folders in data/train
+    "input_shape": (224, 224, 3),
+    "activation": "relu",
+    "kernel_initializer_glob": "glorot_uniform",
+    "kernel_initializer_norm": "normal",
+    "optimizer": "adam",
+    "loss": "sparse_categorical_crossentropy",
+    "metrics": ["accuracy"],
+    "validation_split": 0.2,
+    "epochs": 9,
+    "batch_size": 64,
+    "learning_rate": 1e-5,
+    "pooling": "avg",  # needed for resnet50
+    "verbose": 2,
+    "class_balancing": "resample",  # "resample", "class_weight", or "none"
+    # applied per batch during training only, set to None to disable
+    "augmentation": {
+        "flip": "horizontal_and_vertical",
+        "rotation": 0.1,
+        "crop_fraction": 0.9,
+        "brightness": 0.1,
+        "contrast": 0.1,
+    },
+}
+
+sweep_params = {
+    "model_classes": [Model_Class.Basic.name, Model_Class.ResNet50.name],
+    "strategy": "halving",  # one of "grid", "random", "halving"
+    "num_trials": 9,  # only used for "random" and "halving"
+    "search_space": {
+        "learning_rate": [1e-3, 1e-4, 1e-5],
+        "batch_size": [32, 64],
+        "optimizer": ["adam", "sgd"],
+    },
+    "pruning_metric": "val_accuracy",
+    "min_epochs": 1,
+    "reduction_factor": 3,
+}
+
+# number of trials trained at the same time
+SWEEP_MAX_PARALLEL_TRIALS = 4
+
+################################################################################
+#
+# AIRFLOW DAG
+#
+@dag(
+    dag_id="cnn_skin_cancer_sweep_workflow",
+    default_args={
+        "owner": "seblum",
+        "depends_on_past": False,
+        "start_date": pendulum.datetime(2021, 1, 1, tz="Europe/Amsterdam"),
+        "tags": ["Hyperparameter sweep of Keras CNN to classify skin cancer"],
+    },
+    schedule_interval=None,
+    max_active_runs=1,
+)
+def cnn_skin_cancer_sweep_workflow():
+    """
+    Apache Airflow DAG for running a hyperparameter sweep over the skin cancer classification models.
+    """
+
+    @task(task_id="mlflow_experiment_op")
+    def mlflow_experiment_op(tracking_uri: str) -> str:
+        """
+        Look up or create the MLflow experiment at runtime, so parsing the DAG does not hit the tracking server.
+
+        The task runs on the Airflow worker, which has mlflow but not `src` installed.
+
+        Args:
+            tracking_uri (str): The URI of the MLflow tracking server.
+
+        Returns:
+            str: The MLflow experiment ID.
+        """
+        import mlflow
+
+        client = mlflow.MlflowClient(tracking_uri=tracking_uri)
+        experiment = client.get_experiment_by_name(EXPERIMENT_NAME)
+        if experiment is not None:
+            return experiment.experiment_id
+        return client.create_experiment(EXPERIMENT_NAME)
+
+    @task.kubernetes(
+        image=preprocess_container_image,
+        task_id="preprocessing_op",
+        namespace="airflow",
+        env_vars={
+            "MLFLOW_TRACKING_URI": MLFLOW_TRACKING_URI,
+            "SHARED_VOLUME_DIR": SHARED_VOLUME_DIR,
+            "IMAGE_DIGEST": preprocess_container_image,
+            **mlflow_spool_env_vars,
+        },
+        volumes=shared_volumes + [mlflow_spool_volume],
+        volume_mounts=shared_volume_mounts_write + [mlflow_spool_volume_mount],
+        in_cluster=True,
+        get_logs=True,
+        do_xcom_push=True,
+        startup_timeout_seconds=300,
+        service_account_name="airflow-sa",
+        secrets=[
+            SECRET_AWS_BUCKET,
+            SECRET_AWS_REGION,
+            SECRET_AWS_ACCESS_KEY_ID,
+            SECRET_AWS_SECRET_ACCESS_KEY,
+            SECRET_AWS_ROLE_NAME,
+        ],
+    )
+    def preprocessing_op(mlflow_experiment_id: str, preprocessing_params: dict) -> dict:
+        """
+        Perform data preprocessing.
+
+        Args:
+            mlflow_experiment_id (str): The MLflow experiment ID.
+            preprocessing_params (dict): The streaming params of the preprocessing.
+
+        Returns:
+            dict: A dictionary containing the paths to preprocessed data.
+        """
+        import os
+
+        aws_bucket = os.getenv("AWS_BUCKET")
+        shared_volume_dir = os.getenv("SHARED_VOLUME_DIR")
+
+        from src.preprocessing import data_preprocessing
+
+        X_train_data_path, y_train_data_path, X_test_data_path, y_test_data_path = data_preprocessing(
+            mlflow_experiment_id=mlflow_experiment_id,
+            aws_bucket=aws_bucket,
+            shared_volume_dir=shared_volume_dir,
+            streaming=preprocessing_params["streaming"],
+            memory_budget_mb=preprocessing_params["memory_budget_mb"],
+        )
+
+        # Create dictionary with S3 paths to return
+        # training pods read from the shared volume first, if given
+        return_dict = {
+            "X_train_data_path": X_train_data_path,
+            "y_train_data_path": y_train_data_path,
+            "X_test_data_path": X_test_data_path,
+            "y_test_data_path": y_test_data_path,
+            "shared_volume_dir": shared_volume_dir,
+        }
+        return return_dict
+
+    @task.kubernetes(
+        image=compare_deploy_container_image,
+        task_id="expand_trials_op",
+        namespace="airflow",
+        in_cluster=True,
+        get_logs=True,
+        do_xcom_push=True,
+        startup_timeout_seconds=300,
+        service_account_name="airflow-sa",
+    )
+    def expand_trials_op(model_params: dict, sweep_params: dict) -> list:
+        """
+        Expand the search space into one trial per model class and param combination.
+
+        Args:
+            model_params (dict): A dictionary containing the base model parameters.
+            sweep_params (dict): A dictionary containing the sweep configuration.
+
+        Returns:
+            list: A list of trials, each containing "trial_id", "model_class" and "model_params". The trial IDs
+                are prefixed by the model class, so they are unique across the sweep.
+        """
+        from src.sweep import expand_search_space
+
+        trials = []
+        for model_class in sweep_params["model_classes"]:
+            for trial in expand_search_space(
+                base_params=model_params,
+                search_space=sweep_params["search_space"],
+                strategy=sweep_params["strategy"],
+                num_trials=sweep_params["num_trials"],
+            ):
+                trials.append({**trial, "trial_id": f"{model_class}_{trial['trial_id']}", "model_class": model_class})
+
+        print(f"Expanded {len(trials)} trials")
+        return trials
+
+    @task.kubernetes(
+        image=train_container_image,
+        task_id="model_training_op",
+        namespace="airflow",
+        env_vars={
+            "MLFLOW_TRACKING_URI": MLFLOW_TRACKING_URI,
+            "IMAGE_DIGEST": train_container_image,
+            **mlflow_spool_env_vars,
+        },
+        volumes=shared_volumes + [mlflow_spool_volume],
+        volume_mounts=shared_volume_mounts_read + [mlflow_spool_volume_mount],
+        in_cluster=True,
+        get_logs=True,
+        do_xcom_push=True,
+        startup_timeout_seconds=300,
+        node_selector=node_selector,
+        tolerations=tolerations,
+        service_account_name="airflow-sa",
+        max_active_tis_per_dag=SWEEP_MAX_PARALLEL_TRIALS,
+        secrets=[
+            SECRET_AWS_BUCKET,
+            SECRET_AWS_REGION,
+            SECRET_AWS_ACCESS_KEY_ID,
+            SECRET_AWS_SECRET_ACCESS_KEY,
+            SECRET_AWS_ROLE_NAME,
+        ],
+    )
+    def model_training_op(
+        mlflow_experiment_id: str, sweep_id: str, sweep_params: dict, input: dict, trial: dict
+    ) -> dict:
+        """
+        Train a single trial of the sweep, pruning it early if it falls behind the other trials.
+
+        Args:
+            mlflow_experiment_id (str): The MLflow experiment ID.
+            sweep_id (str): The ID shared by all trials of this sweep.
+            sweep_params (dict): A dictionary containing the sweep configuration.
+            input (dict): A dictionary containing the input data.
+            trial (dict): A dictionary containing "trial_id", "model_class" and "model_params".
+
+        Returns:
+            dict: A dictionary containing the results of the trial.
+        """
+        import os
+
+        from src.model.callbacks import PruningCallback
+        from src.train import train_model
+
+        aws_bucket = os.getenv("AWS_BUCKET")
+        pruning_callback = PruningCallback(
+            sweep_id=sweep_id,
+            experiment_id=mlflow_experiment_id,
+            model_class=trial["model_class"],
+            strategy=sweep_params["strategy"],
+            metric=sweep_params["pruning_metric"],
+            min_epochs=sweep_params["min_epochs"],
+            reduction_factor=sweep_params["reduction_factor"],
+        )
+        run_id, model_name, _, _ = train_model(
+            mlflow_experiment_id=mlflow_experiment_id,
+            model_class=trial["model_class"],
+            model_params=trial["model_params"],
+            aws_bucket=aws_bucket,
+            import_dict=input,
+            callbacks=[pruning_callback],
+            run_tags={"sweep_id": sweep_id, "trial_id": trial["trial_id"], "model_class": trial["model_class"]},
+            register_model=False,
+            use_cache=False,  # cached trials would skip the pruning of the current sweep
+        )
+
+        return_dict = {
+            "run_id": run_id,
+            "model_name": model_name,
+            "trial_id": trial["trial_id"],
+            "pruned": pruning_callback.pruned,
+        }
+        return return_dict
+
+    @task.kubernetes(
+        image=compare_deploy_container_image,
+        task_id="select_winners_op",
+        namespace="airflow",
+        env_vars={"MLFLOW_TRACKING_URI": MLFLOW_TRACKING_URI, "IMAGE_DIGEST": compare_deploy_container_image},
+        in_cluster=True,
+        get_logs=True,
+        do_xcom_push=True,
+        startup_timeout_seconds=300,
+        service_account_name="airflow-sa",  # Don't need Access Secrets as SA is given
+    )
+    def select_winners_op(trial_results: list) -> dict:
+        """
+        Select and register the best trial per model class.
+
+        Args:
+            trial_results (list): A list of dictionaries containing the results of the trials.
+
+        Returns:
+            dict: A dictionary containing the names and run IDs of the winning models.
+        """
+        from src.sweep import select_sweep_winners
+
+        return select_sweep_winners(trial_results=list(trial_results))
+
+    @task.kubernetes(
+        image=compare_deploy_container_image,
+        task_id="compare_models_op",
+        namespace="airflow",
+        env_vars={"MLFLOW_TRACKING_URI": MLFLOW_TRACKING_URI, "IMAGE_DIGEST": compare_deploy_container_image},
+        in_cluster=True,
+        get_logs=True,
+        do_xcom_push=True,
+        startup_timeout_seconds=300,
+        service_account_name="airflow-sa",  # Don't need Access Secrets as SA is given
+    )
+    def compare_models_op(mlflow_experiment_id: str, compare_dict: dict) -> dict:
+        """
+        Compare the winning models of the sweep.
+
+        Args:
+            mlflow_experiment_id (str): The MLflow experiment ID.
+            compare_dict (dict): A dictionary containing the names and run IDs of the winning models.
+
+        Returns:
+            dict: A dictionary containing the results of the model comparison.
+        """
+        print(compare_dict)
+        from src.compare_models import compare_models
+
+        serving_model_name, serving_model_uri, serving_model_version = compare_models(
+            input_dict=compare_dict, mlflow_experiment_id=mlflow_experiment_id
+        )
+        return_dict = {
+            "serving_model_name": serving_model_name,
+            "serving_model_uri": serving_model_uri,
+            "serving_model_version": serving_model_version,
+        }
+        return return_dict
+
+    ################################################################################
+    #
+    # CREATE PIPELINE
+    #
+    mlflow_experiment_id = mlflow_experiment_op(tracking_uri=MLFLOW_TRACKING_URI)
+    preprocessed_data = preprocessing_op(
+        mlflow_experiment_id=mlflow_experiment_id,
+        preprocessing_params=preprocessing_params,
+    )
+    trials = expand_trials_op(model_params=model_params, sweep_params=sweep_params)
+    trial_results = model_training_op.partial(
+        mlflow_experiment_id=mlflow_experiment_id,
+        sweep_id="{{ run_id }}",
+        sweep_params=sweep_params,
+        input=preprocessed_data,
+    ).expand(trial=trials)
+    winners = select_winners_op(trial_results)
+    compare_models_op(mlflow_experiment_id, winners)
+
+
+cnn_skin_cancer_sweep_workflow()
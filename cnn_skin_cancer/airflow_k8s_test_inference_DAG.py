@@ -4,7 +4,7 @@ from airflow.kubernetes.secret import Secret
 from airflow.models import Variable
 
 # SET PARAMETERS
-skin_cancer_container_image = "seblum/cnn-skin-cancer-model:latest"  # base image for k8s pods
+inference_client_container_image = "seblum/cnn-skin-cancer-model:inference-client"  # image for k8s pods
 
 SECRET_AWS_REGION = Secret(
     deploy_type="env", deploy_target="AWS_REGION", secret="airflow-aws-account-information", key="AWS_REGION"
@@ -32,7 +32,7 @@ def cnn_skin_cancer_sagemaker_inference_test():
     """
 
     @task.kubernetes(
-        image=skin_cancer_container_image,
+        image=inference_client_container_image,
         task_id="inference_call_op",
         namespace="airflow",
         in_cluster=True,
@@ -47,14 +47,11 @@ def cnn_skin_cancer_sagemaker_inference_test():
         """
         Perform inference on a SageMaker endpoint with multiple images.
         """
-        import json
-
         from src.inference_to_sagemaker import (
+            encode_image_payload,
             endpoint_status,
             get_image_directory,
-            preprocess_image,
             query_endpoint,
-            read_imagefile,
         )
 
         sagemaker_endpoint_name = "test-cnn-skin-cancer"
@@ -72,13 +69,9 @@ def cnn_skin_cancer_sagemaker_inference_test():
             print("[+] Endpoint Status")
             print(f"Application status is {endpoint_status(sagemaker_endpoint_name)}")
 
-            image = read_imagefile(filepath)
-
-            print("[+] Preprocess Data")
-            np_image = preprocess_image(image)
-
-            # Add instances fiels so np_image can be inferenced by MLflow model
-            payload = json.dumps({"instances": np_image.tolist()})
+            # The raw JPEG is sent, the model preprocesses it server-side
+            print("[+] Encode Data")
+            payload = encode_image_payload([filepath])
 
             print("[+] Prediction")
             predictions = query_endpoint(app_name=sagemaker_endpoint_name, data=payload)
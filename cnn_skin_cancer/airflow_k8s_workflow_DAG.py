@@ -1,25 +1,30 @@
-import os
+import json
 from enum import Enum
+from pathlib import Path
 
-import mlflow
 import pendulum
 from airflow.decorators import dag, task
 from airflow.kubernetes.secret import Secret
-from airflow.models import Variable
-from airflow.operators.bash import BashOperator
-from airflow.providers.docker.operators.docker import DockerOperator
 from kubernetes.client import models as k8s
+from sagemaker_endpoint_sensor import SageMakerEndpointSensor
 
 ################################################################################
 #
 # SET VARIOUS PARAMETERS
 #
 EXPERIMENT_NAME = "cnn_skin_cancer"  # mlflow experiment name
-skin_cancer_container_image = "seblum/cnn-skin-cancer-model:latest"  # base image for k8s pods
-
-MLFLOW_TRACKING_URI = Variable.get("MLFLOW_TRACKING_URI")
-ECR_REPOSITORY_NAME = Variable.get("ECR_REPOSITORY_NAME")
-ECR_SAGEMAKER_IMAGE_TAG = Variable.get("ECR_SAGEMAKER_IMAGE_TAG")
+# role-specific images for k8s pods, see Docker/
+# the tags move with every build, so the images are pinned by the digests the Docker CI publishes as airflow
+# variables, and the pinned references are passed on as IMAGE_DIGEST to key the stage cache
+container_repository = "seblum/cnn-skin-cancer-model"
+preprocess_container_image = container_repository + ":preprocess@{{ var.value.IMAGE_DIGEST_PREPROCESS }}"
+train_container_image = container_repository + ":train@{{ var.value.IMAGE_DIGEST_TRAIN }}"
+compare_deploy_container_image = container_repository + ":compare-deploy@{{ var.value.IMAGE_DIGEST_COMPARE_DEPLOY }}"
+
+# airflow variables are rendered at runtime, so parsing the DAG does not query the metadata database
+MLFLOW_TRACKING_URI = "{{ var.value.MLFLOW_TRACKING_URI }}"
+ECR_REPOSITORY_NAME = "{{ var.value.ECR_REPOSITORY_NAME }}"
+ECR_SAGEMAKER_IMAGE_TAG = "{{ var.value.ECR_SAGEMAKER_IMAGE_TAG }}"
 
 # secrets to pass on to k8s pod
 secret_name = "airflow-sagemaker-access"
@@ -60,6 +65,103 @@ SECRET_AWS_ROLE_NAME = Secret(
 tolerations = [k8s.V1Toleration(key="dedicated", operator="Equal", value="t3_large", effect="NoSchedule")]
 node_selector = {"role": "t3_large"}
 
+# shared volume the preprocessed data is written to once and memory-mapped by all training pods
+# if "claim_name" is None, a node-local hostPath cache is used instead of a PVC
+# training pods fall back to S3 if the data is not available on the volume
+shared_volume_params = {
+    "enabled": True,
+    "claim_name": "cnn-skin-cancer-preprocessed-data",
+    "host_path": "/var/cache/cnn-skin-cancer",
+    "mount_path": "/mnt/preprocessed",
+}
+
+shared_volume_name = "preprocessed-data"
+if shared_volume_params["claim_name"]:
+    shared_volume = k8s.V1Volume(
+        name=shared_volume_name,
+        persistent_volume_claim=k8s.V1PersistentVolumeClaimVolumeSource(claim_name=shared_volume_params["claim_name"]),
+    )
+else:
+    shared_volume = k8s.V1Volume(
+        name=shared_volume_name,
+        host_path=k8s.V1HostPathVolumeSource(path=shared_volume_params["host_path"], type="DirectoryOrCreate"),
+    )
+
+if shared_volume_params["enabled"]:
+    SHARED_VOLUME_DIR = shared_volume_params["mount_path"]
+    shared_volumes = [shared_volume]
+    shared_volume_mounts_write = [k8s.V1VolumeMount(name=shared_volume_name, mount_path=SHARED_VOLUME_DIR)]
+    shared_volume_mounts_read = [
+        k8s.V1VolumeMount(name=shared_volume_name, mount_path=SHARED_VOLUME_DIR, read_only=True)
+    ]
+else:
+    SHARED_VOLUME_DIR = ""
+    shared_volumes, shared_volume_mounts_write, shared_volume_mounts_read = [], [], []
+
+# node-local spool of MLflow entries the training could not send during a tracking outage, see src/mlflow_logging.py
+# the spool outlives the pods, so the next pod logging on the node sends the spooled entries
+mlflow_spool_params = {
+    "host_path": "/var/spool/cnn-skin-cancer-mlflow",
+    "mount_path": "/mnt/mlflow-spool",
+}
+
+mlflow_spool_volume_name = "mlflow-spool"
+mlflow_spool_volume = k8s.V1Volume(
+    name=mlflow_spool_volume_name,
+    host_path=k8s.V1HostPathVolumeSource(path=mlflow_spool_params["host_path"], type="DirectoryOrCreate"),
+)
+mlflow_spool_volume_mount = k8s.V1VolumeMount(
+    name=mlflow_spool_volume_name, mount_path=mlflow_spool_params["mount_path"]
+)
+mlflow_spool_env_vars = {"MLFLOW_SPOOL_DIR": mlflow_spool_params["mount_path"]}
+
+# CPU and memory requests and limits per task, derived from the peak RSS and CPU seconds logged by previous runs
+# the shipped profile only holds default estimates, marked as estimated, until it is regenerated from real runs
+# regenerate profiles/pod_resources.json with `python -m src.resource_profiling`
+# the profile is read with plain json, as `src` is only installed in the pods and not on the airflow components
+with open(Path(__file__).parent / "profiles" / "pod_resources.json") as f:
+    pod_resource_profile = json.load(f)
+
+
+def container_resources(task_id: str, variant: str = None) -> k8s.V1ResourceRequirements:
+    """
+    Get the resource requirements of a task from the pod resource profile.
+
+    A variant is looked up as "<task_id>:<variant>", the key `src.resource_profiling.profile_key` logs its usage
+    under, falling back to the task without variant and to the defaults.
+
+    Args:
+        task_id (str): The task ID.
+        variant (str, optional): The variant of the task, e.g. the model class. Defaults to None.
+
+    Returns:
+        k8s.V1ResourceRequirements: The requests and limits of the task's container.
+    """
+    tasks = pod_resource_profile["tasks"]
+    key = f"{task_id}:{variant}" if variant else task_id
+    resources = tasks.get(key) or tasks.get(task_id) or pod_resource_profile["defaults"]
+    return k8s.V1ResourceRequirements(requests=resources["requests"], limits=resources.get("limits"))
+
+
+# node-local cache of registered model artifacts and metadata, shared by the pods scheduled on a node
+# repeated loads of a model version, e.g. of the deployed baseline in every shadow evaluation, are read from disk
+model_cache_params = {
+    "host_path": "/var/cache/cnn-skin-cancer-models",
+    "mount_path": "/mnt/model-cache",
+    "max_bytes": 10 * 1024**3,
+}
+
+model_cache_volume_name = "model-cache"
+model_cache_volume = k8s.V1Volume(
+    name=model_cache_volume_name,
+    host_path=k8s.V1HostPathVolumeSource(path=model_cache_params["host_path"], type="DirectoryOrCreate"),
+)
+model_cache_volume_mount = k8s.V1VolumeMount(name=model_cache_volume_name, mount_path=model_cache_params["mount_path"])
+model_cache_env_vars = {
+    "MODEL_CACHE_DIR": model_cache_params["mount_path"],
+    "MODEL_CACHE_MAX_BYTES": str(model_cache_params["max_bytes"]),
+}
+
 
 # Enum Class to distiguish models
 class Model_Class(Enum):
@@ -70,15 +172,23 @@ class Model_Class(Enum):
     ResNet50 = "ResNet50"
 
 
+# Set preprocessing params
+# streaming processes the images in batches bounded by the memory budget (MiB) and writes the chunks as it goes,
+# for data sets larger than the memory of the preprocessing pod
+preprocessing_params = {
+    "streaming": False,
+    "memory_budget_mb": 2048,
+}
+
 # Set various model params
 model_params = {
-    "num_classes": 2,
+    "num_classes": 2,  # overridden by the number of class folders in data/train
     "input_shape": (224, 224, 3),
     "activation": "relu",
     "kernel_initializer_glob": "glorot_uniform",
     "kernel_initializer_norm": "normal",
     "optimizer": "adam",
-    "loss": "binary_crossentropy",
+    "loss": "sparse_categorical_crossentropy",
     "metrics": ["accuracy"],
     "validation_split": 0.2,
     "epochs": 2,
@@ -86,38 +196,57 @@ model_params = {
     "learning_rate": 1e-5,
     "pooling": "avg",  # needed for resnet50
     "verbose": 2,
+    "class_balancing": "resample",  # "resample", "class_weight", or "none"
+    # applied per batch during training only, set to None to disable
+    "augmentation": {
+        "flip": "horizontal_and_vertical",
+        "rotation": 0.1,
+        "crop_fraction": 0.9,
+        "brightness": 0.1,
+        "contrast": 0.1,
+    },
 }
 
-################################################################################
-#
-# SET MLFLOW
-#
-mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
-
-
-def make_mlflow() -> str:
-    """
-    Creates an MLflow experiment and sets it as the active experiment.
-
-    Returns:
-        str: The experiment ID of the created or existing MLflow experiment.
-
-    Example:
-        # Create an MLflow experiment and set it as active
-        experiment_id = make_mlflow()
-        print(f"Active MLflow experiment ID: {experiment_id}")
-    """
-    try:
-        mlflow_experiment_id = mlflow.create_experiment(EXPERIMENT_NAME)
-    except:
-        pass
-    mlflow_experiment_id = mlflow.set_experiment(EXPERIMENT_NAME).experiment_id
-    return mlflow_experiment_id
-
+# Set sagemaker deployment params
+# mode "auto" updates an existing endpoint in place and creates it otherwise
+# if autoscaling is enabled, instance type and count are chosen from the recorded load-test profile
+# the shipped profile only holds estimates, enable autoscaling once a load test is recorded, see the README
+sagemaker_params = {
+    "endpoint_name": "test-cnn-skin-cancer",
+    "instance_type": "ml.t2.large",
+    "instance_count": 1,
+    "mode": "auto",
+    "autoscaling": {
+        "enabled": False,
+        "expected_peak_invocations_per_minute": 600,
+        "target_utilization": 0.7,
+        "min_instances": 1,
+    },
+}
 
-# When dag is loaded, mlflow experiment is created
-mlflow_experiment_id = make_mlflow()
+# Set shadow evaluation params
+# the best model is replayed against the deployed model on the held-out test set before it is promoted
+# the promotion is blocked if its p95 latency or its agreement with the deployed model regresses beyond the thresholds
+shadow_params = {
+    "enabled": True,
+    "max_requests": 200,
+    "concurrency": 4,
+    "max_p95_latency_regression": 0.2,
+    "min_agreement": 0.9,
+}
 
+# Set distributed training params
+# if enabled, the ResNet50 model is trained data-parallel by "num_workers" coordinated pods instead of a single pod
+# the pods find each other through the headless service "service_name" (clusterIP: None), which has to exist in the
+# namespace and select the label below
+distributed_params = {
+    "enabled": False,
+    "num_workers": 3,
+    "port": 12345,
+    "service_name": "cnn-skin-cancer-workers",
+    "model_class": "ResNet50",
+}
+distributed_worker_label = {"app": "cnn-skin-cancer-distributed-training"}
 
 ################################################################################
 #
@@ -139,11 +268,40 @@ def cnn_skin_cancer_workflow():
     Apache Airflow DAG for running a workflow to train, compare, and deploy skin cancer classification models.
     """
 
+    @task(task_id="mlflow_experiment_op")
+    def mlflow_experiment_op(tracking_uri: str) -> str:
+        """
+        Look up or create the MLflow experiment at runtime, so parsing the DAG does not hit the tracking server.
+
+        The task runs on the Airflow worker, which has mlflow but not `src` installed.
+
+        Args:
+            tracking_uri (str): The URI of the MLflow tracking server.
+
+        Returns:
+            str: The MLflow experiment ID.
+        """
+        import mlflow
+
+        client = mlflow.MlflowClient(tracking_uri=tracking_uri)
+        experiment = client.get_experiment_by_name(EXPERIMENT_NAME)
+        if experiment is not None:
+            return experiment.experiment_id
+        return client.create_experiment(EXPERIMENT_NAME)
+
     @task.kubernetes(
-        image=skin_cancer_container_image,
+        image=preprocess_container_image,
         task_id="preprocessing_op",
         namespace="airflow",
-        env_vars={"MLFLOW_TRACKING_URI": MLFLOW_TRACKING_URI},
+        container_resources=container_resources("preprocessing_op"),
+        env_vars={
+            "MLFLOW_TRACKING_URI": MLFLOW_TRACKING_URI,
+            "SHARED_VOLUME_DIR": SHARED_VOLUME_DIR,
+            "IMAGE_DIGEST": preprocess_container_image,
+            **mlflow_spool_env_vars,
+        },
+        volumes=shared_volumes + [mlflow_spool_volume],
+        volume_mounts=shared_volume_mounts_write + [mlflow_spool_volume_mount],
         in_cluster=True,
         get_logs=True,
         do_xcom_push=True,
@@ -157,43 +315,59 @@ def cnn_skin_cancer_workflow():
             SECRET_AWS_ROLE_NAME,
         ],
     )
-    def preprocessing_op(mlflow_experiment_id: str) -> dict:
+    def preprocessing_op(mlflow_experiment_id: str, preprocessing_params: dict) -> dict:
         """
         Perform data preprocessing.
 
         Args:
             mlflow_experiment_id (str): The MLflow experiment ID.
+            preprocessing_params (dict): The streaming params of the preprocessing.
 
         Returns:
             dict: A dictionary containing the paths to preprocessed data.
         """
         import os
 
+        from src.resource_profiling import track_resource_usage
+
+        track_resource_usage("preprocessing_op")
+
         aws_bucket = os.getenv("AWS_BUCKET")
+        shared_volume_dir = os.getenv("SHARED_VOLUME_DIR")
 
         from src.preprocessing import data_preprocessing
 
-        (
-            X_train_data_path,
-            y_train_data_path,
-            X_test_data_path,
-            y_test_data_path,
-        ) = data_preprocessing(mlflow_experiment_id=mlflow_experiment_id, aws_bucket=aws_bucket)
+        X_train_data_path, y_train_data_path, X_test_data_path, y_test_data_path = data_preprocessing(
+            mlflow_experiment_id=mlflow_experiment_id,
+            aws_bucket=aws_bucket,
+            shared_volume_dir=shared_volume_dir,
+            streaming=preprocessing_params["streaming"],
+            memory_budget_mb=preprocessing_params["memory_budget_mb"],
+        )
 
         # Create dictionary with S3 paths to return
+        # training pods read from the shared volume first, if given
         return_dict = {
             "X_train_data_path": X_train_data_path,
             "y_train_data_path": y_train_data_path,
             "X_test_data_path": X_test_data_path,
             "y_test_data_path": y_test_data_path,
+            "shared_volume_dir": shared_volume_dir,
         }
         return return_dict
 
     @task.kubernetes(
-        image=skin_cancer_container_image,
+        image=train_container_image,
         task_id="model_training_op",
         namespace="airflow",
-        env_vars={"MLFLOW_TRACKING_URI": MLFLOW_TRACKING_URI},
+        container_resources=container_resources("model_training_op"),
+        env_vars={
+            "MLFLOW_TRACKING_URI": MLFLOW_TRACKING_URI,
+            "IMAGE_DIGEST": train_container_image,
+            **mlflow_spool_env_vars,
+        },
+        volumes=shared_volumes + [mlflow_spool_volume],
+        volume_mounts=shared_volume_mounts_read + [mlflow_spool_volume_mount],
         in_cluster=True,
         get_logs=True,
         do_xcom_push=True,
@@ -224,6 +398,10 @@ def cnn_skin_cancer_workflow():
         """
         import os
 
+        from src.resource_profiling import track_resource_usage
+
+        track_resource_usage("model_training_op", variant=model_class)
+
         from src.train import train_model
 
         aws_bucket = os.getenv("AWS_BUCKET")
@@ -244,38 +422,222 @@ def cnn_skin_cancer_workflow():
         return return_dict
 
     @task.kubernetes(
-        image=skin_cancer_container_image,
+        image=train_container_image,
+        task_id="distributed_training_op",
+        namespace="airflow",
+        container_resources=container_resources("distributed_training_op"),
+        env_vars={"MLFLOW_TRACKING_URI": MLFLOW_TRACKING_URI, "IMAGE_DIGEST": train_container_image},
+        labels=distributed_worker_label,
+        volumes=shared_volumes,
+        volume_mounts=shared_volume_mounts_read,
+        in_cluster=True,
+        get_logs=True,
+        do_xcom_push=True,
+        startup_timeout_seconds=300,
+        node_selector=node_selector,
+        tolerations=tolerations,
+        service_account_name="airflow-sa",
+        secrets=[
+            SECRET_AWS_BUCKET,
+            SECRET_AWS_REGION,
+            SECRET_AWS_ACCESS_KEY_ID,
+            SECRET_AWS_SECRET_ACCESS_KEY,
+            SECRET_AWS_ROLE_NAME,
+        ],
+    )
+    def distributed_training_op(
+        mlflow_experiment_id: str, model_params: dict, input: dict, distributed_params: dict, worker_index: int
+    ) -> dict:
+        """
+        Train a model as one worker of a multi-worker cluster.
+
+        Args:
+            mlflow_experiment_id (str): The MLflow experiment ID.
+            model_params (dict): A dictionary containing the model parameters.
+            input (dict): A dictionary containing the input data.
+            distributed_params (dict): A dictionary containing the number of workers, their port and service.
+            worker_index (int): The index of this worker, worker 0 is the chief.
+
+        Returns:
+            dict: A dictionary containing the results of the model training, which are None except on the chief.
+        """
+        import os
+
+        from src.resource_profiling import track_resource_usage
+
+        track_resource_usage("distributed_training_op")
+
+        from src.distributed import train_distributed
+
+        service_domain = f"{distributed_params['service_name']}.airflow.svc.cluster.local"
+        worker_hosts = [
+            f"worker-{index}.{service_domain}:{distributed_params['port']}"
+            for index in range(distributed_params["num_workers"])
+        ]
+        run_id, model_name, model_version, model_stage = train_distributed(
+            mlflow_experiment_id=mlflow_experiment_id,
+            model_class=distributed_params["model_class"],
+            model_params=model_params,
+            aws_bucket=os.getenv("AWS_BUCKET"),
+            import_dict=input,
+            worker_hosts=worker_hosts,
+            worker_index=worker_index,
+        )
+
+        return_dict = {
+            "run_id": run_id,
+            "model_name": model_name,
+            "model_version": model_version,
+            "model_stage": model_stage,
+        }
+        return return_dict
+
+    @task.kubernetes(
+        image=train_container_image,
+        task_id="shadow_evaluation_op",
+        namespace="airflow",
+        container_resources=container_resources("shadow_evaluation_op"),
+        env_vars={"MLFLOW_TRACKING_URI": MLFLOW_TRACKING_URI, **model_cache_env_vars},
+        volumes=shared_volumes + [model_cache_volume],
+        volume_mounts=shared_volume_mounts_read + [model_cache_volume_mount],
+        in_cluster=True,
+        get_logs=True,
+        do_xcom_push=True,
+        startup_timeout_seconds=300,
+        node_selector=node_selector,
+        tolerations=tolerations,
+        service_account_name="airflow-sa",
+        secrets=[
+            SECRET_AWS_BUCKET,
+            SECRET_AWS_REGION,
+            SECRET_AWS_ACCESS_KEY_ID,
+            SECRET_AWS_SECRET_ACCESS_KEY,
+            SECRET_AWS_ROLE_NAME,
+        ],
+    )
+    def shadow_evaluation_op(
+        mlflow_experiment_id: str,
+        input: dict,
+        train_data_basic: dict,
+        train_data_resnet50: dict,
+        train_data_crossval: dict,
+        sagemaker_params: dict,
+        shadow_params: dict,
+    ) -> dict:
+        """
+        Replays the held-out test set against the deployed model and the best trained model concurrently.
+
+        Args:
+            mlflow_experiment_id (str): The MLflow experiment ID.
+            input (dict): A dictionary containing the input data.
+            train_data_basic (dict): A dictionary containing the results of training the basic model.
+            train_data_resnet50 (dict): A dictionary containing the results of training the ResNet50 model.
+            train_data_crossval (dict): A dictionary containing the results of training the CrossVal model.
+            sagemaker_params (dict): A dictionary containing the endpoint name.
+            shadow_params (dict): A dictionary containing the replay settings and thresholds.
+
+        Returns:
+            dict: The shadow report, or None if the shadow evaluation is disabled.
+        """
+        import os
+
+        from src.resource_profiling import track_resource_usage
+
+        track_resource_usage("shadow_evaluation_op")
+
+        if not shadow_params["enabled"]:
+            print("Shadow evaluation is disabled")
+            return None
+
+        from src.shadow_evaluation import run_shadow_evaluation
+
+        compare_dict = {
+            train_data_basic["model_name"]: train_data_basic["run_id"],
+            train_data_resnet50["model_name"]: train_data_resnet50["run_id"],
+            train_data_crossval["model_name"]: train_data_crossval["run_id"],
+        }
+        # the versions registered by the trainings, also if a training was reused from the stage cache
+        model_versions = {
+            train_data_basic["model_name"]: train_data_basic["model_version"],
+            train_data_resnet50["model_name"]: train_data_resnet50["model_version"],
+            train_data_crossval["model_name"]: train_data_crossval["model_version"],
+        }
+        return run_shadow_evaluation(
+            mlflow_experiment_id=mlflow_experiment_id,
+            input_dict=compare_dict,
+            import_dict=input,
+            aws_bucket=os.getenv("AWS_BUCKET"),
+            sagemaker_endpoint_name=sagemaker_params["endpoint_name"],
+            max_requests=shadow_params["max_requests"],
+            concurrency=shadow_params["concurrency"],
+            max_p95_latency_regression=shadow_params["max_p95_latency_regression"],
+            min_agreement=shadow_params["min_agreement"],
+            model_versions=model_versions,
+        )
+
+    @task.kubernetes(
+        image=compare_deploy_container_image,
         task_id="compare_models_op",
         namespace="airflow",
-        env_vars={"MLFLOW_TRACKING_URI": MLFLOW_TRACKING_URI},
+        container_resources=container_resources("compare_models_op"),
+        env_vars={
+            "MLFLOW_TRACKING_URI": MLFLOW_TRACKING_URI,
+            "IMAGE_DIGEST": compare_deploy_container_image,
+            **model_cache_env_vars,
+        },
+        volumes=[model_cache_volume],
+        volume_mounts=[model_cache_volume_mount],
         in_cluster=True,
         get_logs=True,
         do_xcom_push=True,
         startup_timeout_seconds=300,
         service_account_name="airflow-sa",  # Don't need Access Secrets as SA is given
     )
-    def compare_models_op(train_data_basic: dict, train_data_resnet50: dict, train_data_crossval: dict) -> dict:
+    def compare_models_op(
+        mlflow_experiment_id: str,
+        train_data_basic: dict,
+        train_data_resnet50: dict,
+        train_data_crossval: dict,
+        shadow_report: dict = None,
+    ) -> dict:
         """
         Compare trained models.
 
         Args:
+            mlflow_experiment_id (str): The MLflow experiment ID.
             train_data_basic (dict): A dictionary containing the results of training the basic model.
             train_data_resnet50 (dict): A dictionary containing the results of training the ResNet50 model.
             train_data_crossval (dict): A dictionary containing the results of training the CrossVal model.
+            shadow_report (dict, optional): The shadow report of the best model, which may block its promotion.
 
         Returns:
             dict: A dictionary containing the results of the model comparison.
         """
+        from src.resource_profiling import track_resource_usage
+
+        track_resource_usage("compare_models_op")
+
         compare_dict = {
             train_data_basic["model_name"]: train_data_basic["run_id"],
             train_data_resnet50["model_name"]: train_data_resnet50["run_id"],
             train_data_crossval["model_name"]: train_data_crossval["run_id"],
         }
+        # the versions registered by the trainings, also if a training was reused from the stage cache
+        model_versions = {
+            train_data_basic["model_name"]: train_data_basic["model_version"],
+            train_data_resnet50["model_name"]: train_data_resnet50["model_version"],
+            train_data_crossval["model_name"]: train_data_crossval["model_version"],
+        }
 
         print(compare_dict)
         from src.compare_models import compare_models
 
-        serving_model_name, serving_model_uri, serving_model_version = compare_models(input_dict=compare_dict)
+        serving_model_name, serving_model_uri, serving_model_version = compare_models(
+            input_dict=compare_dict,
+            mlflow_experiment_id=mlflow_experiment_id,
+            shadow_report=shadow_report,
+            model_versions=model_versions,
+        )
         return_dict = {
             "serving_model_name": serving_model_name,
             "serving_model_uri": serving_model_uri,
@@ -284,16 +646,21 @@ def cnn_skin_cancer_workflow():
         return return_dict
 
     @task.kubernetes(
-        image=skin_cancer_container_image,
+        image=compare_deploy_container_image,
         task_id="deploy_model_to_sagemaker_op",
         namespace="airflow",
+        container_resources=container_resources("deploy_model_to_sagemaker_op"),
         env_vars={
             "MLFLOW_TRACKING_URI": MLFLOW_TRACKING_URI,
             "ECR_REPOSITORY_NAME": ECR_REPOSITORY_NAME,
             "ECR_SAGEMAKER_IMAGE_TAG": ECR_SAGEMAKER_IMAGE_TAG,
+            **model_cache_env_vars,
         },
+        volumes=[model_cache_volume],
+        volume_mounts=[model_cache_volume_mount],
         in_cluster=True,
         get_logs=True,
+        do_xcom_push=True,
         startup_timeout_seconds=300,
         service_account_name="airflow-sa",
         secrets=[
@@ -302,16 +669,25 @@ def cnn_skin_cancer_workflow():
             SECRET_AWS_ID,
         ],
     )
-    def deploy_model_to_sagemaker_op(serving_model_dict: dict):
+    def deploy_model_to_sagemaker_op(serving_model_dict: dict, sagemaker_params: dict) -> dict:
         """
         Deploys a machine learning model to Amazon SageMaker using the specified parameters.
 
+        The deployment is started without waiting for the endpoint, which is polled by `wait_for_endpoint_op`.
+        It is skipped if the endpoint already serves the model version.
+
         Args:
             serving_model_dict (dict): A dictionary containing information about the model to deploy.
                 It should contain the following keys:
                     - "serving_model_name" (str): The name of the MLflow model to be deployed.
                     - "serving_model_uri" (str): The URI or path to the MLflow model in artifact storage.
                     - "serving_model_version" (str): The version of the MLflow model to deploy.
+            sagemaker_params (dict): A dictionary containing the endpoint name, instance type, instance count,
+                and deployment mode.
+
+        Returns:
+            dict: A dictionary containing the endpoint name, its region, whether a deployment was started, and the
+                endpoint config the endpoint must serve once in service.
 
         Example:
             serving_model_info = {
@@ -319,8 +695,19 @@ def cnn_skin_cancer_workflow():
                 "serving_model_uri": "s3://my-bucket/mlflow/models/my_model",
                 "serving_model_version": "1",
             }
-            deploy_model_to_sagemaker_op(serving_model_info)
+            deploy_model_to_sagemaker_op(serving_model_info, sagemaker_params)
         """
+        import os
+
+        from src.resource_profiling import track_resource_usage
+
+        track_resource_usage("deploy_model_to_sagemaker_op")
+
+        from src.sagemaker_autoscaling import (
+            choose_endpoint_sizing,
+            load_load_test_profile,
+        )
+
         mlflow_model_name, mlflow_model_uri, mlflow_model_version = (
             serving_model_dict["serving_model_name"],
             serving_model_dict["serving_model_uri"],
@@ -331,47 +718,170 @@ def cnn_skin_cancer_workflow():
         print(f"mlflow_model_uri: {mlflow_model_uri}")
         print(f"mlflow_model_version: {mlflow_model_version}")
 
+        autoscaling_params = sagemaker_params["autoscaling"]
+        if autoscaling_params["enabled"]:
+            sizing = choose_endpoint_sizing(
+                profile=load_load_test_profile(),
+                expected_peak_invocations_per_minute=autoscaling_params["expected_peak_invocations_per_minute"],
+                target_utilization=autoscaling_params["target_utilization"],
+                min_instances=autoscaling_params["min_instances"],
+            )
+        else:
+            sizing = {
+                "instance_type": sagemaker_params["instance_type"],
+                "min_instances": sagemaker_params["instance_count"],
+            }
+
         from src.deploy_model_to_sagemaker import deploy_model_to_sagemaker
 
-        result = deploy_model_to_sagemaker(
+        deployed, endpoint_config_name = deploy_model_to_sagemaker(
             mlflow_model_name=mlflow_model_name,
             mlflow_model_uri=mlflow_model_uri,
             mlflow_model_version=mlflow_model_version,
             mlflow_experiment_name="cnn_skin_cancer",
-            sagemaker_endpoint_name="test-cnn-skin-cancer",
-            sagemaker_instance_type="ml.t2.large",
+            sagemaker_endpoint_name=sagemaker_params["endpoint_name"],
+            sagemaker_instance_type=sizing["instance_type"],
+            sagemaker_instance_count=sizing["min_instances"],
+            mode=sagemaker_params["mode"],
+            synchronous=False,
         )
 
-        print(f"Script run successfully: {result}")
+        print(f"Script run successfully: {deployed}, endpoint config {endpoint_config_name}")
+        return_dict = {
+            "endpoint_name": sagemaker_params["endpoint_name"],
+            "region_name": os.getenv("AWS_REGION"),
+            "deployed": deployed,
+            "endpoint_config_name": endpoint_config_name,
+            "sizing": sizing,
+        }
+        return return_dict
+
+    # Deferrable sensor, frees the worker slot while the endpoint is created or updated
+    wait_for_endpoint_op = SageMakerEndpointSensor(
+        task_id="wait_for_endpoint_op",
+        endpoint_name=sagemaker_params["endpoint_name"],
+        region_name="{{ ti.xcom_pull(task_ids='deploy_model_to_sagemaker_op')['region_name'] }}",
+        # a failed update rolls back to the previous config and is in service again, so the config is checked too
+        endpoint_config_name="{{ ti.xcom_pull(task_ids='deploy_model_to_sagemaker_op')['endpoint_config_name'] }}",
+        poke_interval=30,
+        timeout=2400,
+    )
+
+    @task.kubernetes(
+        image=compare_deploy_container_image,
+        task_id="autoscale_endpoint_op",
+        namespace="airflow",
+        container_resources=container_resources("autoscale_endpoint_op"),
+        env_vars={"MLFLOW_TRACKING_URI": MLFLOW_TRACKING_URI},
+        in_cluster=True,
+        get_logs=True,
+        startup_timeout_seconds=300,
+        service_account_name="airflow-sa",
+        secrets=[
+            SECRET_AWS_REGION,
+        ],
+    )
+    def autoscale_endpoint_op(deployment_dict: dict, sagemaker_params: dict):
+        """
+        Attaches the autoscaling policy to the SageMaker endpoint once it is in service.
+
+        Args:
+            deployment_dict (dict): A dictionary containing the endpoint name and the chosen sizing.
+            sagemaker_params (dict): A dictionary containing the autoscaling configuration.
+        """
+        import os
+
+        from src.resource_profiling import track_resource_usage
+
+        track_resource_usage("autoscale_endpoint_op")
+
+        if not sagemaker_params["autoscaling"]["enabled"]:
+            print("Autoscaling is disabled")
+            return
+
+        from src.sagemaker_autoscaling import apply_autoscaling_policy
+
+        sizing = deployment_dict["sizing"]
+        apply_autoscaling_policy(
+            endpoint_name=deployment_dict["endpoint_name"],
+            min_instances=sizing["min_instances"],
+            max_instances=sizing["max_instances"],
+            target_invocations_per_instance=sizing["target_invocations_per_instance"],
+            region_name=os.getenv("AWS_REGION"),
+        )
 
     ################################################################################
     #
     # CREATE PIPELINE
     #
+    mlflow_experiment_id = mlflow_experiment_op(tracking_uri=MLFLOW_TRACKING_URI)
     preprocessed_data = preprocessing_op(
         mlflow_experiment_id=mlflow_experiment_id,
+        preprocessing_params=preprocessing_params,
     )
-    train_data_basic = model_training_op(
+    train_data_basic = model_training_op.override(
+        container_resources=container_resources("model_training_op", Model_Class.Basic.name)
+    )(
         mlflow_experiment_id=mlflow_experiment_id,
         model_class=Model_Class.Basic.name,
         model_params=model_params,
         input=preprocessed_data,
     )
-    train_data_resnet50 = model_training_op(
-        mlflow_experiment_id=mlflow_experiment_id,
-        model_class=Model_Class.ResNet50.name,
-        model_params=model_params,
-        input=preprocessed_data,
-    )
-    train_data_crossval = model_training_op(
+    if distributed_params["enabled"]:
+        # one pod per worker, addressable as worker-<index>.<service_name> through the headless service
+        distributed_workers = [
+            distributed_training_op.override(
+                task_id=f"distributed_training_worker_{index}",
+                full_pod_spec=k8s.V1Pod(
+                    spec=k8s.V1PodSpec(
+                        hostname=f"worker-{index}",
+                        subdomain=distributed_params["service_name"],
+                        containers=[k8s.V1Container(name="base")],
+                    )
+                ),
+            )(
+                mlflow_experiment_id=mlflow_experiment_id,
+                model_params=model_params,
+                input=preprocessed_data,
+                distributed_params=distributed_params,
+                worker_index=index,
+            )
+            for index in range(distributed_params["num_workers"])
+        ]
+        # the chief logs and registers the model
+        train_data_resnet50 = distributed_workers[0]
+    else:
+        train_data_resnet50 = model_training_op.override(
+            container_resources=container_resources("model_training_op", Model_Class.ResNet50.name)
+        )(
+            mlflow_experiment_id=mlflow_experiment_id,
+            model_class=Model_Class.ResNet50.name,
+            model_params=model_params,
+            input=preprocessed_data,
+        )
+    train_data_crossval = model_training_op.override(
+        container_resources=container_resources("model_training_op", Model_Class.CrossVal.name)
+    )(
         mlflow_experiment_id=mlflow_experiment_id,
         model_class=Model_Class.CrossVal.name,
         model_params=model_params,
         input=preprocessed_data,
     )
-    compare_models_dict = compare_models_op(train_data_basic, train_data_resnet50, train_data_crossval)
+    shadow_report = shadow_evaluation_op(
+        mlflow_experiment_id,
+        preprocessed_data,
+        train_data_basic,
+        train_data_resnet50,
+        train_data_crossval,
+        sagemaker_params,
+        shadow_params,
+    )
+    compare_models_dict = compare_models_op(
+        mlflow_experiment_id, train_data_basic, train_data_resnet50, train_data_crossval, shadow_report
+    )
 
-    deploy_model_to_sagemaker_op(compare_models_dict)
+    deployment_dict = deploy_model_to_sagemaker_op(compare_models_dict, sagemaker_params)
+    deployment_dict >> wait_for_endpoint_op >> autoscale_endpoint_op(deployment_dict, sagemaker_params)
 
 
 cnn_skin_cancer_workflow()
@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+
+import numpy as np
+from src.model.augmentation import DEFAULT_AUGMENTATION
+from src.model.sequences import SliceSequence
+from src.model.utils import get_model
+
+# Run within the train image as `python -m benchmarks.augmentation_throughput`
+
+MODEL_PARAMS = {
+    "num_classes": 2,
+    "input_shape": (224, 224, 3),
+    "activation": "relu",
+    "kernel_initializer_glob": "glorot_uniform",
+    "kernel_initializer_norm": "normal",
+    "optimizer": "adam",
+    "loss": "sparse_categorical_crossentropy",
+    "metrics": ["accuracy"],
+    "pooling": "avg",
+}
+
+
+def benchmark_training_throughput(
+    model_class: str, augmentation: dict, num_images: int, batch_size: int, epochs: int = 2
+) -> float:
+    """
+    Measures the training throughput of a model on synthetic uint8 images fed by a SliceSequence.
+
+    The first epoch traces the graph and is not measured.
+
+    Args:
+        model_class (str): The class of the model to train.
+        augmentation (dict): The augmentation params of the model, None for the baseline without augmentation.
+        num_images (int): The number of images per epoch.
+        batch_size (int): The number of images per batch.
+        epochs (int, optional): The number of epochs, including the unmeasured first one. Defaults to 2.
+
+    Returns:
+        float: The examples per second of the measured epochs.
+    """
+    rng = np.random.default_rng(11)
+    X = rng.integers(0, 256, size=(num_images, *MODEL_PARAMS["input_shape"]), dtype=np.uint8)
+    y = rng.integers(0, MODEL_PARAMS["num_classes"], size=num_images, dtype=np.uint8)
+    model = get_model(model_class, {**MODEL_PARAMS, "augmentation": augmentation})
+    sequence = SliceSequence(X, y, [[0, num_images]], batch_size)
+
+    model.fit(sequence, epochs=1, verbose=0)
+    start_time = time.perf_counter()
+    model.fit(sequence, epochs=epochs - 1, verbose=0)
+    return num_images * (epochs - 1) / (time.perf_counter() - start_time)
+
+
+if __name__ == "__main__":
+    model_class = os.getenv("MODEL_CLASS", "Basic")
+    num_images = int(os.getenv("NUM_IMAGES", "1024"))
+    batch_size = int(os.getenv("BATCH_SIZE", "64"))
+    max_overhead = float(os.getenv("AUGMENTATION_MAX_OVERHEAD", "0.15"))
+
+    baseline = benchmark_training_throughput(model_class, None, num_images, batch_size)
+    augmented = benchmark_training_throughput(model_class, DEFAULT_AUGMENTATION, num_images, batch_size)
+    overhead = baseline / augmented - 1.0
+    print(f"{'no augmentation':<20}{baseline:>10.1f} examples/s")
+    print(f"{'augmentation':<20}{augmented:>10.1f} examples/s")
+    print(f"{'overhead':<20}{overhead:>10.1%}")
+
+    if overhead > max_overhead:
+        print(f"Augmentation slows training down by {overhead:.1%} (> {max_overhead:.0%})")
+        sys.exit(1)
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+from src.chunked_dataset import (
+    LocalChunkStore,
+    S3ChunkStore,
+    read_chunked_array,
+    write_chunked_array,
+)
+
+# Run within the train image as `python -m benchmarks.chunked_dataset_read`
+# Set S3_ENDPOINT_URL to a local S3 stand-in, e.g. `moto_server -p 5000` or MinIO, to benchmark range requests
+# against it, its bucket S3_BUCKET is created if missing
+
+
+def _timed(func) -> float:
+    start_time = time.perf_counter()
+    func()
+    return time.perf_counter() - start_time
+
+
+def make_images(num_images: int, seed: int = 11) -> np.array:
+    """
+    Creates synthetic uint8 images, smooth enough to compress like photos.
+
+    Args:
+        num_images (int): The number of images.
+        seed (int, optional): The seed of the images. Defaults to 11.
+
+    Returns:
+        np.array: A uint8 array of shape (num_images, 224, 224, 3).
+    """
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, size=(num_images, 28, 28, 3), dtype=np.uint8)
+    noise = rng.integers(0, 2, size=(num_images, 224, 224, 3), dtype=np.uint8)
+    return coarse.repeat(8, axis=1).repeat(8, axis=2) + noise
+
+
+if __name__ == "__main__":
+    num_images = int(os.getenv("NUM_IMAGES", "2000"))
+    codec = os.getenv("CODEC", "zstd")
+    max_workers = int(os.getenv("MAX_WORKERS", "16"))
+    endpoint_url = os.getenv("S3_ENDPOINT_URL")
+
+    images = make_images(num_images)
+    gigabytes = images.nbytes / 1e9
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        npy_path = os.path.join(tmp_dir, "X.npy")
+        np.save(npy_path, images)
+        results = {"npy from local disk": _timed(lambda: np.load(npy_path))}
+
+        local_store = LocalChunkStore(tmp_dir)
+        write_chunked_array(images, local_store, "X.chunked", codec=codec)
+        results["chunked from local disk"] = _timed(
+            lambda: read_chunked_array(local_store, "X.chunked", max_workers=max_workers)
+        )
+
+        if endpoint_url:
+            import boto3
+            from botocore.config import Config
+
+            s3_bucket = os.getenv("S3_BUCKET", "benchmark")
+            s3_client = boto3.client("s3", endpoint_url=endpoint_url, config=Config(max_pool_connections=max_workers))
+            if s3_bucket not in [bucket["Name"] for bucket in s3_client.list_buckets()["Buckets"]]:
+                s3_client.create_bucket(Bucket=s3_bucket)
+            s3_store = S3ChunkStore(s3_client, s3_bucket)
+            write_chunked_array(images, s3_store, "X.chunked", codec=codec)
+            read_images = read_chunked_array(s3_store, "X.chunked", max_workers=max_workers)
+            assert np.array_equal(read_images, images), "Chunked array read from S3 differs from the written one"
+            results["chunked from S3 stand-in"] = _timed(
+                lambda: read_chunked_array(s3_store, "X.chunked", max_workers=max_workers)
+            )
+
+    for name, seconds in results.items():
+        print(f"{name:<28}{seconds:>8.2f}s{gigabytes / seconds:>8.2f} GB/s")
@@ -0,0 +1,72 @@
+import os
+import subprocess
+import time
+
+# Role images and the module each role imports on startup
+ROLE_IMAGES = {
+    "preprocess": ("seblum/cnn-skin-cancer-model:preprocess", "src.preprocessing"),
+    "train": ("seblum/cnn-skin-cancer-model:train", "src.train"),
+    "compare-deploy": ("seblum/cnn-skin-cancer-model:compare-deploy", "src.compare_models"),
+    "inference-client": ("seblum/cnn-skin-cancer-model:inference-client", "src.inference_to_sagemaker"),
+}
+BASE_IMAGE = "seblum/cnn-skin-cancer-model:latest"
+
+
+def _timed_run(command: list) -> float:
+    """
+    Runs a command and measures its wall-clock time.
+
+    Args:
+        command (list): The command to run.
+
+    Returns:
+        float: The runtime of the command in seconds.
+
+    Raises:
+        subprocess.CalledProcessError: If the command fails.
+    """
+    start_time = time.perf_counter()
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start_time
+
+
+def benchmark_image(image: str, module: str, cold: bool = True) -> dict:
+    """
+    Measures pull time, image size, and time until the role's module is imported in a fresh container.
+
+    Args:
+        image (str): The image to benchmark.
+        module (str): The module the role imports on startup.
+        cold (bool, optional): Whether to remove the local image before pulling it. Defaults to True.
+
+    Returns:
+        dict: A dictionary containing "pull_seconds", "size_mb" and "startup_seconds".
+    """
+    if cold:
+        subprocess.run(["docker", "image", "rm", "--force", image], stdout=subprocess.DEVNULL, check=False)
+    pull_seconds = _timed_run(["docker", "pull", "--quiet", image])
+    size_bytes = subprocess.run(
+        ["docker", "image", "inspect", "--format", "{{.Size}}", image],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+    startup_seconds = _timed_run(["docker", "run", "--rm", image, "python3", "-c", f"import {module}"])
+    return {
+        "pull_seconds": pull_seconds,
+        "size_mb": int(size_bytes) / 1024**2,
+        "startup_seconds": startup_seconds,
+    }
+
+
+if __name__ == "__main__":
+    cold = os.getenv("BENCHMARK_COLD_PULL", "true").lower() == "true"
+
+    print(f"{'role':<18}{'image':<48}{'size [MB]':>10}{'pull [s]':>10}{'startup [s]':>13}")
+    for role, (image, module) in ROLE_IMAGES.items():
+        for benchmarked_image in (BASE_IMAGE, image):
+            result = benchmark_image(image=benchmarked_image, module=module, cold=cold)
+            print(
+                f"{role:<18}{benchmarked_image:<48}{result['size_mb']:>10.0f}"
+                f"{result['pull_seconds']:>10.1f}{result['startup_seconds']:>13.1f}"
+            )
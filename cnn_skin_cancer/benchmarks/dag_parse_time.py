@@ -0,0 +1,88 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+DAG_DIRECTORY = Path(__file__).parent.parent
+DAG_FILES = sorted(DAG_DIRECTORY.glob("airflow_*_DAG.py"))
+PLUGINS_DIRECTORY = DAG_DIRECTORY / "plugins"
+
+# modules that must not be imported when the scheduler parses a DAG file
+HEAVY_MODULES = ["mlflow", "tensorflow", "keras", "sklearn", "boto3", "s3fs", "PIL"]
+
+# Parses a single DAG file in a fresh interpreter, like a scheduler parsing process, with network access disabled.
+# Any attempt to open a network connection during parsing makes the parse fail.
+PARSE_SCRIPT = """
+import json
+import socket
+import sys
+import time
+
+def _no_network(*args, **kwargs):
+    raise RuntimeError(f"DAG parsing attempted network I/O: {args}")
+
+socket.socket.connect = _no_network
+socket.create_connection = _no_network
+
+start_time = time.perf_counter()
+from airflow.models.dagbag import DagBag
+
+dagbag = DagBag(dag_folder=sys.argv[1], include_examples=False, safe_mode=False)
+parse_seconds = time.perf_counter() - start_time
+print(json.dumps({
+    "parse_seconds": parse_seconds,
+    "import_errors": {str(k): str(v) for k, v in dagbag.import_errors.items()},
+    "heavy_modules": [m for m in json.loads(sys.argv[2]) if m in sys.modules],
+}))
+"""
+
+
+def benchmark_dag_file(dag_file: Path) -> dict:
+    """
+    Measures the time a fresh interpreter needs to parse a DAG file, including the import of Airflow.
+
+    The interpreter runs outside of the DAG directory with only the plugins on its path, like the scheduler, so a
+    DAG importing `src` at parse time fails with an import error.
+
+    Args:
+        dag_file (Path): The DAG file to parse.
+
+    Returns:
+        dict: A dictionary containing "parse_seconds", "import_errors" and "heavy_modules".
+
+    Raises:
+        subprocess.CalledProcessError: If the parsing process fails.
+    """
+    env = {**os.environ, "AIRFLOW__CORE__PLUGINS_FOLDER": str(PLUGINS_DIRECTORY)}
+    env.pop("PYTHONPATH", None)
+    with tempfile.TemporaryDirectory() as working_directory:
+        output = subprocess.run(
+            [sys.executable, "-c", PARSE_SCRIPT, str(dag_file), json.dumps(HEAVY_MODULES)],
+            check=True,
+            capture_output=True,
+            text=True,
+            cwd=working_directory,
+            env=env,
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    threshold_seconds = float(os.getenv("DAG_PARSE_THRESHOLD_SECONDS", "5.0"))
+
+    failures = []
+    for dag_file in DAG_FILES:
+        result = benchmark_dag_file(dag_file)
+        print(f"{dag_file.name:<40}{result['parse_seconds']:>8.2f}s")
+        if result["parse_seconds"] > threshold_seconds:
+            failures.append(f"{dag_file.name} took {result['parse_seconds']:.2f}s (> {threshold_seconds}s)")
+        if result["import_errors"]:
+            failures.append(f"{dag_file.name} failed to parse: {result['import_errors']}")
+        if result["heavy_modules"]:
+            failures.append(f"{dag_file.name} imports heavy modules at parse time: {result['heavy_modules']}")
+
+    if failures:
+        print("\n".join(failures))
+        sys.exit(1)
@@ -0,0 +1,37 @@
+import glob
+import os
+import time
+
+from PIL import Image
+from src.inference_to_sagemaker import (
+    get_image_directory,
+    preprocess_image,
+    preprocess_images,
+)
+
+# Run within the inference-client image as `python -m benchmarks.preprocess_images`
+# Decoding runs in threads, so the cost of a batch relative to one image shrinks with the cores of the client
+
+
+if __name__ == "__main__":
+    batch_size = int(os.getenv("BATCH_SIZE", "64"))
+    max_workers = int(os.getenv("MAX_WORKERS", str(os.cpu_count())))
+    repeats = int(os.getenv("REPEATS", "5"))
+
+    filepaths = sorted(glob.glob(f"{get_image_directory()}/*.jpg"))
+    batch_filepaths = [filepaths[index % len(filepaths)] for index in range(batch_size)]
+
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        for filepath in filepaths:
+            preprocess_image(Image.open(filepath))
+    single_seconds = (time.perf_counter() - start_time) / (repeats * len(filepaths))
+
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        preprocess_images(batch_filepaths, max_workers=max_workers)
+    batch_seconds = (time.perf_counter() - start_time) / repeats
+
+    print(f"{'one image':<24}{single_seconds * 1000:>10.2f} ms")
+    print(f"{f'batch of {batch_size}':<24}{batch_seconds * 1000:>10.2f} ms")
+    print(f"{'batch / one image':<24}{batch_seconds / single_seconds:>10.1f}x with {max_workers} threads")
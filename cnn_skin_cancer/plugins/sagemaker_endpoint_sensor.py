@@ -0,0 +1,191 @@
+import asyncio
+from datetime import timedelta
+from typing import Any, AsyncIterator, Tuple
+
+from airflow.exceptions import AirflowException
+from airflow.sensors.base import BaseSensorOperator
+from airflow.triggers.base import BaseTrigger, TriggerEvent
+
+# The sensor is parsed by the scheduler and the trigger is run by the triggerer, neither of which has `src` on its
+# path. The module is therefore shipped as Airflow plugin and imported by its module name, see the README.
+
+# endpoint states from which the endpoint will not become "InService" on its own
+FAILED_STATES = ("Failed", "OutOfService", "RollingBack")
+
+
+def _describe_endpoint(endpoint_name: str, aws_conn_id: str, region_name: str) -> dict:
+    """
+    Describes a SageMaker endpoint using the Airflow AWS connection.
+
+    Args:
+        endpoint_name (str): The name of the SageMaker endpoint.
+        aws_conn_id (str): The Airflow connection ID of the AWS credentials.
+        region_name (str): The AWS region of the endpoint.
+
+    Returns:
+        dict: The description of the endpoint, containing e.g. "EndpointStatus" and "EndpointConfigName".
+    """
+    # imported lazily, so parsing a DAG using the sensor does not import boto3
+    from airflow.providers.amazon.aws.hooks.base_aws import AwsBaseHook
+
+    client = AwsBaseHook(aws_conn_id=aws_conn_id, client_type="sagemaker", region_name=region_name).get_conn()
+    return client.describe_endpoint(EndpointName=endpoint_name)
+
+
+def check_endpoint(endpoint: dict, endpoint_config_name: str = None) -> Tuple[str, str]:
+    """
+    Checks whether an endpoint serves the deployed endpoint config.
+
+    A failed update rolls the endpoint back to its previous config, after which it is "InService" again. An
+    endpoint in service therefore only counts as deployed if it runs the expected endpoint config.
+
+    Args:
+        endpoint (dict): The description of the endpoint, as returned by `describe_endpoint`.
+        endpoint_config_name (str, optional): The endpoint config the endpoint must serve. Defaults to None,
+            in which case any config in service counts as deployed.
+
+    Returns:
+        Tuple[str, str]: "success", "error", or None while the endpoint is being created or updated, and a
+            message describing the state of the endpoint.
+    """
+    status = endpoint["EndpointStatus"]
+    current_config_name = endpoint["EndpointConfigName"]
+    failure_reason = endpoint.get("FailureReason")
+    if status in FAILED_STATES:
+        return "error", f"{status}: {failure_reason}"
+    if status != "InService":
+        return None, status
+    if endpoint_config_name and current_config_name != endpoint_config_name:
+        return "error", (
+            f"in service with endpoint config {current_config_name} instead of {endpoint_config_name}, "
+            f"the update was rolled back: {failure_reason}"
+        )
+    return "success", f"in service with endpoint config {current_config_name}"
+
+
+class SageMakerEndpointTrigger(BaseTrigger):
+    """SageMakerEndpointTrigger polls the status of a SageMaker endpoint in the triggerer until it is in service.
+
+    Args:
+        endpoint_name (str): The name of the SageMaker endpoint.
+        aws_conn_id (str): The Airflow connection ID of the AWS credentials.
+        region_name (str): The AWS region of the endpoint.
+        poke_interval (float): Seconds to wait between two status checks.
+        endpoint_config_name (str, optional): The endpoint config the endpoint must serve. Defaults to None.
+
+    Methods:
+        serialize() -> Tuple[str, dict]:
+            Serializes the trigger to be run by the triggerer.
+
+        run() -> AsyncIterator[TriggerEvent]:
+            Polls the endpoint status and fires once the endpoint is in service or failed.
+    """
+
+    def __init__(
+        self,
+        endpoint_name: str,
+        aws_conn_id: str,
+        region_name: str,
+        poke_interval: float,
+        endpoint_config_name: str = None,
+    ):
+        super().__init__()
+        self.endpoint_name = endpoint_name
+        self.aws_conn_id = aws_conn_id
+        self.region_name = region_name
+        self.poke_interval = poke_interval
+        self.endpoint_config_name = endpoint_config_name
+
+    def serialize(self) -> Tuple[str, dict]:
+        return (
+            "sagemaker_endpoint_sensor.SageMakerEndpointTrigger",
+            {
+                "endpoint_name": self.endpoint_name,
+                "aws_conn_id": self.aws_conn_id,
+                "region_name": self.region_name,
+                "poke_interval": self.poke_interval,
+                "endpoint_config_name": self.endpoint_config_name,
+            },
+        )
+
+    async def run(self) -> AsyncIterator[TriggerEvent]:
+        while True:
+            # boto3 is blocking, so the call runs in a thread to keep the triggerer's event loop free
+            endpoint = await asyncio.to_thread(
+                _describe_endpoint, self.endpoint_name, self.aws_conn_id, self.region_name
+            )
+            status, message = check_endpoint(endpoint, self.endpoint_config_name)
+            self.log.info("Endpoint %s is %s", self.endpoint_name, message)
+            if status is not None:
+                yield TriggerEvent({"status": status, "message": message})
+                return
+            await asyncio.sleep(self.poke_interval)
+
+
+class SageMakerEndpointSensor(BaseSensorOperator):
+    """SageMakerEndpointSensor waits until a SageMaker endpoint is in service with the deployed endpoint config.
+
+    The sensor defers itself to the triggerer, so it does not occupy a worker slot while the endpoint is created
+    or updated.
+
+    Args:
+        endpoint_name (str): The name of the SageMaker endpoint. Templated.
+        region_name (str): The AWS region of the endpoint. Templated.
+        endpoint_config_name (str, optional): The endpoint config the endpoint must serve, e.g. as returned by
+            `deploy_model_to_sagemaker`. Templated. Defaults to None, in which case any config in service passes.
+        aws_conn_id (str, optional): The Airflow connection ID of the AWS credentials. Defaults to "aws_default".
+        poke_interval (float, optional): Seconds to wait between two status checks. Defaults to 30.
+        timeout (float, optional): Seconds to wait for the endpoint before failing. Defaults to 2400.
+
+    Methods:
+        execute(context: Any):
+            Defers to the `SageMakerEndpointTrigger`.
+
+        execute_complete(context: Any, event: dict):
+            Resumes after the trigger fired and fails the task if the endpoint failed or was rolled back.
+    """
+
+    template_fields = ("endpoint_name", "region_name", "endpoint_config_name")
+
+    def __init__(
+        self,
+        endpoint_name: str,
+        region_name: str,
+        endpoint_config_name: str = None,
+        aws_conn_id: str = "aws_default",
+        poke_interval: float = 30,
+        timeout: float = 2400,
+        **kwargs,
+    ):
+        super().__init__(poke_interval=poke_interval, timeout=timeout, **kwargs)
+        self.endpoint_name = endpoint_name
+        self.region_name = region_name
+        self.endpoint_config_name = endpoint_config_name
+        self.aws_conn_id = aws_conn_id
+
+    def poke(self, context: Any) -> bool:
+        endpoint = _describe_endpoint(self.endpoint_name, self.aws_conn_id, self.region_name)
+        status, message = check_endpoint(endpoint, self.endpoint_config_name)
+        if status == "error":
+            raise AirflowException(f"Endpoint {self.endpoint_name} is {message}")
+        return status == "success"
+
+    def execute(self, context: Any):
+        if self.poke(context):
+            return
+        self.defer(
+            trigger=SageMakerEndpointTrigger(
+                endpoint_name=self.endpoint_name,
+                aws_conn_id=self.aws_conn_id,
+                region_name=self.region_name,
+                poke_interval=self.poke_interval,
+                endpoint_config_name=self.endpoint_config_name,
+            ),
+            method_name="execute_complete",
+            timeout=timedelta(seconds=self.timeout),
+        )
+
+    def execute_complete(self, context: Any, event: dict):
+        if event["status"] != "success":
+            raise AirflowException(f"Endpoint {self.endpoint_name} is {event['message']}")
+        self.log.info("Endpoint %s is %s", self.endpoint_name, event["message"])
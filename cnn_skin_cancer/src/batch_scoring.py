@@ -0,0 +1,143 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Iterator, List
+
+import mlflow
+import numpy as np
+import pandas as pd
+from src.model_cache import ModelCache
+from src.utils import AWSSession, timeit
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def iter_chunks(items: list, chunk_size: int) -> Iterator[list]:
+    """
+    Splits a list into consecutive chunks.
+
+    Args:
+        items (list): The list to split.
+        chunk_size (int): The maximum number of items per chunk.
+
+    Returns:
+        Iterator[list]: The chunks in order.
+    """
+    for start in range(0, len(items), chunk_size):
+        yield items[start : start + chunk_size]
+
+
+def predict_in_batches(predict_fn: Callable, images: List[np.array], batch_size: int = 256) -> np.array:
+    """
+    Predicts a list of images in large batches.
+
+    Args:
+        predict_fn (Callable): The predict function of the pyfunc model, accepting uint8 batches.
+        images (List[np.array]): The images as uint8 arrays of the same shape.
+        batch_size (int, optional): The number of images per call of the predict function. Defaults to 256.
+
+    Returns:
+        np.array: The predicted class probabilities of shape (N, num_classes).
+    """
+    predictions = [np.asarray(predict_fn(np.stack(batch))) for batch in iter_chunks(images, batch_size)]
+    return np.concatenate(predictions, axis=0)
+
+
+@timeit
+def batch_score(
+    model_name: str,
+    aws_bucket: str,
+    input_prefix: str,
+    output_prefix: str,
+    model_stage: str = "Staging",
+    chunk_size: int = 4096,
+    batch_size: int = 256,
+    max_workers: int = 16,
+) -> dict:
+    """
+    Scores all images below an S3 prefix with a registered model and writes the predictions as chunked Parquet.
+
+    The images are streamed chunk by chunk, and the next chunk is downloaded by the parallel loader while the
+    current chunk is predicted. Downloading and predicting overlap, and the memory use is bounded by two chunks.
+    Every chunk is written to its own Parquet file.
+
+    Args:
+        model_name (str): The name of the registered model.
+        aws_bucket (str): The AWS S3 bucket name for data storage.
+        input_prefix (str): The S3 prefix of the images to score, relative to the bucket.
+        output_prefix (str): The S3 prefix to write the predictions to, relative to the bucket.
+        model_stage (str, optional): The stage of the model to score with. Defaults to "Staging".
+        chunk_size (int, optional): The number of images per Parquet file. Defaults to 4096.
+        batch_size (int, optional): The number of images per call of the model. Defaults to 256.
+        max_workers (int, optional): The number of concurrent downloads. Defaults to 16.
+
+    Returns:
+        dict: A dictionary containing the model version, the number of scored images, and the output paths.
+
+    Raises:
+        None
+    """
+    mlflow_tracking_uri = os.getenv("MLFLOW_TRACKING_URI")
+    mlflow.set_tracking_uri(mlflow_tracking_uri)
+
+    # The version is resolved once, so all chunks are scored by the same model even if the stage moves on
+    client = mlflow.MlflowClient()
+    model_version = client.get_latest_versions(name=model_name, stages=[model_stage])[0].version
+    print(f"\n> Loading model {model_name} version {model_version}...")
+    predict_fn = ModelCache().load_pyfunc(model_name, model_version).predict
+
+    aws_session = AWSSession()
+    aws_session.set_sessions()
+    imnames = [
+        name
+        for name in aws_session.get_data_manifest(f"{aws_bucket}/{input_prefix}")
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+    chunks = list(iter_chunks(imnames, chunk_size))
+    print(f"Scoring {len(imnames)} images in {len(chunks)} chunks")
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    path_output = f"{output_prefix}/{model_name}/{model_version}/{timestamp}"
+    output_paths = []
+    # one client is shared by the download threads of all chunks
+    s3_client = aws_session.get_s3_client(max_pool_connections=max_workers)
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        if chunks:
+            next_images = prefetcher.submit(
+                aws_session.read_images_from_s3, aws_bucket, chunks[0], max_workers, s3_client
+            )
+        for chunk_index, chunk in enumerate(chunks):
+            images = next_images.result()
+            if chunk_index + 1 < len(chunks):
+                next_images = prefetcher.submit(
+                    aws_session.read_images_from_s3, aws_bucket, chunks[chunk_index + 1], max_workers, s3_client
+                )
+
+            probabilities = predict_in_batches(predict_fn, images, batch_size=batch_size)
+            predictions = pd.DataFrame(
+                probabilities, columns=[f"probability_{label}" for label in range(probabilities.shape[1])]
+            )
+            predictions.insert(0, "predicted_class", np.argmax(probabilities, axis=1).astype(np.uint8))
+            predictions.insert(0, "image", [imname.split(f"{aws_bucket}/", 1)[1] for imname in chunk])
+
+            file_key = f"{path_output}/part-{chunk_index:05d}.parquet"
+            aws_session.upload_parquet_to_s3(predictions, s3_bucket=aws_bucket, file_key=file_key)
+            output_paths.append(file_key)
+            print(f"Chunk {chunk_index + 1}/{len(chunks)} written to {file_key}")
+
+    return {
+        "model_name": model_name,
+        "model_version": model_version,
+        "num_images": len(imnames),
+        "output_paths": output_paths,
+    }
+
+
+if __name__ == "__main__":
+    batch_score(
+        model_name=os.getenv("MODEL_NAME"),
+        aws_bucket=os.getenv("AWS_BUCKET"),
+        input_prefix=os.getenv("INPUT_PREFIX"),
+        output_prefix=os.getenv("OUTPUT_PREFIX", "predictions"),
+        model_stage=os.getenv("MODEL_STAGE", "Staging"),
+    )
@@ -0,0 +1,408 @@
+import json
+import os
+import shutil
+import tempfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Tuple
+
+import numpy as np
+
+# suffix of the file keys of chunked arrays, e.g. "preprocessed/<fingerprint>/X_train.chunked"
+CHUNKED_SUFFIX = ".chunked"
+INDEX_NAME = "index.json"
+DATA_NAME = "data.bin"
+FORMAT_VERSION = 1
+
+
+def get_codec(name: str) -> Tuple[str, Callable[[bytes], bytes], Callable[[bytes, int], bytes]]:
+    """
+    Get the compression and decompression functions of a codec.
+
+    zstd and lz4 are optional dependencies, installed in the preprocess and train images. zlib is part of the
+    standard library. All three release the GIL, so chunks are (de)compressed in parallel threads.
+
+    Args:
+        name (str): The codec, "zstd", "lz4", or "zlib".
+
+    Returns:
+        Tuple[str, Callable, Callable]: The name of the codec, a function compressing bytes, and a function
+            decompressing bytes given the size of the raw bytes.
+
+    Raises:
+        ValueError: If the codec is unknown.
+        ImportError: If the package of the codec is not installed.
+    """
+    if name == "zstd":
+        try:
+            import zstandard
+        except ImportError as error:
+            raise ImportError("The codec zstd requires zstandard, install it or use codec zlib") from error
+
+        return (
+            "zstd",
+            lambda raw: zstandard.ZstdCompressor(level=3).compress(raw),
+            lambda data, raw_size: zstandard.ZstdDecompressor().decompress(data, max_output_size=raw_size),
+        )
+    if name == "lz4":
+        try:
+            import lz4.frame
+        except ImportError as error:
+            raise ImportError("The codec lz4 requires lz4, install it or use codec zlib") from error
+
+        return "lz4", lz4.frame.compress, lambda data, raw_size: lz4.frame.decompress(data)
+    if name != "zlib":
+        raise ValueError(f"Unknown codec {name}")
+    return "zlib", lambda raw: zlib.compress(raw, 1), lambda data, raw_size: zlib.decompress(data, bufsize=raw_size)
+
+
+class LocalChunkStore:
+    """LocalChunkStore stores chunked arrays in a local directory, e.g. a shared volume or for tests.
+
+    Args:
+        root_dir (str): The directory the keys are relative to.
+
+    Methods:
+        put_file(key: str, path: str):
+            Stores a local file under a key.
+
+        get(key: str) -> bytes:
+            Returns the content of a key.
+
+        get_range(key: str, start: int, end: int) -> bytes:
+            Returns the bytes [start, end) of a key.
+
+        exists(key: str) -> bool:
+            Returns whether a key exists.
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root_dir, key)
+
+    def put_file(self, key: str, path: str):
+        os.makedirs(os.path.dirname(self._path(key)), exist_ok=True)
+        shutil.copyfile(path, f"{self._path(key)}.tmp")
+        os.replace(f"{self._path(key)}.tmp", self._path(key))
+
+    def get(self, key: str) -> bytes:
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def get_range(self, key: str, start: int, end: int) -> bytes:
+        with open(self._path(key), "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+
+class S3ChunkStore:
+    """S3ChunkStore stores chunked arrays in an S3 bucket and reads chunks with HTTP range requests.
+
+    Any S3-compatible endpoint works, e.g. a local stand-in such as MinIO or moto for tests, by passing a client
+    created with its `endpoint_url`.
+
+    Args:
+        s3_client (botocore.client.S3): The S3 client. Its connection pool should allow as many connections as
+            chunks are read in parallel.
+        s3_bucket (str): The name of the S3 bucket.
+
+    Methods:
+        put_file(key: str, path: str):
+            Uploads a local file under a key, in parallel multipart uploads for large files.
+
+        get(key: str) -> bytes:
+            Returns the content of a key.
+
+        get_range(key: str, start: int, end: int) -> bytes:
+            Returns the bytes [start, end) of a key.
+
+        exists(key: str) -> bool:
+            Returns whether a key exists.
+    """
+
+    def __init__(self, s3_client, s3_bucket: str):
+        self.s3_client = s3_client
+        self.s3_bucket = s3_bucket
+
+    def put_file(self, key: str, path: str):
+        self.s3_client.upload_file(path, self.s3_bucket, key)
+
+    def get(self, key: str) -> bytes:
+        return self.s3_client.get_object(Bucket=self.s3_bucket, Key=key)["Body"].read()
+
+    def get_range(self, key: str, start: int, end: int) -> bytes:
+        # the end of an HTTP range is inclusive
+        response = self.s3_client.get_object(Bucket=self.s3_bucket, Key=key, Range=f"bytes={start}-{end - 1}")
+        return response["Body"].read()
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.s3_client.head_object(Bucket=self.s3_bucket, Key=key)
+            return True
+        except ClientError:
+            return False
+
+
+class ChunkedArrayWriter:
+    """ChunkedArrayWriter writes rows appended in batches of any size as fixed-size compressed chunks.
+
+    Appended rows are buffered until a chunk is full. Chunks are compressed in parallel threads and appended to a
+    local temporary file in order, which is uploaded on `close`, so the memory use is bounded by a few chunks
+    independent of the number of rows. The index holds the byte range and checksum of every chunk and is written
+    last, so readers never see a partially written array.
+
+    Args:
+        store (LocalChunkStore | S3ChunkStore): The store to write to.
+        file_key (str): The key of the chunked array, e.g. "preprocessed/X_train.chunked".
+        row_shape (Tuple[int, ...]): The shape of a row, e.g. (224, 224, 3) for images.
+        dtype (np.dtype): The dtype of the array.
+        chunk_bytes (int, optional): The approximate uncompressed size of a chunk. Defaults to 8 MiB.
+        codec (str, optional): The compression codec, "zstd", "lz4", or "zlib". Defaults to "zstd".
+        max_workers (int, optional): The number of threads compressing chunks. Defaults to 8.
+
+    Attributes:
+        num_rows (int): The number of rows appended so far.
+
+    Methods:
+        append(rows: np.array):
+            Appends rows.
+
+        close() -> dict:
+            Writes the remaining rows, uploads the data and the index, and returns the index.
+    """
+
+    def __init__(
+        self,
+        store,
+        file_key: str,
+        row_shape: Tuple[int, ...],
+        dtype: np.dtype,
+        chunk_bytes: int = 8 * 1024 * 1024,
+        codec: str = "zstd",
+        max_workers: int = 8,
+    ):
+        self.store = store
+        self.file_key = file_key
+        self.row_shape = tuple(row_shape)
+        self.dtype = np.dtype(dtype)
+        self.codec, self.__compress, _ = get_codec(codec)
+        self.max_workers = max_workers
+        row_bytes = max(1, int(np.prod(self.row_shape, dtype=np.int64)) * self.dtype.itemsize)
+        self.rows_per_chunk = max(1, chunk_bytes // row_bytes)
+        self.num_rows = 0
+        self.__chunks = []
+        self.__offset = 0
+        self.__written_rows = 0
+        self.__buffer = np.empty((self.rows_per_chunk, *self.row_shape), dtype=self.dtype)
+        self.__buffered_rows = 0
+        self.__pending = deque()
+        self.__data_file = tempfile.NamedTemporaryFile(suffix=DATA_NAME)
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _compress(self, chunk: np.array) -> Tuple[int, int, bytes]:
+        return len(chunk), chunk.nbytes, self.__compress(chunk.data)
+
+    def _write_compressed(self, num_rows: int, raw_size: int, compressed: bytes):
+        self.__data_file.write(compressed)
+        self.__chunks.append(
+            {
+                "start_row": self.__written_rows,
+                "num_rows": num_rows,
+                "offset": self.__offset,
+                "size": len(compressed),
+                "raw_size": raw_size,
+                "crc32": zlib.crc32(compressed),
+            }
+        )
+        self.__offset += len(compressed)
+        self.__written_rows += num_rows
+
+    def _submit(self, chunk: np.array):
+        # at most two chunks per thread are in flight, so the memory use does not grow with the array
+        self.__pending.append(self.__executor.submit(self._compress, chunk))
+        while self.__pending and (len(self.__pending) >= 2 * self.max_workers or self.__pending[0].done()):
+            self._write_compressed(*self.__pending.popleft().result())
+
+    def append(self, rows: np.array):
+        """
+        Appends rows.
+
+        Args:
+            rows (np.array): The rows of shape (N, *row_shape).
+
+        Raises:
+            ValueError: If the rows do not match the row shape.
+        """
+        if tuple(rows.shape[1:]) != self.row_shape:
+            raise ValueError(f"Rows of shape {rows.shape[1:]} do not match the row shape {self.row_shape}")
+        self.num_rows += len(rows)
+        start = 0
+        while start < len(rows):
+            num_copied = min(self.rows_per_chunk - self.__buffered_rows, len(rows) - start)
+            self.__buffer[self.__buffered_rows : self.__buffered_rows + num_copied] = rows[start : start + num_copied]
+            self.__buffered_rows += num_copied
+            start += num_copied
+            if self.__buffered_rows == self.rows_per_chunk:
+                # the buffer is handed to the compression thread, the next rows go into a new one
+                self._submit(self.__buffer)
+                self.__buffer = np.empty_like(self.__buffer)
+                self.__buffered_rows = 0
+
+    def close(self) -> dict:
+        """
+        Writes the remaining rows, uploads the data and the index, and returns the index.
+
+        Returns:
+            dict: The index of the chunked array.
+        """
+        if self.__buffered_rows:
+            self._submit(self.__buffer[: self.__buffered_rows].copy())
+        while self.__pending:
+            self._write_compressed(*self.__pending.popleft().result())
+        self.__executor.shutdown()
+        self.__data_file.flush()
+        self.store.put_file(f"{self.file_key}/{DATA_NAME}", self.__data_file.name)
+        self.__data_file.close()
+
+        index = {
+            "format_version": FORMAT_VERSION,
+            "dtype": self.dtype.str,
+            "shape": [self.num_rows, *self.row_shape],
+            "rows_per_chunk": self.rows_per_chunk,
+            "codec": self.codec,
+            "chunks": self.__chunks,
+        }
+        with tempfile.NamedTemporaryFile("w", suffix=INDEX_NAME) as index_file:
+            json.dump(index, index_file)
+            index_file.flush()
+            self.store.put_file(f"{self.file_key}/{INDEX_NAME}", index_file.name)
+        raw_bytes = self.num_rows * int(np.prod(self.row_shape, dtype=np.int64)) * self.dtype.itemsize
+        print(
+            f"Wrote {len(self.__chunks)} {self.codec} chunks of {self.file_key}, "
+            f"{raw_bytes / max(self.__offset, 1):.2f}x compression"
+        )
+        return index
+
+
+def write_chunked_array(
+    data: np.array,
+    store,
+    file_key: str,
+    chunk_bytes: int = 8 * 1024 * 1024,
+    codec: str = "zstd",
+    max_workers: int = 8,
+) -> dict:
+    """
+    Writes an array as fixed-size compressed chunks of rows into a single data object with an index.
+
+    Args:
+        data (np.array): The array to write, chunked along the first axis. Can be memory-mapped.
+        store (LocalChunkStore | S3ChunkStore): The store to write to.
+        file_key (str): The key of the chunked array, e.g. "preprocessed/X_train.chunked".
+        chunk_bytes (int, optional): The approximate uncompressed size of a chunk. Defaults to 8 MiB.
+        codec (str, optional): The compression codec, "zstd", "lz4", or "zlib". Defaults to "zstd".
+        max_workers (int, optional): The number of threads compressing chunks. Defaults to 8.
+
+    Returns:
+        dict: The index of the chunked array.
+    """
+    writer = ChunkedArrayWriter(store, file_key, data.shape[1:], data.dtype, chunk_bytes, codec, max_workers)
+    for start in range(0, len(data), writer.rows_per_chunk):
+        writer.append(data[start : start + writer.rows_per_chunk])
+    return writer.close()
+
+
+def read_chunked_index(store, file_key: str) -> dict:
+    """
+    Reads the index of a chunked array.
+
+    Args:
+        store (LocalChunkStore | S3ChunkStore): The store to read from.
+        file_key (str): The key of the chunked array.
+
+    Returns:
+        dict: The index of the chunked array.
+    """
+    return json.loads(store.get(f"{file_key}/{INDEX_NAME}"))
+
+
+def read_chunked_array(
+    store,
+    file_key: str,
+    rows: Tuple[int, int] = None,
+    max_workers: int = 16,
+    out: np.array = None,
+) -> np.array:
+    """
+    Reads a chunked array, or a range of its rows, into a preallocated buffer.
+
+    Every chunk is fetched with its own range request and decompressed straight into its rows of the buffer,
+    all in parallel threads. Only the chunks overlapping the requested rows are fetched.
+
+    Args:
+        store (LocalChunkStore | S3ChunkStore): The store to read from.
+        file_key (str): The key of the chunked array.
+        rows (Tuple[int, int], optional): The [start, end) rows to read. Defaults to None, i.e. all rows.
+        max_workers (int, optional): The number of chunks fetched and decompressed in parallel. Defaults to 16.
+        out (np.array, optional): A C-contiguous buffer of the shape and dtype of the rows to read into, e.g. a
+            memory map on local disk. Defaults to None, i.e. a new array.
+
+    Returns:
+        np.array: The array or its rows.
+
+    Raises:
+        ImportError: If the codec of the array is not installed.
+        IOError: If a chunk is corrupt.
+    """
+    index = read_chunked_index(store, file_key)
+    shape, dtype = tuple(index["shape"]), np.dtype(index["dtype"])
+    start_row, end_row = rows or (0, shape[0])
+    if out is None:
+        out = np.empty((end_row - start_row, *shape[1:]), dtype=dtype)
+    _, _, decompress = get_codec(index["codec"])
+
+    row_bytes = int(np.prod(shape[1:], dtype=np.int64)) * dtype.itemsize
+    out_bytes = out.reshape(-1).view(np.uint8)
+    data_key = f"{file_key}/{DATA_NAME}"
+
+    def _read_chunk(chunk: dict):
+        compressed = store.get_range(data_key, chunk["offset"], chunk["offset"] + chunk["size"])
+        if zlib.crc32(compressed) != chunk["crc32"]:
+            raise IOError(f"Chunk at row {chunk['start_row']} of {file_key} is corrupt")
+        raw = np.frombuffer(decompress(compressed, chunk["raw_size"]), dtype=np.uint8)
+        # copy only the rows of the chunk within the requested range
+        first_row = max(chunk["start_row"], start_row)
+        last_row = min(chunk["start_row"] + chunk["num_rows"], end_row)
+        source = raw[(first_row - chunk["start_row"]) * row_bytes : (last_row - chunk["start_row"]) * row_bytes]
+        out_bytes[(first_row - start_row) * row_bytes : (last_row - start_row) * row_bytes] = source
+
+    chunks = [
+        chunk
+        for chunk in index["chunks"]
+        if chunk["start_row"] < end_row and chunk["start_row"] + chunk["num_rows"] > start_row
+    ]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # consuming the results raises the first error of a chunk
+        list(executor.map(_read_chunk, chunks))
+    return out
+
+
+def is_chunked(file_key: str) -> bool:
+    """
+    Tells whether a file key denotes a chunked array.
+
+    Args:
+        file_key (str): The key of the array.
+
+    Returns:
+        bool: True if the key ends with the chunked suffix.
+    """
+    return file_key.endswith(CHUNKED_SUFFIX)
@@ -1,45 +1,202 @@
 import os
+from datetime import datetime
 from typing import Tuple
 
 import mlflow
+from src.model_cache import ModelCache
+from src.stage_cache import compute_fingerprint, lookup_stage_cache, record_stage_cache
 
 
-def compare_models(input_dict: dict, metric: str = "prediction_accuracy") -> Tuple[str, str, int]:
+def compare_models(
+    input_dict: dict,
+    metric: str = "prediction_accuracy",
+    mlflow_experiment_id: str = None,
+    use_cache: bool = True,
+    shadow_report: dict = None,
+    model_versions: dict = None,
+) -> Tuple[str, str, int]:
     """
     Compares a given set of MLflow models based on their logged metric. The model with the best metric will be
     transferred to a "Staging" stage within the MLflow Registry.
 
+    If a shadow report of the best model is given and the model did not pass the shadow evaluation, the promotion
+    is blocked and the baseline model of the report is returned instead.
+
+    If an experiment ID is given, the comparison is logged as a run and fingerprinted by the compared run IDs and
+    versions and the outcome of the shadow evaluation. A previous comparison of the same runs is then reused
+    without touching the registry again.
+
     Args:
         input_dict (dict): A dictionary containing the names and run IDs of the MLflow models to compare.
         metric (str, optional): The metric to compare the models. Defaults to "prediction_accuracy".
+        mlflow_experiment_id (str, optional): The MLflow experiment ID to log the comparison to. Defaults to None.
+        use_cache (bool, optional): Whether to reuse the result of a previous comparison of the same runs.
+            Defaults to True.
+        shadow_report (dict, optional): The result of `shadow_evaluate` for the best model. Defaults to None.
+        model_versions (dict, optional): The registered version per model name, as returned by the training.
+            Defaults to None, in which case the version registered from the run of the best model is used.
 
     Returns:
         Tuple[str, str, int]: A tuple containing the name of the best performing model, its MLflow URI,
                               and the version of the model.
 
     Raises:
-        None
+        ValueError: If the best model has no registered version.
     """
 
     mlflow_tracking_uri = os.getenv("MLFLOW_TRACKING_URI")
     mlflow.set_tracking_uri(mlflow_tracking_uri)
 
-    client = mlflow.MlflowClient(tracking_uri=mlflow_tracking_uri)
+    if mlflow_experiment_id is None:
+        return _compare_models(
+            input_dict=input_dict,
+            metric=metric,
+            tracking_uri=mlflow_tracking_uri,
+            shadow_report=shadow_report,
+            model_versions=model_versions,
+        )
+
+    # the shadow report also holds the measured latencies, which differ on every run and would never hit the cache
+    shadow_outcome = None
+    if shadow_report is not None:
+        shadow_outcome = {
+            key: shadow_report.get(key)
+            for key in [
+                "passed",
+                "candidate_model_name",
+                "candidate_model_version",
+                "baseline_model_name",
+                "baseline_model_version",
+            ]
+        }
+    fingerprint = compute_fingerprint(
+        stage="compare",
+        input_dict=input_dict,
+        metric=metric,
+        model_versions=model_versions,
+        shadow_outcome=shadow_outcome,
+    )
+    if use_cache:
+        cached_outputs = lookup_stage_cache(mlflow_experiment_id, stage="compare", fingerprint=fingerprint)
+        if cached_outputs is not None:
+            return (
+                cached_outputs["serving_model_name"],
+                cached_outputs["serving_model_uri"],
+                cached_outputs["serving_model_version"],
+            )
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    with mlflow.start_run(experiment_id=mlflow_experiment_id, run_name=f"{timestamp}_Compare"):
+        serving_model_name, serving_model_uri, serving_model_version = _compare_models(
+            input_dict=input_dict,
+            metric=metric,
+            tracking_uri=mlflow_tracking_uri,
+            shadow_report=shadow_report,
+            model_versions=model_versions,
+        )
+        record_stage_cache(
+            stage="compare",
+            fingerprint=fingerprint,
+            outputs={
+                "serving_model_name": serving_model_name,
+                "serving_model_uri": serving_model_uri,
+                "serving_model_version": serving_model_version,
+            },
+        )
+
+    return serving_model_name, serving_model_uri, serving_model_version
+
+
+def select_best_model(
+    input_dict: dict, metric: str = "prediction_accuracy", tracking_uri: str = None, model_versions: dict = None
+) -> Tuple[str, int]:
+    """
+    Selects the best model by the given metric without changing the MLflow Registry.
+
+    The version is the one registered from the compared run, not the latest unstaged version of the model. A run
+    reused from the stage cache registers no new version, and earlier versions may have left the stage "None".
+
+    Args:
+        input_dict (dict): A dictionary containing the names and run IDs of the MLflow models to compare.
+        metric (str, optional): The metric to compare the models. Defaults to "prediction_accuracy".
+        tracking_uri (str, optional): The URI of the MLflow tracking server. Defaults to None.
+        model_versions (dict, optional): The registered version per model name, as returned by the training.
+            Defaults to None, in which case the version registered from the run of the best model is looked up.
+
+    Returns:
+        Tuple[str, int]: A tuple containing the name and the registered version of the best model.
+
+    Raises:
+        ValueError: If the run of the best model has no registered version.
+    """
+    client = mlflow.MlflowClient(tracking_uri=tracking_uri)
+    model_cache = ModelCache()
 
     all_results = {}
     for key, value in input_dict.items():
-        # extract params/metrics data for run `test_run_id` in a single dict
-        model_results_data_dict = client.get_run(value).data.to_dictionary()
+        # extract params/metrics data for run `test_run_id` in a single dict, finished runs are cached locally
+        model_results_data_dict = model_cache.get_run_data(value)
         # get params and metrics for this run (test_run_id)
         model_results_accuracy = model_results_data_dict["metrics"][metric]
         all_results[key] = model_results_accuracy
 
     # Get model with maximum accuracy
     serving_model_name = max(all_results, key=all_results.get)
-    serving_model_version = client.get_latest_versions(name=serving_model_name, stages=["None"])[0].version
+    serving_model_version = (model_versions or {}).get(serving_model_name)
+    if serving_model_version is None:
+        run_id = input_dict[serving_model_name]
+        registered_versions = [
+            model_version
+            for model_version in client.search_model_versions(f"run_id = '{run_id}'")
+            if model_version.name == serving_model_name
+        ]
+        if not registered_versions:
+            raise ValueError(f"Run {run_id} of {serving_model_name} has no registered model version")
+        serving_model_version = max(registered_versions, key=lambda model_version: int(model_version.version)).version
     print(f"acc_dict: {all_results}")
     print(f"acc_dict_model: {serving_model_name}")
-    print(f"latest_model_version: {serving_model_version}")
+    print(f"model_version: {serving_model_version}")
+    return serving_model_name, serving_model_version
+
+
+def _compare_models(
+    input_dict: dict, metric: str, tracking_uri: str, shadow_report: dict = None, model_versions: dict = None
+) -> Tuple[str, str, int]:
+    """
+    Selects the best model by the given metric and transitions it to "Staging", unless it failed the shadow
+    evaluation.
+
+    Args:
+        input_dict (dict): A dictionary containing the names and run IDs of the MLflow models to compare.
+        metric (str): The metric to compare the models.
+        tracking_uri (str): The URI of the MLflow tracking server.
+        shadow_report (dict, optional): The result of `shadow_evaluate` for the best model. Defaults to None.
+        model_versions (dict, optional): The registered version per model name. Defaults to None.
+
+    Returns:
+        Tuple[str, str, int]: A tuple containing the name of the best performing model, its MLflow URI,
+                              and the version of the model.
+    """
+    client = mlflow.MlflowClient(tracking_uri=tracking_uri)
+    serving_model_name, serving_model_version = select_best_model(input_dict, metric, tracking_uri, model_versions)
+
+    if (
+        shadow_report is not None
+        and not shadow_report["passed"]
+        and shadow_report["candidate_model_name"] == serving_model_name
+        and str(shadow_report["candidate_model_version"]) == str(serving_model_version)
+    ):
+        baseline_model_name = shadow_report["baseline_model_name"]
+        baseline_model_version = shadow_report["baseline_model_version"]
+        print(
+            f"Promotion of {serving_model_name} version {serving_model_version} blocked by shadow evaluation: "
+            f"{shadow_report['reasons']}, keeping {baseline_model_name} version {baseline_model_version}"
+        )
+        return (
+            baseline_model_name,
+            f"models:/{baseline_model_name}/{baseline_model_version}",
+            baseline_model_version,
+        )
 
     # Transition model to stage "Staging"
     model_stage = "Staging"
@@ -0,0 +1,143 @@
+import hashlib
+from collections import defaultdict
+from typing import List
+
+import numpy as np
+
+# weights of the RGB channels for the conversion to grayscale (ITU-R 601)
+GRAYSCALE_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def dhash_batch(images: np.array, hash_size: int = 8, chunk_size: int = 1024) -> np.array:
+    """
+    Computes the 64-bit difference hash (dHash) of a batch of images, vectorized over the batch.
+
+    Each image is converted to grayscale and area-averaged to (hash_size, hash_size + 1) pixels. Every bit of the
+    hash tells whether a pixel is brighter than its right neighbour, which is robust to rescaling, recompression,
+    and small changes in brightness.
+
+    Args:
+        images (np.array): A uint8 array of shape (N, H, W, 3).
+        hash_size (int, optional): The number of rows of the hash, which has hash_size ** 2 bits. Defaults to 8.
+        chunk_size (int, optional): The number of images converted to float at once. Defaults to 1024.
+
+    Returns:
+        np.array: A uint64 array of shape (N,) holding the hashes.
+    """
+    height, width = images.shape[1:3]
+    row_starts = np.linspace(0, height, hash_size + 1).astype(int)[:-1]
+    col_starts = np.linspace(0, width, hash_size + 2).astype(int)[:-1]
+    row_counts = np.diff(np.append(row_starts, height))
+    col_counts = np.diff(np.append(col_starts, width))
+    bit_weights = np.uint64(1) << np.arange(hash_size * hash_size, dtype=np.uint64)
+
+    hashes = np.empty(len(images), dtype=np.uint64)
+    for start in range(0, len(images), chunk_size):
+        gray = images[start : start + chunk_size].astype(np.float32) @ GRAYSCALE_WEIGHTS
+        # area averaging over uneven bins, as reduceat sums the pixels between the bin starts
+        small = np.add.reduceat(np.add.reduceat(gray, row_starts, axis=1), col_starts, axis=2)
+        small /= row_counts[:, None] * col_counts[None, :]
+        bits = (small[:, :, 1:] > small[:, :, :-1]).reshape(len(small), -1).astype(np.uint64)
+        hashes[start : start + chunk_size] = (bits * bit_weights).sum(axis=1, dtype=np.uint64)
+    return hashes
+
+
+class HammingIndex:
+    """HammingIndex finds hashes within a Hamming distance using multi-index hashing.
+
+    The 64-bit hashes are split into `max_distance + 1` bands. By the pigeonhole principle two hashes within
+    `max_distance` agree exactly on at least one band, so only hashes sharing a band are compared. Lookups stay
+    close to constant time for millions of hashes, instead of comparing against every hash.
+
+    Args:
+        max_distance (int, optional): The maximum Hamming distance of a match. Defaults to 3.
+        hash_bits (int, optional): The number of bits of the hashes. Defaults to 64.
+
+    Methods:
+        add(hash_value: int, item_id: int):
+            Adds a hash to the index.
+
+        query(hash_value: int) -> List[int]:
+            Returns the IDs of all hashes within the maximum distance.
+    """
+
+    def __init__(self, max_distance: int = 3, hash_bits: int = 64):
+        self.max_distance = max_distance
+        num_bands = max_distance + 1
+        band_starts = np.linspace(0, hash_bits, num_bands + 1).astype(int).tolist()
+        self.__bands = [(start, (1 << (end - start)) - 1) for start, end in zip(band_starts[:-1], band_starts[1:])]
+        self.__tables = [defaultdict(list) for _ in self.__bands]
+        self.__hashes = {}
+
+    def __len__(self) -> int:
+        return len(self.__hashes)
+
+    def add(self, hash_value: int, item_id: int):
+        hash_value = int(hash_value)
+        self.__hashes[item_id] = hash_value
+        for (shift, mask), table in zip(self.__bands, self.__tables):
+            table[(hash_value >> shift) & mask].append(item_id)
+
+    def query(self, hash_value: int) -> List[int]:
+        hash_value = int(hash_value)
+        candidates = set()
+        for (shift, mask), table in zip(self.__bands, self.__tables):
+            candidates.update(table.get((hash_value >> shift) & mask, ()))
+        return [
+            item_id
+            for item_id in candidates
+            if bin(self.__hashes[item_id] ^ hash_value).count("1") <= self.max_distance
+        ]
+
+
+class DuplicateFilter:
+    """DuplicateFilter detects exact and near duplicates among all images it has seen.
+
+    Exact duplicates are detected by a digest of the pixels, near duplicates by the dHash within a Hamming
+    distance.
+
+    Args:
+        max_distance (int, optional): The maximum Hamming distance of the dHashes of near duplicates.
+            Defaults to 3.
+
+    Attributes:
+        num_exact_duplicates (int): The number of exact duplicates found so far.
+        num_near_duplicates (int): The number of near duplicates found so far.
+
+    Methods:
+        find_duplicates(images: np.array, insert: bool = True) -> np.array:
+            Flags the images duplicating an image seen before, or an earlier image of the batch.
+    """
+
+    def __init__(self, max_distance: int = 3):
+        self.num_exact_duplicates = 0
+        self.num_near_duplicates = 0
+        self.__index = HammingIndex(max_distance=max_distance)
+        self.__digests = set()
+
+    def find_duplicates(self, images: np.array, insert: bool = True) -> np.array:
+        """
+        Flags the images duplicating an image seen before, or an earlier image of the batch.
+
+        Args:
+            images (np.array): A uint8 array of shape (N, H, W, 3).
+            insert (bool, optional): Whether to remember the unique images, so later calls are compared against
+                them. Set to False to only check for overlap. Defaults to True.
+
+        Returns:
+            np.array: A boolean mask of shape (N,), which is True for duplicates.
+        """
+        hashes = dhash_batch(images)
+        is_duplicate = np.zeros(len(images), dtype=bool)
+        for index, (image, hash_value) in enumerate(zip(images, hashes)):
+            digest = hashlib.blake2b(image.tobytes(), digest_size=16).digest()
+            if digest in self.__digests:
+                is_duplicate[index] = True
+                self.num_exact_duplicates += 1
+            elif self.__index.query(hash_value):
+                is_duplicate[index] = True
+                self.num_near_duplicates += 1
+            elif insert:
+                self.__digests.add(digest)
+                self.__index.add(hash_value, len(self.__index))
+        return is_duplicate
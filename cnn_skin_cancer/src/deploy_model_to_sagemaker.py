@@ -1,7 +1,58 @@
 import os
+from typing import Tuple
 
+import boto3
 import mlflow
 import mlflow.sagemaker
+from src.model_cache import ModelCache
+from src.sagemaker_autoscaling import remove_autoscaling
+
+# tags on the endpoint config, identifying the MLflow model an endpoint serves
+TAG_MODEL_NAME = "mlflow_model_name"
+TAG_MODEL_VERSION = "mlflow_model_version"
+
+
+def get_deployed_model(sagemaker_endpoint_name: str, region_name: str, sage_client=None) -> dict:
+    """
+    Retrieves the MLflow model served by a SageMaker endpoint from the tags of its active endpoint config.
+
+    The tags are read from the endpoint config and not from the endpoint itself, as a failed update rolls an
+    endpoint back to its previous config.
+
+    Args:
+        sagemaker_endpoint_name (str): The name of the SageMaker endpoint.
+        region_name (str): The AWS region of the endpoint.
+        sage_client (optional): A boto3 SageMaker client. Defaults to None, in which case a client is created.
+
+    Returns:
+        dict: A dictionary containing "status", "endpoint_config_name", "model_name" and "model_version", or None
+              if the endpoint does not exist.
+
+    Raises:
+        botocore.exceptions.ClientError: If the endpoint could not be described for another reason than not
+            existing, e.g. throttling or missing permissions.
+    """
+    sage_client = sage_client or boto3.client("sagemaker", region_name=region_name)
+    try:
+        endpoint_description = sage_client.describe_endpoint(EndpointName=sagemaker_endpoint_name)
+    except sage_client.exceptions.ClientError as error:
+        # SageMaker has no dedicated error for a missing endpoint, any other error must not be taken as missing
+        error_code = error.response.get("Error", {}).get("Code")
+        error_message = error.response.get("Error", {}).get("Message", "")
+        if error_code == "ValidationException" and "Could not find endpoint" in error_message:
+            return None
+        raise
+
+    endpoint_config_arn = sage_client.describe_endpoint_config(
+        EndpointConfigName=endpoint_description["EndpointConfigName"]
+    )["EndpointConfigArn"]
+    tags = {tag["Key"]: tag["Value"] for tag in sage_client.list_tags(ResourceArn=endpoint_config_arn)["Tags"]}
+    return {
+        "status": endpoint_description["EndpointStatus"],
+        "endpoint_config_name": endpoint_description["EndpointConfigName"],
+        "model_name": tags.get(TAG_MODEL_NAME),
+        "model_version": tags.get(TAG_MODEL_VERSION),
+    }
 
 
 def deploy_model_to_sagemaker(
@@ -11,11 +62,18 @@ def deploy_model_to_sagemaker(
     mlflow_model_version: int,
     sagemaker_endpoint_name: str,
     sagemaker_instance_type: str,
-) -> bool:
+    sagemaker_instance_count: int = 1,
+    mode: str = "auto",
+    synchronous: bool = False,
+    timeout_seconds: int = 2400,
+) -> Tuple[bool, str]:
     """
     Deploy a machine learning model to AWS SageMaker from MLflow.
 
     This function deploys an MLflow model to an AWS SageMaker endpoint using the specified configuration.
+    If the endpoint is in service and already serves the given model version, the deployment is skipped.
+    By default, the deployment is started asynchronously and the endpoint status has to be polled afterwards,
+    e.g. by the `SageMakerEndpointSensor` of the plugin `plugins/sagemaker_endpoint_sensor.py`.
 
     Args:
         mlflow_model_name (str): The name of the MLflow model to deploy.
@@ -24,9 +82,15 @@ def deploy_model_to_sagemaker(
         mlflow_model_version (int): The version of the MLflow model to deploy.
         sagemaker_endpoint_name (str): The desired name for the SageMaker endpoint.
         sagemaker_instance_type (str): The SageMaker instance type for deployment.
+        sagemaker_instance_count (int, optional): The number of instances to deploy. Defaults to 1.
+        mode (str, optional): One of "create", "replace", "add", or "auto". "auto" replaces the model of an
+            existing endpoint in place and creates the endpoint otherwise. Defaults to "auto".
+        synchronous (bool, optional): Whether to block until the endpoint is in service. Defaults to False.
+        timeout_seconds (int, optional): Timeout of a synchronous deployment. Defaults to 2400.
 
     Returns:
-        bool: True if the task was completed successfully, otherwise False.
+        Tuple[bool, str]: Whether a deployment was started, False if it was skipped as the model version is already
+            deployed, and the name of the endpoint config serving the model version once the endpoint is in service.
     """
     # Retrieve AWS and MLflow environment variables
     AWS_ID = os.getenv("AWS_ID")
@@ -74,7 +138,7 @@ def deploy_model_to_sagemaker(
         execution_role_arn = f"arn:aws:iam::{aws_id}:role/{access_role_name}"
         return execution_role_arn
 
-    def _get_mlflow_parameters(experiment_name: str, model_name: str, model_version: int) -> (str, str, str):
+    def _get_mlflow_parameters(experiment_name: str, model_name: str, model_version: int) -> str:
         """
         Retrieve MLflow model parameters.
 
@@ -84,22 +148,37 @@ def deploy_model_to_sagemaker(
             model_version (int): Version of the MLflow model.
 
         Returns:
-            Tuple[str, str]: The model URI and source.
+            str: The model source, which is the pyfunc model including its image preprocessing.
         """
-        client = mlflow.MlflowClient()
-        model_version_details = client.get_model_version(
-            name=model_name,
-            version=model_version,
-        )
+        # a registered version never changes, so its details are cached locally
+        model_version_details = ModelCache().get_model_version(model_name, model_version)
 
         # This is for local
         # experiment_id = dict(mlflow.get_experiment_by_name(experiment_name))["experiment_id"]
         # run_id = model_version_details.run_id
         # model_uri = f"mlruns/{experiment_id}/{run_id}/artifacts/{model_name}"
-        model_source = model_version_details.source
-        model_source_adapted = f"{model_source.removesuffix(model_name)}model"
-
-        return model_source, model_source_adapted
+        model_source = model_version_details["source"]
+
+        return model_source
+
+    sage_client = boto3.client("sagemaker", region_name=AWS_REGION)
+    deployed_model = get_deployed_model(sagemaker_endpoint_name, region_name=AWS_REGION, sage_client=sage_client)
+    print(f"deployed_model: {deployed_model}")
+    if (
+        deployed_model is not None
+        and deployed_model["status"] == "InService"
+        and deployed_model["model_name"] == mlflow_model_name
+        and deployed_model["model_version"] == str(mlflow_model_version)
+    ):
+        print(f"Model {mlflow_model_name} version {mlflow_model_version} is already deployed, skipping deployment")
+        return False, deployed_model["endpoint_config_name"]
+
+    if mode == "auto":
+        mode = "create" if deployed_model is None else "replace"
+    print(f"deployment mode: {mode}")
+    if mode == "replace":
+        # Replacing the variant fails while it is registered with Application Auto Scaling
+        remove_autoscaling(sagemaker_endpoint_name, region_name=AWS_REGION, sage_client=sage_client)
 
     image_url = _build_image_url(
         aws_id=AWS_ID,
@@ -108,7 +187,7 @@ def deploy_model_to_sagemaker(
         ecr_sagemaker_image_tag=ECR_SAGEMAKER_IMAGE_TAG,
     )
     execution_role_arn = _build_execution_role_arn(aws_id=AWS_ID, access_role_name=AWS_ACCESS_ROLE_NAME_SAGEMAKER)
-    model_source, model_source_adapted = _get_mlflow_parameters(
+    model_source = _get_mlflow_parameters(
         experiment_name=mlflow_experiment_name,
         model_name=mlflow_model_name,
         model_version=mlflow_model_version,
@@ -116,17 +195,34 @@ def deploy_model_to_sagemaker(
 
     print(f"model_source: {model_source}")
     print(f"mlflow_model_uri: {mlflow_model_uri}")
-    print(f"model_source_adapted: {model_source_adapted}")
 
     mlflow.sagemaker._deploy(
-        mode="create",
+        mode=mode,
         app_name=sagemaker_endpoint_name,
-        model_uri=model_source_adapted,
+        model_uri=model_source,
         image_url=image_url,
         execution_role_arn=execution_role_arn,
         instance_type=sagemaker_instance_type,
-        instance_count=1,
+        instance_count=sagemaker_instance_count,
         region_name=AWS_REGION,
-        timeout_seconds=2400,
+        synchronous=synchronous,
+        timeout_seconds=timeout_seconds,
+    )
+
+    # Tag the endpoint config created by this deployment with the model it serves. While an update is in progress,
+    # the endpoint still reports its previous config and the new one is pending
+    endpoint_description = sage_client.describe_endpoint(EndpointName=sagemaker_endpoint_name)
+    endpoint_config_name = endpoint_description.get("PendingDeploymentSummary", {}).get(
+        "EndpointConfigName", endpoint_description["EndpointConfigName"]
+    )
+    endpoint_config_arn = sage_client.describe_endpoint_config(EndpointConfigName=endpoint_config_name)[
+        "EndpointConfigArn"
+    ]
+    sage_client.add_tags(
+        ResourceArn=endpoint_config_arn,
+        Tags=[
+            {"Key": TAG_MODEL_NAME, "Value": mlflow_model_name},
+            {"Key": TAG_MODEL_VERSION, "Value": str(mlflow_model_version)},
+        ],
     )
-    return True
+    return True, endpoint_config_name
@@ -0,0 +1,411 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import List, Tuple
+
+import mlflow
+import numpy as np
+from keras.callbacks import Callback
+from src.model.sequences import SliceSequence
+from src.model.utils import Model_Class, get_model
+from src.train import (
+    load_training_data,
+    log_pyfunc_model,
+    log_test_metrics,
+    resolve_class_balancing,
+)
+
+
+def build_tf_config(worker_hosts: List[str], worker_index: int) -> dict:
+    """
+    Builds the TF_CONFIG of a worker of a multi-worker cluster.
+
+    Args:
+        worker_hosts (List[str]): The "host:port" addresses of all workers, in the same order on every worker.
+        worker_index (int): The index of this worker in `worker_hosts`. Worker 0 is the chief.
+
+    Returns:
+        dict: The TF_CONFIG, to be set as JSON in the environment before the strategy is created.
+    """
+    return {"cluster": {"worker": list(worker_hosts)}, "task": {"type": "worker", "index": worker_index}}
+
+
+def worker_hosts_from_env() -> Tuple[List[str], int]:
+    """
+    Reads the cluster of a worker from the environment variables WORKER_HOSTS and WORKER_INDEX.
+
+    Returns:
+        Tuple[List[str], int]: The addresses of all workers and the index of this worker.
+    """
+    worker_hosts = [host.strip() for host in os.getenv("WORKER_HOSTS", "").split(",") if host.strip()]
+    return worker_hosts, int(os.getenv("WORKER_INDEX", "0"))
+
+
+def shard_ranges(ranges: List[list], num_workers: int, worker_index: int) -> List[list]:
+    """
+    Splits row ranges into one contiguous shard per worker.
+
+    Every range is split into `num_workers` parts of nearly equal size, so each worker reads its own rows and
+    reads from a memory map stay sequential.
+
+    Args:
+        ranges (List[list]): The [start, end) row ranges to split.
+        num_workers (int): The number of workers.
+        worker_index (int): The index of the worker.
+
+    Returns:
+        List[list]: The [start, end) row ranges of the worker.
+    """
+    shard = []
+    for start, end in ranges:
+        bounds = np.linspace(start, end, num_workers + 1).astype(int).tolist()
+        if bounds[worker_index] < bounds[worker_index + 1]:
+            shard.append([bounds[worker_index], bounds[worker_index + 1]])
+    return shard
+
+
+def _num_rows(ranges: List[list]) -> int:
+    return sum(end - start for start, end in ranges)
+
+
+def make_shard_dataset(
+    X: np.array,
+    y: np.array,
+    ranges: List[list],
+    batch_size: int,
+    shuffle: bool = True,
+    seed: int = 11,
+    class_balanced: bool = False,
+):
+    """
+    Creates an endless tf.data dataset of the batches of a worker's shard.
+
+    Auto-sharding is switched off, as the shard is already selected by its row ranges. The dataset repeats, so
+    all workers run the same number of steps per epoch even if their shards differ by a few rows.
+
+    Keras takes every batch of a worker's dataset as global batch and splits it across the replicas of all
+    workers, so a worker consumes `batch_size / num_workers` rows of its shard per step.
+
+    Args:
+        X (np.array): The images, e.g. memory-mapped from the shared volume.
+        y (np.array): The labels.
+        ranges (List[list]): The [start, end) row ranges of the shard.
+        batch_size (int): The global batch size, i.e. the number of rows of all workers per step.
+        shuffle (bool, optional): Whether to visit the rows in a new random order every epoch. Defaults to True.
+        seed (int, optional): The seed of the row order. Defaults to 11.
+        class_balanced (bool, optional): Whether to sample all classes equally often. Defaults to False.
+
+    Returns:
+        tf.data.Dataset: The batches of the shard.
+    """
+    import tensorflow as tf
+
+    sequence = SliceSequence(X, y, ranges, batch_size, shuffle=shuffle, seed=seed, class_balanced=class_balanced)
+
+    def _generator():
+        while True:
+            for index in range(len(sequence)):
+                yield sequence[index]
+            sequence.on_epoch_end()
+
+    # uint8 images are scaled to float32 by the sequence
+    image_dtype = tf.float32 if X.dtype == np.uint8 else tf.as_dtype(X.dtype)
+    dataset = tf.data.Dataset.from_generator(
+        _generator,
+        output_signature=(
+            tf.TensorSpec(shape=(None, *X.shape[1:]), dtype=image_dtype),
+            tf.TensorSpec(shape=(None, *y.shape[1:]), dtype=tf.as_dtype(y.dtype)),
+        ),
+    )
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+    return dataset.with_options(options).prefetch(tf.data.AUTOTUNE)
+
+
+class ThroughputCallback(Callback):
+    """ThroughputCallback measures the training throughput of all workers together.
+
+    The first epoch includes graph tracing and the setup of the collectives, so it is only counted if it is the
+    only epoch.
+
+    Args:
+        examples_per_epoch (int): The number of examples all workers process per epoch.
+
+    Attributes:
+        examples_per_second (float): The throughput after training, None before.
+    """
+
+    def __init__(self, examples_per_epoch: int):
+        super(ThroughputCallback, self).__init__()
+        self.examples_per_epoch = examples_per_epoch
+        self.examples_per_second = None
+        self.__epoch_seconds = []
+        self.__epoch_start = None
+
+    def on_epoch_begin(self, epoch: int, logs: dict = None):
+        self.__epoch_start = time.perf_counter()
+
+    def on_epoch_end(self, epoch: int, logs: dict = None):
+        self.__epoch_seconds.append(time.perf_counter() - self.__epoch_start)
+
+    def on_train_end(self, logs: dict = None):
+        epoch_seconds = self.__epoch_seconds[1:] or self.__epoch_seconds
+        if epoch_seconds:
+            self.examples_per_second = self.examples_per_epoch * len(epoch_seconds) / sum(epoch_seconds)
+
+
+def _single_worker_throughput(mlflow_experiment_id: str, model_class: str, batch_size: int) -> float:
+    """
+    Get the throughput of the latest single-worker run of a model, the baseline of the scaling efficiency.
+
+    Args:
+        mlflow_experiment_id (str): The MLflow experiment ID to search in.
+        model_class (str): The class of the model.
+        batch_size (int): The batch size per worker.
+
+    Returns:
+        float: The examples per second of the baseline, or None if there is no baseline run.
+    """
+    runs = mlflow.search_runs(
+        experiment_ids=[mlflow_experiment_id],
+        filter_string=(
+            f"tags.distributed_num_workers = '1' and tags.distributed_model_class = '{model_class}' "
+            f"and params.batch_size = '{batch_size}' and attributes.status = 'FINISHED'"
+        ),
+        order_by=["attributes.start_time DESC"],
+        max_results=1,
+        output_format="list",
+    )
+    if not runs:
+        return None
+    return runs[0].data.metrics.get("examples_per_second")
+
+
+def train_distributed(
+    mlflow_experiment_id: str,
+    model_class: str,
+    model_params: dict,
+    aws_bucket: str,
+    import_dict: dict,
+    worker_hosts: List[str],
+    worker_index: int,
+    run_tags: dict = None,
+    register_model: bool = True,
+) -> Tuple[str, str, int, str]:
+    """
+    Trains a model data-parallel on several CPU workers with `tf.distribute.MultiWorkerMirroredStrategy`.
+
+    Every worker runs this function with the same cluster and its own index. Each worker reads its own shard of
+    the train and validation rows in batches of the batch size, gradients are all-reduced after every step, so
+    the global batch size is the batch size times the number of workers. Only the chief, worker 0, logs to MLflow and registers the model.
+
+    The throughput of all workers is logged as "examples_per_second", and the "scaling_efficiency" compares it
+    to the latest single-worker run of the same model and batch size. Both are logged at the number of workers
+    as step.
+
+    Args:
+        mlflow_experiment_id (str): The ID of the MLflow experiment to log the results.
+        model_class (str): The class of the model to train. CrossVal is not supported.
+        model_params (dict): A dictionary containing the parameters for the model.
+        aws_bucket (str): The AWS S3 bucket name for data storage.
+        import_dict (dict): A dictionary containing paths for importing data, as passed to `train_model`.
+        worker_hosts (List[str]): The "host:port" addresses of all workers.
+        worker_index (int): The index of this worker in `worker_hosts`.
+        run_tags (dict, optional): Tags to set on the MLflow run. Defaults to None.
+        register_model (bool, optional): Whether to register the model in the MLflow Registry. Defaults to True.
+
+    Returns:
+        Tuple[str, str, int, str]: A tuple containing the run ID, model name, model version, and current stage.
+            All are None on workers other than the chief.
+
+    Raises:
+        ValueError: If the model class is CrossVal.
+    """
+    if model_class == Model_Class.CrossVal.value:
+        raise ValueError("CrossVal trains one model per fold and is not supported by distributed training")
+
+    # TF_CONFIG has to be set before the strategy is created, and the strategy before any other TensorFlow op
+    os.environ["TF_CONFIG"] = json.dumps(build_tf_config(worker_hosts, worker_index))
+    import tensorflow as tf
+
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    num_workers = len(worker_hosts)
+    is_chief = worker_index == 0
+    print(f"\n> Worker {worker_index} of {num_workers}, {strategy.num_replicas_in_sync} replicas in sync")
+
+    mlflow.set_tracking_uri(os.getenv("MLFLOW_TRACKING_URI"))
+
+    print("\n> Loading data...")
+    X_train, y_train, X_test, y_test, split_index = load_training_data(import_dict, aws_bucket, model_params)
+    batch_size = model_params.get("batch_size")
+    class_names = split_index.get("class_names") or [str(label) for label in range(model_params.get("num_classes"))]
+    model_params = {**model_params, "num_classes": len(class_names)}
+    class_balanced, class_weight = resolve_class_balancing(model_params, split_index, y_train)
+
+    # the datasets are batched at the global batch size, which Keras splits into the batch size per worker
+    global_batch_size = batch_size * num_workers
+    # every worker runs the same number of steps, bounded by the smallest shard
+    train_shards = [shard_ranges([split_index["train"]], num_workers, index) for index in range(num_workers)]
+    validation_shards = [shard_ranges([split_index["validation"]], num_workers, index) for index in range(num_workers)]
+    steps_per_epoch = max(1, min(_num_rows(shard) for shard in train_shards) // batch_size)
+    validation_steps = max(1, min(_num_rows(shard) for shard in validation_shards) // batch_size)
+
+    train_dataset = make_shard_dataset(
+        X_train,
+        y_train,
+        train_shards[worker_index],
+        global_batch_size,
+        seed=split_index["seed"] + worker_index,
+        class_balanced=class_balanced,
+    )
+    validation_dataset = make_shard_dataset(
+        X_train, y_train, validation_shards[worker_index], global_batch_size, shuffle=False
+    )
+
+    with strategy.scope():
+        model = get_model(model_class, model_params)
+
+    throughput = ThroughputCallback(examples_per_epoch=steps_per_epoch * global_batch_size)
+    print("\n> Training model...")
+    history = model.fit(
+        train_dataset,
+        steps_per_epoch=steps_per_epoch,
+        class_weight=class_weight,
+        validation_data=validation_dataset,
+        validation_steps=validation_steps,
+        epochs=model_params.get("epochs"),
+        verbose=model_params.get("verbose") if is_chief else 0,
+        callbacks=[throughput],
+    )
+    print(f"Throughput of {num_workers} workers: {throughput.examples_per_second:.1f} examples/s")
+
+    if not is_chief:
+        # saving runs collective ops, so every worker saves, the other workers to a directory that is discarded
+        model.predict(SliceSequence(X_test, y_test, [[0, len(X_test)]], batch_size, shuffle=False), verbose=0)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            model.save(os.path.join(tmp_dir, "keras_model"))
+        return None, None, None, None
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    run_name = f"{timestamp}-{model_class}-{num_workers}workers"
+    with mlflow.start_run(experiment_id=mlflow_experiment_id, run_name=run_name) as run:
+        mlflow.log_params(model_params)
+        mlflow.log_params({"split_seed": split_index["seed"], "num_workers": num_workers})
+        mlflow.set_tags(
+            {"distributed_num_workers": str(num_workers), "distributed_model_class": model_class, **(run_tags or {})}
+        )
+        for metric, values in history.history.items():
+            for epoch, value in enumerate(values):
+                mlflow.log_metric(metric, value, step=epoch)
+
+        examples_per_second = throughput.examples_per_second
+        mlflow.log_metric("examples_per_second", examples_per_second, step=num_workers)
+        baseline = examples_per_second if num_workers == 1 else None
+        if baseline is None:
+            baseline = _single_worker_throughput(mlflow_experiment_id, model_class, batch_size)
+        if baseline:
+            scaling_efficiency = examples_per_second / (num_workers * baseline)
+            mlflow.log_metric("scaling_efficiency", scaling_efficiency, step=num_workers)
+            print(f"Scaling efficiency of {num_workers} workers: {scaling_efficiency:.2%}")
+        else:
+            print("No single-worker run found, scaling efficiency is not logged")
+
+        print("\n> Testing model...")
+        log_test_metrics(model, X_test, y_test, class_names, batch_size=batch_size)
+
+        print("\n> Logging pyfunc model...")
+        log_pyfunc_model(model, model_class, input_shape=model_params.get("input_shape"))
+
+        run_id = run.info.run_id
+        if register_model:
+            print("\n> Register model...")
+            mv = mlflow.register_model(f"runs:/{run_id}/{model_class}", model_class)
+            return run_id, mv.name, mv.version, mv.current_stage
+    return run_id, model_class, None, None
+
+
+def launch_local_workers(worker_counts: List[int], base_port: int = 12345) -> None:
+    """
+    Runs distributed training with several processes on one machine, once per number of workers.
+
+    Each worker is started as `python -m src.distributed` with its WORKER_HOSTS and WORKER_INDEX. The cores are
+    divided among the workers, so the runs measure the scaling of the collectives rather than oversubscription.
+    The worker counts run in ascending order, so a single-worker count run first provides the baseline of the
+    scaling efficiency.
+
+    Args:
+        worker_counts (List[int]): The numbers of workers to run, e.g. [1, 2, 4].
+        base_port (int, optional): The port of the first worker, the others use the following ports.
+            Defaults to 12345.
+
+    Raises:
+        RuntimeError: If a worker fails.
+    """
+    for num_workers in sorted(worker_counts):
+        worker_hosts = [f"localhost:{base_port + index}" for index in range(num_workers)]
+        threads_per_worker = str(max(1, (os.cpu_count() or 1) // num_workers))
+        print(f"\n> Starting {num_workers} local workers...")
+        processes = [
+            subprocess.Popen(
+                [sys.executable, "-m", "src.distributed"],
+                env={
+                    **os.environ,
+                    "WORKER_HOSTS": ",".join(worker_hosts),
+                    "WORKER_INDEX": str(index),
+                    "TF_NUM_INTRAOP_THREADS": threads_per_worker,
+                    "TF_NUM_INTEROP_THREADS": "2",
+                },
+            )
+            for index in range(num_workers)
+        ]
+        return_codes = [process.wait() for process in processes]
+        if any(return_codes):
+            raise RuntimeError(f"Local workers failed with return codes {return_codes}")
+
+
+if __name__ == "__main__":
+    # without WORKER_HOSTS, local workers are launched for every count of LOCAL_WORKER_COUNTS
+    worker_hosts, worker_index = worker_hosts_from_env()
+    if not worker_hosts:
+        launch_local_workers([int(count) for count in os.getenv("LOCAL_WORKER_COUNTS", "1,2").split(",")])
+        sys.exit(0)
+
+    # deleted afterwards
+    model_params = {
+        "num_classes": 2,
+        "input_shape": (224, 224, 3),
+        "activation": "relu",
+        "kernel_initializer_glob": "glorot_uniform",
+        "kernel_initializer_norm": "normal",
+        "optimizer": "adam",
+        "loss": "sparse_categorical_crossentropy",
+        "metrics": ["accuracy"],
+        "validation_split": 0.2,
+        "epochs": 2,
+        "batch_size": 64,
+        "learning_rate": 1e-5,
+        "pooling": "avg",  # needed for resnet50
+        "verbose": 2,
+        "class_balancing": "resample",
+        "augmentation": {
+            "flip": "horizontal_and_vertical",
+            "rotation": 0.1,
+            "crop_fraction": 0.9,
+            "brightness": 0.1,
+            "contrast": 0.1,
+        },
+    }
+
+    train_distributed(
+        mlflow_experiment_id=os.getenv("MLFLOW_EXPERIMENT_ID"),
+        model_class=Model_Class[os.getenv("MODEL_CLASS", "ResNet50")].value,
+        model_params=model_params,
+        aws_bucket=os.getenv("AWS_BUCKET"),
+        import_dict=json.loads(os.getenv("IMPORT_DICT", "{}")),
+        worker_hosts=worker_hosts,
+        worker_index=worker_index,
+    )
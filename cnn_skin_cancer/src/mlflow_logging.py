@@ -0,0 +1,266 @@
+import fcntl
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import List
+
+import mlflow
+from mlflow.entities import Metric, Param, RunTag
+
+# limits of a single log_batch request of the MLflow REST API
+MAX_METRICS_PER_BATCH = 1000
+MAX_PARAMS_PER_BATCH = 100
+MAX_TAGS_PER_BATCH = 100
+# seconds between two retries of the spool while closing
+REPLAY_INTERVAL_SECONDS = 5
+# lock file serializing spooling and replays of all loggers sharing a spool directory
+SPOOL_LOCK_NAME = ".lock"
+
+
+class AsyncMlflowLogger:
+    """AsyncMlflowLogger logs metrics, params, and tags of a run in batches from a background thread.
+
+    Logging only appends to an in-memory buffer and never waits for the tracking server. The background thread
+    sends the buffer with `log_batch` whenever `flush` is called, e.g. at the end of an epoch, or after
+    `flush_interval_seconds` at the latest. If the tracking server is unreachable, the batch is appended to a
+    spool file on disk instead, which is sent once the server responds again, also by later loggers sharing the
+    spool directory. The spool directory has to outlive the pod, e.g. a mounted volume set as MLFLOW_SPOOL_DIR, for
+    later loggers to send what a pod could not.
+
+    Args:
+        run_id (str): The ID of the MLflow run to log to.
+        flush_interval_seconds (float, optional): The maximum time entries are buffered. Defaults to 10.
+        spool_dir (str, optional): The directory of the spool files. Defaults to the environment variable
+            MLFLOW_SPOOL_DIR or a directory in the temporary directory, which does not outlive the pod.
+        tracking_uri (str, optional): The URI of the MLflow tracking server. Defaults to the current one.
+
+    Attributes:
+        num_logged (int): The number of entries sent to the tracking server.
+        num_spooled (int): The number of entries written to the spool while the server was unreachable.
+
+    Methods:
+        log_metric(key: str, value: float, step: int = 0):
+            Buffers a metric.
+
+        log_metrics(metrics: dict, step: int = 0):
+            Buffers several metrics at the same step.
+
+        log_params(params: dict):
+            Buffers params.
+
+        set_tags(tags: dict):
+            Buffers tags.
+
+        flush(wait: bool = False, timeout: float = None):
+            Asks the background thread to send the buffer, optionally waiting until it is sent or spooled.
+
+        close(timeout: float = 30):
+            Sends the remaining entries and stops the background thread, raising if entries remain unsent.
+    """
+
+    def __init__(
+        self,
+        run_id: str,
+        flush_interval_seconds: float = 10,
+        spool_dir: str = None,
+        tracking_uri: str = None,
+    ):
+        self.run_id = run_id
+        self.flush_interval_seconds = flush_interval_seconds
+        self.spool_dir = spool_dir or os.getenv("MLFLOW_SPOOL_DIR") or os.path.join(tempfile.gettempdir(), "mlflow")
+        self.num_logged = 0
+        self.num_spooled = 0
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.__client = mlflow.MlflowClient(tracking_uri=tracking_uri)
+        self.__buffer = {"metrics": [], "params": [], "tags": []}
+        self.__lock = threading.Lock()
+        self.__flush_requested = threading.Event()
+        self.__flushed = threading.Condition(self.__lock)
+        self.__num_buffered = 0
+        self.__num_sent = 0
+        self.__closed = False
+        self.__thread = threading.Thread(target=self._run, name="AsyncMlflowLogger", daemon=True)
+        self.__thread.start()
+
+    def _append(self, kind: str, entries: List[dict]):
+        with self.__lock:
+            if self.__closed:
+                raise RuntimeError("The logger is closed")
+            self.__buffer[kind].extend(entries)
+            self.__num_buffered += len(entries)
+
+    def log_metric(self, key: str, value: float, step: int = 0):
+        self.log_metrics({key: value}, step=step)
+
+    def log_metrics(self, metrics: dict, step: int = 0):
+        timestamp = int(time.time() * 1000)
+        entries = [
+            {"key": key, "value": float(value), "timestamp": timestamp, "step": int(step)}
+            for key, value in metrics.items()
+        ]
+        self._append("metrics", entries)
+
+    def log_params(self, params: dict):
+        self._append("params", [{"key": key, "value": str(value)} for key, value in params.items()])
+
+    def set_tags(self, tags: dict):
+        self._append("tags", [{"key": key, "value": str(value)} for key, value in tags.items()])
+
+    def flush(self, wait: bool = False, timeout: float = None):
+        """
+        Asks the background thread to send the buffer.
+
+        Args:
+            wait (bool, optional): Whether to wait until the buffered entries are sent or spooled.
+                Defaults to False, so training is never blocked.
+            timeout (float, optional): The maximum time to wait. Defaults to None, i.e. no limit.
+        """
+        with self.__lock:
+            target = self.__num_buffered
+        self.__flush_requested.set()
+        if wait:
+            with self.__flushed:
+                self.__flushed.wait_for(lambda: self.__num_sent >= target, timeout=timeout)
+
+    def close(self, timeout: float = 30):
+        """
+        Sends the remaining entries and stops the background thread.
+
+        Once the background thread has exited, the spooled entries of the run are retried until the timeout while
+        the tracking server is unreachable.
+        Entries that still cannot be sent stay spooled for later loggers, and an error is raised, so a run missing
+        entries does not pass for complete.
+
+        Args:
+            timeout (float, optional): The maximum time to wait for the background thread and the retries.
+                Defaults to 30.
+
+        Raises:
+            RuntimeError: If entries of the run could not be sent.
+        """
+        deadline = time.monotonic() + timeout
+        with self.__lock:
+            self.__closed = True
+        self.__flush_requested.set()
+        self.__thread.join(timeout=timeout)
+        # a thread still sending owns the spool, replaying here as well would race with it
+        while (
+            not self.__thread.is_alive()
+            and os.path.exists(self._spool_path(self.run_id))
+            and time.monotonic() < deadline
+        ):
+            time.sleep(min(REPLAY_INTERVAL_SECONDS, max(0.0, deadline - time.monotonic())))
+            self._replay_spool()
+        if self.__thread.is_alive() or os.path.exists(self._spool_path(self.run_id)):
+            raise RuntimeError(
+                f"The tracking server is unreachable, unsent entries of run {self.run_id} stay spooled in "
+                f"{self.spool_dir}"
+            )
+
+    def _run(self):
+        while True:
+            self.__flush_requested.wait(timeout=self.flush_interval_seconds)
+            self.__flush_requested.clear()
+            with self.__lock:
+                batch, self.__buffer = self.__buffer, {"metrics": [], "params": [], "tags": []}
+                closed = self.__closed
+            num_entries = sum(len(entries) for entries in batch.values())
+            if num_entries:
+                self._send_or_spool(self.run_id, batch)
+            elif os.path.exists(self._spool_path(self.run_id)):
+                # nothing new to send, but spooled batches are retried until the server is back
+                self._replay_spool()
+            with self.__flushed:
+                self.__num_sent += num_entries
+                self.__flushed.notify_all()
+            if closed:
+                return
+
+    def _send(self, run_id: str, batch: dict):
+        """
+        Sends a batch in as many `log_batch` requests as the limits of the REST API require.
+
+        Args:
+            run_id (str): The ID of the MLflow run.
+            batch (dict): The metrics, params, and tags to send.
+        """
+        metrics = [Metric(**entry) for entry in batch["metrics"]]
+        params = [Param(**entry) for entry in batch["params"]]
+        tags = [RunTag(**entry) for entry in batch["tags"]]
+        while metrics or params or tags:
+            self.__client.log_batch(
+                run_id,
+                metrics=metrics[:MAX_METRICS_PER_BATCH],
+                params=params[:MAX_PARAMS_PER_BATCH],
+                tags=tags[:MAX_TAGS_PER_BATCH],
+            )
+            metrics = metrics[MAX_METRICS_PER_BATCH:]
+            params = params[MAX_PARAMS_PER_BATCH:]
+            tags = tags[MAX_TAGS_PER_BATCH:]
+
+    def _send_or_spool(self, run_id: str, batch: dict):
+        try:
+            self._send(run_id, batch)
+        except Exception as error:
+            # the tracking server is unreachable, the batch is kept on disk and sent with a later flush
+            print(f"MLflow logging failed, spooling the batch to {self.spool_dir}: {error}")
+            self._spool(run_id, batch)
+            return
+        self.num_logged += sum(len(entries) for entries in batch.values())
+        self._replay_spool()
+
+    def _spool_path(self, run_id: str) -> str:
+        return os.path.join(self.spool_dir, f"{run_id}.jsonl")
+
+    @contextmanager
+    def _spool_lock(self):
+        """
+        Locks the spool directory for all loggers sharing it, in this process and in other pods on the node.
+        """
+        with open(os.path.join(self.spool_dir, SPOOL_LOCK_NAME), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _spool(self, run_id: str, batch: dict):
+        with self._spool_lock():
+            with open(self._spool_path(run_id), "a") as f:
+                f.write(json.dumps({"run_id": run_id, **batch}) + "\n")
+        self.num_spooled += sum(len(entries) for entries in batch.values())
+
+    def _replay_spool(self):
+        """
+        Sends the spooled batches of all runs in the spool directory in their order, and removes them once sent.
+
+        A spool file is locked while it is replayed, so no batch is spooled behind the unsent ones meanwhile, and
+        the unsent batches are written back in their order.
+        """
+        for spool_path in sorted(glob.glob(os.path.join(self.spool_dir, "*.jsonl"))):
+            with self._spool_lock():
+                try:
+                    with open(spool_path) as f:
+                        batches = [json.loads(line) for line in f if line.strip()]
+                except FileNotFoundError:
+                    # replayed by another logger meanwhile
+                    continue
+                num_sent = 0
+                for batch in batches:
+                    try:
+                        self._send(batch["run_id"], batch)
+                    except Exception:
+                        # still unreachable, the remaining batches stay spooled
+                        break
+                    num_sent += 1
+                    self.num_logged += sum(len(batch[kind]) for kind in ("metrics", "params", "tags"))
+                if num_sent == len(batches):
+                    os.remove(spool_path)
+                elif num_sent:
+                    with open(f"{spool_path}.tmp", "w") as f:
+                        f.writelines(json.dumps(batch) + "\n" for batch in batches[num_sent:])
+                    os.replace(f"{spool_path}.tmp", spool_path)
@@ -0,0 +1,68 @@
+from typing import Tuple
+
+from keras import layers
+from keras.models import Model, Sequential
+
+# default augmentation of the model params, the factors are fractions of the image size or value range
+DEFAULT_AUGMENTATION = {
+    "flip": "horizontal_and_vertical",
+    "rotation": 0.1,
+    "crop_fraction": 0.9,
+    "brightness": 0.1,
+    "contrast": 0.1,
+}
+
+
+def build_augmentation(augmentation_params: dict) -> Sequential:
+    """
+    Builds the augmentation stage from Keras preprocessing layers.
+
+    The layers transform every image of a batch with its own random parameters, vectorized within the graph,
+    and are only active during training. Random crops are drawn by zooming in and translating by up to the
+    cropped fraction, so the image size is kept and inference sees the images unchanged. The layers expect
+    images scaled to [0, 1].
+
+    Args:
+        augmentation_params (dict): The augmentations to apply. The keys are "flip" ("horizontal", "vertical", or
+            "horizontal_and_vertical"), "rotation" (fraction of a full turn), "crop_fraction" (the share of the
+            height and width kept), "brightness", and "contrast". Missing or falsy keys are skipped.
+
+    Returns:
+        keras.models.Sequential: The augmentation stage.
+    """
+    augmentation = Sequential(name="augmentation")
+    if augmentation_params.get("flip"):
+        augmentation.add(layers.RandomFlip(augmentation_params["flip"]))
+    if augmentation_params.get("rotation"):
+        augmentation.add(layers.RandomRotation(augmentation_params["rotation"], fill_mode="reflect"))
+    crop_fraction = augmentation_params.get("crop_fraction")
+    if crop_fraction and crop_fraction < 1.0:
+        # zooming in by up to 1 - crop_fraction and translating within the margin is a random crop of the same size
+        margin = 1.0 - crop_fraction
+        augmentation.add(layers.RandomZoom(height_factor=(-margin, 0.0), fill_mode="reflect"))
+        augmentation.add(layers.RandomTranslation(margin / 2, margin / 2, fill_mode="reflect"))
+    if augmentation_params.get("brightness"):
+        augmentation.add(layers.RandomBrightness(augmentation_params["brightness"], value_range=(0.0, 1.0)))
+    if augmentation_params.get("contrast"):
+        augmentation.add(layers.RandomContrast(augmentation_params["contrast"]))
+    return augmentation
+
+
+def with_augmentation(model: Model, augmentation_params: dict, input_shape: Tuple[int, int, int]) -> Model:
+    """
+    Prepends the augmentation stage to a model.
+
+    The augmented images are never materialized, they are computed per batch in the training step. As the
+    layers pass images through unchanged at inference, the logged model serves like the model without them.
+
+    Args:
+        model (keras.models.Model): The model to augment the inputs of.
+        augmentation_params (dict): The augmentations to apply, see `build_augmentation`.
+        input_shape (Tuple[int, int, int]): The input shape of the model.
+
+    Returns:
+        keras.models.Model: The model with the augmentation stage, not compiled.
+    """
+    inputs = layers.Input(shape=input_shape)
+    outputs = model(build_augmentation(augmentation_params)(inputs))
+    return Model(inputs=inputs, outputs=outputs, name=f"augmented_{model.name}")
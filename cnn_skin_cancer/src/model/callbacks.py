@@ -0,0 +1,172 @@
+from typing import List
+
+import mlflow
+from keras.callbacks import Callback
+from src.mlflow_logging import AsyncMlflowLogger
+from src.sweep import Sweep_Strategy, halving_rungs
+
+
+class PruningCallback(Callback):
+    """PruningCallback stops weak trials early based on the intermediate metrics of other trials in MLflow.
+
+    At the end of every epoch the metric of the running trial is compared against the metrics the other runs of
+    the same sweep and model class logged at that epoch, so model classes of different capacity are not ranked
+    against each other. With the "halving" strategy a trial is only compared at rung epochs and continues if it
+    is within the top 1/reduction_factor. Otherwise it continues if it is not below the median.
+
+    Args:
+        sweep_id (str): The value of the `sweep_id` tag shared by all runs of a sweep.
+        experiment_id (str): The MLflow experiment ID of the sweep.
+        model_class (str, optional): The value of the `model_class` tag of the trial. Only trials of the same model
+            class are compared. Defaults to None, which compares against all trials of the sweep.
+        strategy (str, optional): The sweep strategy. Defaults to "grid".
+        metric (str, optional): The metric logged per epoch to compare trials. Defaults to "val_accuracy".
+        min_epochs (int, optional): Number of epochs to run before a trial can be pruned. Defaults to 1.
+        reduction_factor (int, optional): Reduction factor of successive halving. Defaults to 3.
+
+    Attributes:
+        pruned (bool): Whether the trial has been pruned.
+        pruned_at_epoch (int): The epoch the trial was pruned at, None if not pruned.
+
+    Methods:
+        on_epoch_end(epoch: int, logs: dict):
+            Compares the trial to the others and stops training if it is pruned.
+    """
+
+    def __init__(
+        self,
+        sweep_id: str,
+        experiment_id: str,
+        model_class: str = None,
+        strategy: str = Sweep_Strategy.Grid,
+        metric: str = "val_accuracy",
+        min_epochs: int = 1,
+        reduction_factor: int = 3,
+    ):
+        super(PruningCallback, self).__init__()
+        self.sweep_id = sweep_id
+        self.experiment_id = experiment_id
+        self.model_class = model_class
+        self.strategy = strategy
+        self.metric = metric
+        self.min_epochs = min_epochs
+        self.reduction_factor = reduction_factor
+        self.pruned = False
+        self.pruned_at_epoch = None
+        self.__client = mlflow.MlflowClient()
+        self.__rungs = None
+
+    def _get_other_trial_values(self, epoch: int) -> List[float]:
+        """
+        Retrieves the metric other trials of the sweep and model class logged at the given epoch.
+
+        Args:
+            epoch (int): The epoch to compare at.
+
+        Returns:
+            List[float]: The metric values of the other trials.
+        """
+        active_run_id = mlflow.active_run().info.run_id
+        filter_string = f"tags.sweep_id = '{self.sweep_id}'"
+        if self.model_class:
+            filter_string += f" and tags.model_class = '{self.model_class}'"
+        runs = self.__client.search_runs(experiment_ids=[self.experiment_id], filter_string=filter_string)
+        values = []
+        for run in runs:
+            if run.info.run_id == active_run_id:
+                continue
+            for measurement in self.__client.get_metric_history(run.info.run_id, self.metric):
+                if measurement.step == epoch:
+                    values.append(measurement.value)
+                    break
+        return values
+
+    def _should_prune(self, value: float, other_values: List[float]) -> bool:
+        """
+        Decides whether a trial is pruned given the metric values of the other trials.
+
+        Args:
+            value (float): The metric of the running trial.
+            other_values (List[float]): The metric values of the other trials at the same epoch.
+
+        Returns:
+            bool: True if the trial should be stopped.
+        """
+        if not other_values:
+            return False
+        all_values = sorted(other_values + [value], reverse=True)
+        if self.strategy == Sweep_Strategy.Halving:
+            num_promoted = max(1, len(all_values) // self.reduction_factor)
+            return value < all_values[num_promoted - 1]
+        median = all_values[len(all_values) // 2]
+        return value < median
+
+    def on_epoch_end(self, epoch: int, logs: dict = None):
+        logs = logs or {}
+        value = logs.get(self.metric)
+        # keras counts epochs from zero, the rungs are counted from one
+        completed_epochs = epoch + 1
+        if value is None or completed_epochs < self.min_epochs:
+            return
+
+        if self.strategy == Sweep_Strategy.Halving:
+            if self.__rungs is None:
+                self.__rungs = halving_rungs(self.params.get("epochs"), self.min_epochs, self.reduction_factor)
+            if completed_epochs not in self.__rungs:
+                return
+
+        if self._should_prune(value, self._get_other_trial_values(epoch)):
+            print(f"Pruning trial at epoch {completed_epochs}: {self.metric}={value:.4f}")
+            self.pruned = True
+            self.pruned_at_epoch = completed_epochs
+            self.model.stop_training = True
+            mlflow.set_tags({"pruned": "true", "pruned_at_epoch": completed_epochs})
+
+
+class MlflowMetricsCallback(Callback):
+    """MlflowMetricsCallback logs the training metrics through an AsyncMlflowLogger, so `fit` never waits for
+    the tracking server.
+
+    The metrics of every epoch are logged with the epoch as step, under the same keys as `mlflow.keras.autolog`,
+    and the logger is asked to flush at the end of every epoch. Other runs, e.g. the PruningCallback of a sweep,
+    see the metrics of an epoch shortly after it ended.
+
+    Args:
+        logger (AsyncMlflowLogger): The logger of the active run.
+        key_prefix (str, optional): A prefix of the metric keys, e.g. to tell cross-validation folds apart.
+            Defaults to "".
+        log_every_n_batches (int, optional): If set, the batch metrics are additionally logged every n batches
+            with the number of batches seen as step. Defaults to None.
+
+    Methods:
+        on_train_batch_end(batch: int, logs: dict):
+            Buffers the batch metrics every n batches.
+
+        on_epoch_end(epoch: int, logs: dict):
+            Buffers the epoch metrics and asks the logger to flush.
+
+        on_train_end(logs: dict):
+            Asks the logger to flush.
+    """
+
+    def __init__(self, logger: AsyncMlflowLogger, key_prefix: str = "", log_every_n_batches: int = None):
+        super(MlflowMetricsCallback, self).__init__()
+        self.logger = logger
+        self.key_prefix = key_prefix
+        self.log_every_n_batches = log_every_n_batches
+        self.__num_batches = 0
+
+    def _prefixed(self, logs: dict, suffix: str = "") -> dict:
+        return {f"{self.key_prefix}{key}{suffix}": value for key, value in (logs or {}).items()}
+
+    def on_train_batch_end(self, batch: int, logs: dict = None):
+        self.__num_batches += 1
+        if self.log_every_n_batches and self.__num_batches % self.log_every_n_batches == 0:
+            self.logger.log_metrics(self._prefixed(logs, suffix="_batch"), step=self.__num_batches)
+
+    def on_epoch_end(self, epoch: int, logs: dict = None):
+        self.logger.log_metrics(self._prefixed(logs), step=epoch)
+        self.logger.flush()
+
+    def on_train_end(self, logs: dict = None):
+        self.logger.flush()
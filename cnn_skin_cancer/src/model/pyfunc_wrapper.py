@@ -0,0 +1,81 @@
+import base64
+import io
+from typing import Tuple
+
+import mlflow.pyfunc
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+
+def decode_image_batch(model_input, input_shape: Tuple[int, int, int]) -> np.array:
+    """
+    Decodes a batch of raw images into one normalized float32 tensor of the model's input shape.
+
+    Accepted inputs are JPEG bytes, base64 encoded JPEG strings (as sent in JSON requests), a uint8 array of shape
+    (N, H, W, 3), or a DataFrame with an "image" column holding any of the former.
+
+    Args:
+        model_input: The batch of raw images.
+        input_shape (Tuple[int, int, int]): The input shape of the model, e.g. (224, 224, 3).
+
+    Returns:
+        np.array: A float32 array of shape (N, *input_shape) scaled to values between 0 and 1.
+
+    Raises:
+        ValueError: If an image cannot be decoded.
+    """
+    height, width, channels = input_shape
+    if isinstance(model_input, pd.DataFrame):
+        model_input = model_input["image"].to_numpy()
+    if isinstance(model_input, (list, tuple)):
+        model_input = np.asarray(model_input, dtype=object)
+
+    if model_input.dtype == np.uint8 and model_input.ndim == 4:
+        batch = model_input
+        if batch.shape[1:3] != (height, width):
+            batch = np.stack([np.asarray(Image.fromarray(image).resize((width, height))) for image in batch])
+    else:
+        # decoding is inherently per image, it writes into one preallocated uint8 buffer
+        batch = np.empty((len(model_input), height, width, channels), dtype=np.uint8)
+        for index, encoded_image in enumerate(model_input):
+            if isinstance(encoded_image, str):
+                encoded_image = base64.b64decode(encoded_image)
+            image = Image.open(io.BytesIO(encoded_image)).convert("RGB")
+            if image.size != (width, height):
+                image = image.resize((width, height))
+            batch[index] = np.asarray(image)
+
+    # normalization is vectorized over the whole batch
+    return batch.astype(np.float32) * np.float32(1 / 255.0)
+
+
+class SkinCancerImageModel(mlflow.pyfunc.PythonModel):
+    """SkinCancerImageModel wraps a trained Keras model, so it accepts raw images and preprocesses them itself.
+
+    Clients send JPEG bytes or uint8 arrays instead of normalized float tensors, which shrinks requests
+    by about 50x and removes PIL and NumPy from the client side.
+
+    Args:
+        input_shape (Tuple[int, int, int]): The input shape of the Keras model.
+
+    Methods:
+        load_context(context):
+            Loads the Keras model from the model artifacts.
+
+        predict(context, model_input) -> np.array:
+            Decodes, resizes, and normalizes the batch and returns the class probabilities.
+    """
+
+    def __init__(self, input_shape: Tuple[int, int, int]):
+        self.input_shape = tuple(input_shape)
+        self.model = None
+
+    def load_context(self, context):
+        from tensorflow import keras
+
+        self.model = keras.models.load_model(context.artifacts["keras_model"])
+
+    def predict(self, context, model_input) -> np.array:
+        batch = decode_image_batch(model_input, self.input_shape)
+        return self.model.predict(batch, verbose=0)
@@ -0,0 +1,95 @@
+from typing import List, Tuple
+
+import numpy as np
+from keras.utils import Sequence
+
+
+def scale_images(images: np.array) -> np.array:
+    """
+    Scales uint8 images to float32 in [0, 1], the input range of the models. Other images are passed through.
+
+    Args:
+        images (np.array): A batch of images.
+
+    Returns:
+        np.array: The scaled images.
+    """
+    if images.dtype == np.uint8:
+        return images.astype(np.float32) * np.float32(1 / 255.0)
+    return images
+
+
+class SliceSequence(Sequence):
+    """SliceSequence feeds batches from contiguous row ranges of arrays to Keras without copying the ranges.
+
+    The arrays can be memory-mapped, only the rows of the current batch are read. uint8 images are scaled to
+    [0, 1] per batch, so they are stored at a quarter of the size of float32 images. Within every epoch the rows are
+    visited in a seeded random order, and the rows of a batch are read sorted, so reads from a memory map stay
+    mostly sequential.
+
+    If `class_balanced` is set, every epoch draws the same number of row indices from every class, oversampling
+    small and undersampling large classes on the fly. Only indices are resampled, the arrays are never duplicated.
+
+    Args:
+        X (np.array): The images, e.g. memory-mapped from the shared volume.
+        y (np.array): The labels.
+        ranges (List[list]): The [start, end) row ranges to draw from.
+        batch_size (int): The number of rows per batch.
+        shuffle (bool, optional): Whether to visit the rows in a new random order every epoch. Defaults to True.
+        seed (int, optional): The seed of the row order. Defaults to 11.
+        class_balanced (bool, optional): Whether to sample all classes equally often. Defaults to False.
+
+    Methods:
+        __len__() -> int:
+            Returns the number of batches per epoch.
+
+        __getitem__(index: int) -> Tuple[np.array, np.array]:
+            Returns a batch of images and labels.
+
+        on_epoch_end():
+            Draws a new row order for the next epoch.
+    """
+
+    def __init__(
+        self,
+        X: np.array,
+        y: np.array,
+        ranges: List[list],
+        batch_size: int,
+        shuffle: bool = True,
+        seed: int = 11,
+        class_balanced: bool = False,
+    ):
+        self.X = X
+        self.y = y
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.__rows = np.concatenate([np.arange(start, end) for start, end in ranges])
+        self.__rng = np.random.default_rng(seed)
+        self.__order = self.__rows
+        self.__class_rows = None
+        if class_balanced:
+            labels = np.asarray(y[self.__rows])
+            if labels.ndim > 1:
+                labels = np.argmax(labels, axis=1)
+            self.__class_rows = [self.__rows[labels == label] for label in np.unique(labels)]
+        self.on_epoch_end()
+
+    def __len__(self) -> int:
+        return int(np.ceil(len(self.__order) / self.batch_size))
+
+    def __getitem__(self, index: int) -> Tuple[np.array, np.array]:
+        rows = np.sort(self.__order[index * self.batch_size : (index + 1) * self.batch_size])
+        return scale_images(self.X[rows]), self.y[rows]
+
+    def on_epoch_end(self):
+        if self.__class_rows is not None:
+            # an epoch keeps its length, every class contributes the same share of it
+            rows_per_class = len(self.__rows) // len(self.__class_rows)
+            sampled_rows = [
+                self.__rng.choice(class_rows, size=rows_per_class, replace=len(class_rows) < rows_per_class)
+                for class_rows in self.__class_rows
+            ]
+            self.__order = self.__rng.permutation(np.concatenate(sampled_rows))
+        elif self.shuffle:
+            self.__order = self.__rng.permutation(self.__rows)
@@ -1,6 +1,7 @@
 from enum import Enum
 
 from keras.models import Model
+from src.model.augmentation import with_augmentation
 from src.model.basic_model import BasicNet
 from src.model.resnet50_model import ResNet50
 
@@ -16,6 +17,9 @@ class Model_Class(Enum):
 def get_model(model_name: str, model_params: dict) -> Model:
     """Get the specified model based on the model name.
 
+    If the model params contain an "augmentation", the augmentation stage is prepended to the model, so it is
+    applied per batch during training only.
+
     Args:
         model_name (str): The name of the model to retrieve.
         model_params (dict): A dictionary containing the model parameters.
@@ -30,6 +34,8 @@ def get_model(model_name: str, model_params: dict) -> Model:
             print("I am here")
             model = BasicNet(model_params)
             print(model)
+            if model_params.get("augmentation"):
+                model = with_augmentation(model, model_params["augmentation"], model_params.get("input_shape"))
             # print(model.summary(expand_nested=True))
             model.compile(
                 optimizer=model_params.get("optimizer"),
@@ -44,6 +50,8 @@ def get_model(model_name: str, model_params: dict) -> Model:
             pass
         case Model_Class.ResNet50.value:
             model = ResNet50(model_params).call()
+            if model_params.get("augmentation"):
+                model = with_augmentation(model, model_params["augmentation"], model_params.get("input_shape"))
             model.compile(
                 optimizer=model_params.get("optimizer"),
                 loss=model_params.get("loss"),
@@ -0,0 +1,239 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+import mlflow
+
+
+def directory_digest(path: str) -> str:
+    """
+    Computes the SHA-256 digest of the relative paths and contents of all files below a directory.
+
+    Args:
+        path (str): The directory to hash.
+
+    Returns:
+        str: The hex digest, equal for directories with the same files.
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for file_name in sorted(files):
+            file_path = os.path.join(root, file_name)
+            digest.update(os.path.relpath(file_path, path).encode("utf-8"))
+            with open(file_path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+def _directory_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, file_name)) for root, _, files in os.walk(path) for file_name in files
+    )
+
+
+class ModelCache:
+    """ModelCache keeps the artifacts and metadata of registered MLflow models on local disk.
+
+    Artifacts are stored content-addressed by the digest of their files, and referenced by model name and version.
+    Versions of other models pointing to the same files share one copy. As a registered version, its run, and its
+    artifacts never change, a cached version is loaded without contacting the tracking server or S3. Only stages
+    are resolved against the registry on every call, since they move between versions. If the cached artifacts
+    exceed `max_bytes`, the least recently used ones are evicted.
+
+    The index is locked by a file lock, so pods or processes sharing the cache directory, e.g. on a hostPath
+    volume, can load models concurrently.
+
+    Args:
+        cache_dir (str, optional): The directory of the cache. Defaults to the env var MODEL_CACHE_DIR or
+            "~/.cache/cnn-skin-cancer/models".
+        max_bytes (int, optional): The maximum size of the cached artifacts. Defaults to the env var
+            MODEL_CACHE_MAX_BYTES or 10 GiB.
+
+    Attributes:
+        hits (int): The number of loads answered from disk.
+        misses (int): The number of loads downloading artifacts.
+        evictions (int): The number of artifacts evicted.
+
+    Methods:
+        resolve_version(model_name: str, model_stage: str) -> str:
+            Resolves a stage or version to a version.
+
+        get_model_version(model_name: str, model_version: str) -> dict:
+            Returns the run ID and source of a model version.
+
+        get_run_data(run_id: str) -> dict:
+            Returns the metrics, params, and tags of a run.
+
+        get_model_path(model_name: str, model_stage: str) -> str:
+            Returns the local path of the artifacts of a model version, downloading them if needed.
+
+        load_pyfunc(model_name: str, model_stage: str) -> mlflow.pyfunc.PyFuncModel:
+            Loads a model version as pyfunc from the local artifacts.
+    """
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = None):
+        self.cache_dir = cache_dir or os.getenv(
+            "MODEL_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "cnn-skin-cancer", "models")
+        )
+        self.max_bytes = max_bytes or int(os.getenv("MODEL_CACHE_MAX_BYTES", str(10 * 1024**3)))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__objects_dir = os.path.join(self.cache_dir, "objects")
+        self.__index_path = os.path.join(self.cache_dir, "index.json")
+        os.makedirs(self.__objects_dir, exist_ok=True)
+
+    @contextmanager
+    def _locked_index(self) -> Iterator[dict]:
+        """Holds the file lock of the cache and yields the index, which is written back on exit."""
+        with open(os.path.join(self.cache_dir, "index.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                index = {"versions": {}, "runs": {}, "objects": {}}
+                if os.path.exists(self.__index_path):
+                    with open(self.__index_path) as f:
+                        index = json.load(f)
+                yield index
+                tmp_path = f"{self.__index_path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(index, f)
+                os.replace(tmp_path, self.__index_path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def resolve_version(self, model_name: str, model_stage: str) -> str:
+        """
+        Resolves a stage or version to a version.
+
+        Args:
+            model_name (str): The name of the registered model.
+            model_stage (str): A stage, e.g. "Staging", or a version.
+
+        Returns:
+            str: The version.
+        """
+        if str(model_stage).isdigit():
+            return str(model_stage)
+        client = mlflow.MlflowClient()
+        return str(client.get_latest_versions(name=model_name, stages=[model_stage])[0].version)
+
+    def get_model_version(self, model_name: str, model_version: str) -> dict:
+        """
+        Returns the run ID and source of a model version, from the registry only on the first call.
+
+        Args:
+            model_name (str): The name of the registered model.
+            model_version (str): The version of the model.
+
+        Returns:
+            dict: The "run_id" and "source" of the version.
+        """
+        key = f"{model_name}/{model_version}"
+        with self._locked_index() as index:
+            if key in index["versions"]:
+                return dict(index["versions"][key])
+        details = mlflow.MlflowClient().get_model_version(name=model_name, version=str(model_version))
+        with self._locked_index() as index:
+            entry = index["versions"].setdefault(key, {})
+            entry.update({"run_id": details.run_id, "source": details.source})
+            return dict(entry)
+
+    def get_run_data(self, run_id: str) -> dict:
+        """
+        Returns the metrics, params, and tags of a run, from the tracking server only until the run finished.
+
+        Args:
+            run_id (str): The ID of the run.
+
+        Returns:
+            dict: The "metrics", "params", and "tags" of the run.
+        """
+        with self._locked_index() as index:
+            if run_id in index["runs"]:
+                return index["runs"][run_id]
+        run = mlflow.MlflowClient().get_run(run_id)
+        run_data = run.data.to_dictionary()
+        if run.info.status == "FINISHED":
+            with self._locked_index() as index:
+                index["runs"][run_id] = run_data
+        return run_data
+
+    def _evict(self, index: dict, keep_digest: str):
+        """Deletes the least recently used artifacts until the cache fits into `max_bytes`."""
+        total_bytes = sum(entry["size"] for entry in index["objects"].values())
+        for digest, entry in sorted(index["objects"].items(), key=lambda item: item[1]["last_used"]):
+            if total_bytes <= self.max_bytes:
+                break
+            if digest == keep_digest:
+                continue
+            shutil.rmtree(os.path.join(self.__objects_dir, digest), ignore_errors=True)
+            del index["objects"][digest]
+            total_bytes -= entry["size"]
+            self.evictions += 1
+            for version_entry in index["versions"].values():
+                if version_entry.get("digest") == digest:
+                    del version_entry["digest"]
+            print(f"Evicted model artifacts {digest[:12]} from the cache")
+
+    def get_model_path(self, model_name: str, model_stage: str = "Staging") -> str:
+        """
+        Returns the local path of the artifacts of a model version, downloading them if they are not cached.
+
+        Args:
+            model_name (str): The name of the registered model.
+            model_stage (str, optional): The stage or the version of the model. Defaults to "Staging".
+
+        Returns:
+            str: The local directory of the model artifacts.
+        """
+        model_version = self.resolve_version(model_name, model_stage)
+        key = f"{model_name}/{model_version}"
+        with self._locked_index() as index:
+            digest = index["versions"].get(key, {}).get("digest")
+            if digest and digest in index["objects"]:
+                index["objects"][digest]["last_used"] = time.time()
+                self.hits += 1
+                print(f"Loading model {key} from the cache")
+                return os.path.join(self.__objects_dir, digest)
+
+        self.misses += 1
+        print(f"Downloading model {key} into the cache")
+        source = self.get_model_version(model_name, model_version)["source"]
+        # the download is moved into place only once complete, so readers never see partial artifacts
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix="download-")
+        try:
+            local_path = mlflow.artifacts.download_artifacts(artifact_uri=source, dst_path=tmp_dir)
+            digest = directory_digest(local_path)
+            object_path = os.path.join(self.__objects_dir, digest)
+            with self._locked_index() as index:
+                if not os.path.exists(object_path):
+                    os.replace(local_path, object_path)
+                index["objects"][digest] = {"size": _directory_size(object_path), "last_used": time.time()}
+                index["versions"].setdefault(key, {})["digest"] = digest
+                self._evict(index, keep_digest=digest)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return object_path
+
+    def load_pyfunc(self, model_name: str, model_stage: str = "Staging") -> "mlflow.pyfunc.PyFuncModel":
+        """
+        Loads a model version as pyfunc from the local artifacts.
+
+        Args:
+            model_name (str): The name of the registered model.
+            model_stage (str, optional): The stage or the version of the model. Defaults to "Staging".
+
+        Returns:
+            mlflow.pyfunc.PyFuncModel: The loaded model.
+        """
+        import mlflow.pyfunc
+
+        return mlflow.pyfunc.load_model(self.get_model_path(model_name, model_stage))
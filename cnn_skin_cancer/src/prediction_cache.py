@@ -0,0 +1,213 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+import numpy as np
+
+
+def image_content_hash(image) -> str:
+    """
+    Computes the SHA-256 hash of the decoded pixels of an image.
+
+    Hashing the pixels instead of the file makes the hash independent of JPEG metadata, so a resubmitted image
+    hits the cache even if a client re-saved it.
+
+    Args:
+        image: The image as JPEG bytes, base64 encoded JPEG string, or uint8 array or nested list.
+
+    Returns:
+        str: The hex digest of the image's shape and pixels.
+    """
+    if isinstance(image, str):
+        image = base64.b64decode(image)
+    if isinstance(image, bytes):
+        from PIL import Image
+
+        image = Image.open(io.BytesIO(image)).convert("RGB")
+    pixels = np.ascontiguousarray(image, dtype=np.uint8)
+    digest = hashlib.sha256(str(pixels.shape).encode("utf-8"))
+    digest.update(pixels.data)
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """PredictionCache caches predictions in memory with LRU and TTL eviction and optionally on disk.
+
+    Keys combine the model version with the image hash, so a new model version never reads predictions of the
+    previous one. The disk backend keeps predictions across restarts of the client or server.
+
+    Args:
+        max_entries (int, optional): The maximum number of predictions kept in memory. Defaults to 10000.
+        ttl_seconds (float, optional): The time after which a prediction expires. Defaults to 3600.
+        disk_dir (str, optional): A directory to persist predictions to. Defaults to None, i.e. memory only.
+
+    Attributes:
+        hits (int): The number of lookups answered by the cache.
+        misses (int): The number of lookups not answered by the cache.
+        evictions (int): The number of predictions evicted from memory.
+
+    Methods:
+        make_key(model_version: str, image) -> str:
+            Builds the cache key of an image for a model version.
+
+        get(key: str) -> Any:
+            Returns the cached prediction, or None if it is missing or expired.
+
+        put(key: str, prediction: Any):
+            Caches a prediction.
+
+        get_or_compute(key: str, compute_fn: Callable) -> Any:
+            Returns the cached prediction or computes and caches it.
+
+        stats() -> dict:
+            Returns the hit rate and size of the cache.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 3600, disk_dir: str = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(model_version: str, image) -> str:
+        return f"{model_version}:{image_content_hash(image)}"
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.json")
+
+    def _read_from_disk(self, key: str) -> tuple:
+        try:
+            with open(self._disk_path(key)) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return entry["stored_at"], entry["prediction"]
+
+    def _write_to_disk(self, key: str, stored_at: float, prediction: Any):
+        # written atomically, as several clients may share the directory
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"stored_at": stored_at, "prediction": prediction}, f)
+        os.replace(tmp_path, path)
+
+    def get(self, key: str) -> Any:
+        now = time.time()
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl_seconds:
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        entry = self._read_from_disk(key) if self.disk_dir else None
+        with self.__lock:
+            if entry is not None and now - entry[0] < self.ttl_seconds:
+                self._put_in_memory(key, entry)
+                self.hits += 1
+                return entry[1]
+            self.__entries.pop(key, None)
+            self.misses += 1
+            return None
+
+    def _put_in_memory(self, key: str, entry: tuple):
+        # expects the lock to be held
+        self.__entries[key] = entry
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.max_entries:
+            self.__entries.popitem(last=False)
+            self.evictions += 1
+
+    def put(self, key: str, prediction: Any):
+        entry = (time.time(), prediction)
+        with self.__lock:
+            self._put_in_memory(key, entry)
+        if self.disk_dir:
+            self._write_to_disk(key, *entry)
+
+    def get_or_compute(self, key: str, compute_fn: Callable) -> Any:
+        prediction = self.get(key)
+        if prediction is None:
+            prediction = compute_fn()
+            self.put(key, prediction)
+        return prediction
+
+    def stats(self) -> dict:
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "size": len(self.__entries),
+            }
+
+
+class CachedEndpointClient:
+    """CachedEndpointClient queries a SageMaker endpoint through a prediction cache.
+
+    The model version is read from the tags of the endpoint and refreshed periodically, so the cache is
+    invalidated automatically once `compare_models` promotes a new version and it is deployed.
+
+    Args:
+        app_name (str): The name of the SageMaker endpoint.
+        cache (PredictionCache, optional): The cache to use. Defaults to an in-memory cache.
+        version_refresh_seconds (float, optional): How often the deployed model version is re-read.
+            Defaults to 60.
+
+    Methods:
+        predict(image) -> list:
+            Returns the prediction of a single image, from the cache if possible.
+    """
+
+    def __init__(self, app_name: str, cache: PredictionCache = None, version_refresh_seconds: float = 60):
+        self.app_name = app_name
+        self.cache = cache or PredictionCache()
+        self.version_refresh_seconds = version_refresh_seconds
+        self.__model_version = None
+        self.__model_version_read_at = 0.0
+
+    def _model_version(self) -> str:
+        from src.inference_to_sagemaker import deployed_model_version
+
+        if time.time() - self.__model_version_read_at > self.version_refresh_seconds:
+            self.__model_version = deployed_model_version(self.app_name)
+            self.__model_version_read_at = time.time()
+        return self.__model_version
+
+    def predict(self, image) -> list:
+        """
+        Returns the prediction of a single image, from the cache if possible.
+
+        Args:
+            image: The image as JPEG bytes, base64 encoded JPEG string, or uint8 array.
+
+        Returns:
+            list: The predicted class probabilities of the image.
+        """
+        from src.inference_to_sagemaker import query_endpoint
+
+        def _query() -> list:
+            if isinstance(image, np.ndarray):
+                instance = image.tolist()
+            else:
+                instance = image if isinstance(image, str) else base64.b64encode(image).decode("ascii")
+            payload = json.dumps({"instances": [instance]})
+            return query_endpoint(app_name=self.app_name, data=payload)["predictions"][0]
+
+        key = self.cache.make_key(self._model_version(), image)
+        return self.cache.get_or_compute(key, _query)
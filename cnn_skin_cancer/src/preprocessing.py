@@ -4,9 +4,15 @@ from typing import Tuple
 
 import mlflow
 import numpy as np
-from keras.utils.np_utils import to_categorical
 from sklearn.utils import shuffle
-from src.utils import AWSSession, timeit
+from src.chunked_dataset import CHUNKED_SUFFIX
+from src.deduplication import DuplicateFilter
+from src.mlflow_logging import AsyncMlflowLogger
+from src.splits import make_stratified_splits, split_index_path
+from src.stage_cache import compute_fingerprint, lookup_stage_cache, record_stage_cache
+from src.streaming_preprocessing import stream_preprocessing
+from src.utils import AWSSession, save_npy_to_volume, timeit
+from src.validation import validate_images
 from tqdm import tqdm
 
 
@@ -15,17 +21,49 @@ def data_preprocessing(
     mlflow_experiment_id: str,
     aws_bucket: str,
     path_preprocessed: str = "preprocessed",
+    shared_volume_dir: str = None,
+    use_cache: bool = True,
+    deduplicate: bool = True,
+    max_hash_distance: int = 3,
+    validation_fraction: float = 0.2,
+    num_folds: int = 3,
+    split_seed: int = 11,
+    storage_format: str = "chunked",
+    codec: str = "zstd",
+    streaming: bool = False,
+    memory_budget_mb: int = 2048,
+    validate: bool = True,
 ) -> Tuple[str, str, str, str]:
-    """Preprocesses data for further use within model training. Raw data is read from given S3 Bucket, normalized, and stored ad a NumPy Array within S3 again. Output directory is on "/preprocessed". The shape of the data set is logged to MLflow.
+    """Preprocesses data for further use within model training. Raw data is read from given S3 Bucket, deduplicated, split, and stored as uint8 NumPy Array within S3 again. Output directory is on "/preprocessed/<fingerprint>". The shape of the data set is logged to MLflow.
+
+    The fingerprint is computed from the manifest of the raw data (keys and ETags), the code version, and the image. If a previous run with the same fingerprint finished, its outputs are returned without preprocessing the data again.
 
     Args:
         mlflow_experiment_id (str): Experiment ID of the MLflow run to log data
         aws_bucket (str): S3 Bucket to read raw data from and write preprocessed data
         path_preprocessed (str, optional): Subdirectory to store the preprocessed data on the provided S3 Bucket. Defaults to "preprocessed".
+        shared_volume_dir (str, optional): Mount path of a shared volume. If given, the arrays are additionally written to it as .npy files, so training pods can memory-map them instead of downloading them from S3. Defaults to None.
+        use_cache (bool, optional): Whether to reuse the outputs of a previous run with the same fingerprint. Defaults to True.
+        deduplicate (bool, optional): Whether to drop exact and near duplicates within the train and test set, and test images overlapping with the train set. Defaults to True.
+        max_hash_distance (int, optional): The maximum Hamming distance of the perceptual hashes of near duplicates. Defaults to 3.
+        validation_fraction (float, optional): The share of every class of the train set held out for validation. Defaults to 0.2.
+        num_folds (int, optional): The number of cross-validation folds of the train set. Defaults to 3.
+        split_seed (int, optional): The seed of the shuffles and the split. Defaults to 11.
+        storage_format (str, optional): "chunked" stores the arrays as compressed chunks with an index, which are read with parallel range requests, "pickle" as single pickles. Defaults to "chunked".
+        codec (str, optional): The compression codec of chunked arrays, "zstd", "lz4", or "zlib". Defaults to "zstd".
+        streaming (bool, optional): Whether to process the images in batches bounded by `memory_budget_mb` and write the chunks as they go, for data sets larger than the memory of the pod. Requires the "chunked" storage format. Defaults to False.
+        memory_budget_mb (int, optional): The memory the image data may use in streaming mode, in MiB. Defaults to 2048.
+        validate (bool, optional): Whether to check that all images decode and have the same size and RGB mode before preprocessing. Failing images are quarantined to "quarantine_report.json" next to the outputs and skipped. The results are cached per ETag. Defaults to True.
 
     Returns:
         Tuple[str, str, str, str]: Four strings denoting the path of the preprocessed data stored as NumPy Arrays: X_train_data_path, y_train_data_path, X_test_data_path, y_test_data_path
+
+    Raises:
+        ValueError: If streaming is requested with another storage format than "chunked".
     """
+    if streaming and storage_format != "chunked":
+        raise ValueError(f"Streaming preprocessing writes chunked arrays, got storage format {storage_format}")
+
     mlflow_tracking_uri = os.getenv("MLFLOW_TRACKING_URI")
     mlflow.set_tracking_uri(mlflow_tracking_uri)
 
@@ -37,16 +75,50 @@ def data_preprocessing(
     # Set paths within s3
     path_raw_data = f"s3://{aws_bucket}/data/"
 
-    folder_benign_train = f"{path_raw_data}train/benign"
-    folder_malignant_train = f"{path_raw_data}train/malignant"
-
-    folder_benign_test = f"{path_raw_data}test/benign"
-    folder_malignant_test = f"{path_raw_data}test/malignant"
+    # Every folder below "train" is a class, its index is the position in the sorted class names
+    class_folders = aws_session.list_files_in_bucket(f"{path_raw_data}train")
+    class_names = sorted(os.path.basename(folder.rstrip("/")) for folder in class_folders)
+    print(f"Classes: {class_names}")
+
+    # Fingerprint the raw data, so identical reruns can reuse the outputs of a previous run
+    # Streaming splits before deduplicating and yields other rows, the memory budget only changes the batch size
+    data_manifest = aws_session.get_data_manifest(path_raw_data)
+    fingerprint = compute_fingerprint(
+        stage="preprocessing",
+        data_manifest=data_manifest,
+        path_preprocessed=path_preprocessed,
+        deduplicate=deduplicate,
+        max_hash_distance=max_hash_distance,
+        validation_fraction=validation_fraction,
+        num_folds=num_folds,
+        split_seed=split_seed,
+        storage_format=storage_format,
+        codec=codec,
+        streaming=streaming,
+        validate=validate,
+    )
+    if use_cache:
+        cached_outputs = lookup_stage_cache(mlflow_experiment_id, stage="preprocessing", fingerprint=fingerprint)
+        if cached_outputs is not None:
+            return (
+                cached_outputs["X_train_data_path"],
+                cached_outputs["y_train_data_path"],
+                cached_outputs["X_test_data_path"],
+                cached_outputs["y_test_data_path"],
+            )
+
+    # Outputs are stored per fingerprint, so a cached run never points to data overwritten by a later run
+    path_output = f"{path_preprocessed}/{fingerprint[:16]}"
+    file_extension = CHUNKED_SUFFIX if storage_format == "chunked" else ".pkl"
+    X_train_data_path = f"{path_output}/X_train{file_extension}"
+    y_train_data_path = f"{path_output}/y_train{file_extension}"
+    X_test_data_path = f"{path_output}/X_test{file_extension}"
+    y_test_data_path = f"{path_output}/y_test{file_extension}"
 
     @timeit
     def _load_and_convert_images(folder_path: str) -> np.array:
         """
-        Loads and converts images from an S3 bucket folder into a NumPy array.
+        Loads and converts the valid images of an S3 bucket folder into a NumPy array.
 
         Args:
             folder_path (str): The path to the S3 bucket folder.
@@ -57,116 +129,193 @@ def data_preprocessing(
         Raises:
             None
         """
+        s3_client = aws_session.get_s3_client()
         ims = [
-            aws_session.read_image_from_s3(s3_bucket=aws_bucket, imname=filename)
+            aws_session.read_image_from_s3(s3_bucket=aws_bucket, imname=filename, s3_client=s3_client)
             # TODO: currently only uses the last ten files for testing
             # for filename in tqdm(aws_session.list_files_in_bucket(folder_path)[-10:])
             for filename in tqdm(aws_session.list_files_in_bucket(folder_path))
+            if valid_imnames is None or filename in valid_imnames
         ]
         return np.array(ims, dtype="uint8")
 
-    def _create_label(x_dataset: np.array) -> np.array:
+    def _create_label(x_dataset: np.array, class_index: int) -> np.array:
         """
         Creates label array for the given dataset.
 
         Args:
             x_dataset (np.array): The dataset for which labels are to be created.
+            class_index (int): The index of the class of the dataset.
 
         Returns:
-            np.array: The label array.
-
-        Raises:
-            None
-        """
-        return np.zeros(x_dataset.shape[0])
-
-    def _merge_data(set_one: np.array, set_two: np.array) -> np.array:
-        """
-        Merges two datasets into a single dataset.
-
-        Args:
-            set_one (np.array): The first dataset.
-            set_two (np.array): The second dataset.
-
-        Returns:
-            np.array: The merged dataset.
+            np.array: The label array of uint8 class indices.
 
         Raises:
             None
         """
-        return np.concatenate((set_one, set_two), axis=0)
+        return np.full(x_dataset.shape[0], class_index, dtype="uint8")
 
     # Start a MLflow run to log the size of the data
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     with mlflow.start_run(experiment_id=mlflow_experiment_id, run_name=f"{timestamp}_Preprocessing") as run:
-        print("\n> Loading images from S3...")
-        # Load in training pictures
-        X_benign = _load_and_convert_images(folder_benign_train)
-        X_malignant = _load_and_convert_images(folder_malignant_train)
-
-        # Load in testing pictures
-        X_benign_test = _load_and_convert_images(folder_benign_test)
-        X_malignant_test = _load_and_convert_images(folder_malignant_test)
-
-        # Log train-test size in MLflow
-        print("\n> Log data parameters")
-        mlflow.log_param("train_size_benign", X_benign.shape[0])
-        mlflow.log_param("train_size_malignant", X_malignant.shape[0])
-        mlflow.log_param("test_size_benign", X_benign_test.shape[0])
-        mlflow.log_param("test_size_malignant", X_malignant_test.shape[0])
-
-        print("\n> Preprocessing...")
-        # Create labels
-        y_benign = _create_label(X_benign)
-        y_malignant = _create_label(X_malignant)
-
-        y_benign_test = _create_label(X_benign_test)
-        y_malignant_test = _create_label(X_malignant_test)
-
-        # Merge data
-        y_train = _merge_data(y_benign, y_malignant)
-        y_test = _merge_data(y_benign_test, y_malignant_test)
-
-        X_train = _merge_data(X_benign, X_malignant)
-        X_test = _merge_data(X_benign_test, X_malignant_test)
-
-        # Shuffle data
-        X_train, y_train = shuffle(X_train, y_train)
-        X_test, y_test = shuffle(X_test, y_test)
-
-        y_train = to_categorical(y_train, num_classes=2)
-        y_test = to_categorical(y_test, num_classes=2)
-
-        # With data augmentation to prevent overfitting
-        X_train = X_train / 255.0
-        X_test = X_test / 255.0
-
-        print("\n> Upload numpy arrays to S3...")
-        aws_session.upload_npy_to_s3(
-            data=X_train,
-            s3_bucket=aws_bucket,
-            file_key=f"{path_preprocessed}/X_train.pkl",
-        )
-        aws_session.upload_npy_to_s3(
-            data=y_train,
+        metrics_logger = AsyncMlflowLogger(run.info.run_id)
+        valid_imnames = None
+        if validate:
+            print("\n> Validating images...")
+            # A corrupt or odd image would fail the whole run, so it is quarantined and the others are preprocessed
+            valid_imnames, validation_report = validate_images(
+                aws_session=aws_session,
+                aws_bucket=aws_bucket,
+                data_manifest=data_manifest,
+                cache_file_key=f"{path_preprocessed}/validation_cache.json",
+            )
+            aws_session.upload_json_to_s3(
+                data=validation_report, s3_bucket=aws_bucket, file_key=f"{path_output}/quarantine_report.json"
+            )
+            metrics_logger.log_metrics(
+                {
+                    "validated_images": validation_report["num_checked"],
+                    "quarantined_images": validation_report["num_quarantined"],
+                }
+            )
+
+        if streaming:
+            print(f"\n> Streaming images from S3 with a memory budget of {memory_budget_mb} MiB...")
+            streamed = stream_preprocessing(
+                aws_session=aws_session,
+                aws_bucket=aws_bucket,
+                path_raw_data=path_raw_data,
+                class_names=class_names,
+                X_train_data_path=X_train_data_path,
+                X_test_data_path=X_test_data_path,
+                shared_volume_dir=shared_volume_dir,
+                memory_budget_mb=memory_budget_mb,
+                deduplicate=deduplicate,
+                max_hash_distance=max_hash_distance,
+                validation_fraction=validation_fraction,
+                num_folds=num_folds,
+                split_seed=split_seed,
+                codec=codec,
+                valid_imnames=valid_imnames,
+            )
+            metrics_logger.log_metrics(streamed["metrics"])
+            metrics_logger.log_params({"class_names": class_names})
+            for class_name, (train_size, test_size) in streamed["class_sizes"].items():
+                metrics_logger.log_params(
+                    {f"train_size_{class_name}": train_size, f"test_size_{class_name}": test_size}
+                )
+
+            # Only the labels are left to write, the images were written batch by batch
+            split_index = streamed["split_index"]
+            split_index["class_names"] = class_names
+            for data, file_key in [(streamed["y_train"], y_train_data_path), (streamed["y_test"], y_test_data_path)]:
+                aws_session.upload_chunked_array_to_s3(data=data, s3_bucket=aws_bucket, file_key=file_key, codec=codec)
+                if shared_volume_dir:
+                    save_npy_to_volume(data=data, volume_dir=shared_volume_dir, file_key=file_key)
+        else:
+            print("\n> Loading images from S3...")
+            # Load in training and testing pictures per class
+            X_train_sets = [
+                _load_and_convert_images(f"{path_raw_data}train/{class_name}") for class_name in class_names
+            ]
+            X_test_sets = [_load_and_convert_images(f"{path_raw_data}test/{class_name}") for class_name in class_names]
+
+            if deduplicate:
+                print("\n> Removing duplicates...")
+                # Train images are deduplicated across all classes, test images additionally against the train set
+                train_filter = DuplicateFilter(max_distance=max_hash_distance)
+                X_train_sets = [X_set[~train_filter.find_duplicates(X_set)] for X_set in X_train_sets]
+                metrics_logger.log_metrics(
+                    {
+                        "train_exact_duplicates": train_filter.num_exact_duplicates,
+                        "train_near_duplicates": train_filter.num_near_duplicates,
+                    }
+                )
+
+                test_filter = DuplicateFilter(max_distance=max_hash_distance)
+                train_test_overlap = 0
+                for index, X_set in enumerate(X_test_sets):
+                    is_overlap = train_filter.find_duplicates(X_set, insert=False)
+                    train_test_overlap += int(is_overlap.sum())
+                    X_set = X_set[~is_overlap]
+                    X_test_sets[index] = X_set[~test_filter.find_duplicates(X_set)]
+
+                metrics_logger.log_metrics(
+                    {
+                        "test_exact_duplicates": test_filter.num_exact_duplicates,
+                        "test_near_duplicates": test_filter.num_near_duplicates,
+                        "train_test_overlap": train_test_overlap,
+                    }
+                )
+                print(f"Removed {train_test_overlap} test images overlapping with the train set")
+
+            # Log train-test size in MLflow
+            print("\n> Log data parameters")
+            metrics_logger.log_params({"class_names": class_names})
+            for class_name, X_train_set, X_test_set in zip(class_names, X_train_sets, X_test_sets):
+                metrics_logger.log_params(
+                    {f"train_size_{class_name}": X_train_set.shape[0], f"test_size_{class_name}": X_test_set.shape[0]}
+                )
+
+            print("\n> Preprocessing...")
+            # Create labels as uint8 class indices, training uses a sparse categorical loss instead of one-hot labels
+            y_train = np.concatenate([_create_label(X_set, index) for index, X_set in enumerate(X_train_sets)])
+            y_test = np.concatenate([_create_label(X_set, index) for index, X_set in enumerate(X_test_sets)])
+
+            # Merge data
+            X_train = np.concatenate(X_train_sets, axis=0)
+            X_test = np.concatenate(X_test_sets, axis=0)
+            del X_train_sets, X_test_sets
+
+            # Shuffle the train set once into contiguous, stratified folds and validation rows, persisted as index file
+            # The index doubles as manifest of the preprocessed data and holds the class map
+            train_order, split_index = make_stratified_splits(
+                y_train, validation_fraction=validation_fraction, num_folds=num_folds, seed=split_seed
+            )
+            split_index["class_names"] = class_names
+            X_train, y_train = X_train[train_order], y_train[train_order]
+            X_test, y_test = shuffle(X_test, y_test, random_state=split_seed)
+
+            # Images are stored as uint8 and scaled to [0, 1] per batch during training, augmentation is applied there
+            # as well, so no augmented or float copies are written
+            print("\n> Upload numpy arrays to S3...")
+            for data, file_key in [
+                (X_train, X_train_data_path),
+                (y_train, y_train_data_path),
+                (X_test, X_test_data_path),
+                (y_test, y_test_data_path),
+            ]:
+                if storage_format == "chunked":
+                    aws_session.upload_chunked_array_to_s3(
+                        data=data, s3_bucket=aws_bucket, file_key=file_key, codec=codec
+                    )
+                else:
+                    aws_session.upload_npy_to_s3(data=data, s3_bucket=aws_bucket, file_key=file_key)
+
+            if shared_volume_dir:
+                print(f"\n> Write numpy arrays to shared volume {shared_volume_dir}...")
+                save_npy_to_volume(data=X_train, volume_dir=shared_volume_dir, file_key=X_train_data_path)
+                save_npy_to_volume(data=y_train, volume_dir=shared_volume_dir, file_key=y_train_data_path)
+                save_npy_to_volume(data=X_test, volume_dir=shared_volume_dir, file_key=X_test_data_path)
+                save_npy_to_volume(data=y_test, volume_dir=shared_volume_dir, file_key=y_test_data_path)
+
+        aws_session.upload_json_to_s3(
+            data=split_index,
             s3_bucket=aws_bucket,
-            file_key=f"{path_preprocessed}/y_train.pkl",
-        )
-        aws_session.upload_npy_to_s3(
-            data=X_test,
-            s3_bucket=aws_bucket,
-            file_key=f"{path_preprocessed}/X_test.pkl",
-        )
-        aws_session.upload_npy_to_s3(
-            data=y_test,
-            s3_bucket=aws_bucket,
-            file_key=f"{path_preprocessed}/y_test.pkl",
+            file_key=split_index_path(X_train_data_path),
         )
 
-    X_train_data_path = f"{path_preprocessed}/X_train.pkl"
-    y_train_data_path = f"{path_preprocessed}/y_train.pkl"
-    X_test_data_path = f"{path_preprocessed}/X_test.pkl"
-    y_test_data_path = f"{path_preprocessed}/y_test.pkl"
+        metrics_logger.close()
+        record_stage_cache(
+            stage="preprocessing",
+            fingerprint=fingerprint,
+            outputs={
+                "X_train_data_path": X_train_data_path,
+                "y_train_data_path": y_train_data_path,
+                "X_test_data_path": X_test_data_path,
+                "y_test_data_path": y_test_data_path,
+            },
+        )
 
     return X_train_data_path, y_train_data_path, X_test_data_path, y_test_data_path
 
@@ -174,8 +323,12 @@ def data_preprocessing(
 if __name__ == "__main__":
     mlflow_experiment_id = os.getenv("MLFLOW_EXPERIMENT_ID")
     aws_bucket = os.getenv("AWS_BUCKET")
+    shared_volume_dir = os.getenv("SHARED_VOLUME_DIR")
 
     data_preprocessing(
         mlflow_experiment_id=mlflow_experiment_id,
         aws_bucket=aws_bucket,
+        shared_volume_dir=shared_volume_dir,
+        streaming=os.getenv("STREAMING", "false").lower() == "true",
+        memory_budget_mb=int(os.getenv("MEMORY_BUDGET_MB", "2048")),
     )
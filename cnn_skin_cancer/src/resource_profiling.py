@@ -0,0 +1,192 @@
+import atexit
+import json
+import math
+import os
+import resource
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+# MLflow experiment collecting the resource usage of every task, apart from the pipeline's experiment
+# mlflow and numpy are imported where needed, as every task imports this module to track its resource usage
+RESOURCE_EXPERIMENT_NAME = "cnn_skin_cancer_resources"
+
+
+def get_profile_path() -> str:
+    """
+    Get the file path of the pod resource profile relative to the current script's location.
+
+    Returns:
+        str: The absolute file path to 'profiles/pod_resources.json'.
+    """
+    return f"{Path(__file__).parent.parent}/profiles/pod_resources.json"
+
+
+def load_pod_resource_profile(profile_path: str = None) -> dict:
+    """
+    Loads the pod resource profile.
+
+    Args:
+        profile_path (str, optional): The path to the profile. Defaults to the profile shipped in `profiles/`.
+
+    Returns:
+        dict: The profile, containing the requests and limits per task and the defaults.
+    """
+    with open(profile_path or get_profile_path()) as f:
+        return json.load(f)
+
+
+def profile_key(task_id: str, variant: str = None) -> str:
+    """
+    Builds the key of a task in the profile, e.g. "model_training_op:ResNet50" for a variant of a task.
+
+    Args:
+        task_id (str): The task ID.
+        variant (str, optional): The variant of the task, e.g. the model class. Defaults to None.
+
+    Returns:
+        str: The key of the task.
+    """
+    return f"{task_id}:{variant}" if variant else task_id
+
+
+def measure_resource_usage(start_time: float) -> dict:
+    """
+    Measures the resource usage of the current process and its terminated child processes.
+
+    Args:
+        start_time (float): The time the measurement started at, as returned by `time.time`.
+
+    Returns:
+        dict: The "peak_rss_mb", "cpu_seconds", and "wall_seconds".
+    """
+    own_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        # ru_maxrss is reported in KiB on Linux, for children it is the peak of the largest child
+        "peak_rss_mb": max(own_usage.ru_maxrss, children_usage.ru_maxrss) / 1024,
+        "cpu_seconds": own_usage.ru_utime + own_usage.ru_stime + children_usage.ru_utime + children_usage.ru_stime,
+        "wall_seconds": time.time() - start_time,
+    }
+
+
+def track_resource_usage(task_id: str, variant: str = None):
+    """
+    Logs the peak RSS and CPU seconds of the current process to MLflow when it exits.
+
+    Every task logs a run to the experiment `RESOURCE_EXPERIMENT_NAME`, tagged by its profile key, from which
+    `generate_pod_resource_profile` derives the requests and limits. Logging happens after the task returned,
+    so it neither changes the result of the task nor fails it.
+
+    Args:
+        task_id (str): The task ID.
+        variant (str, optional): The variant of the task, e.g. the model class. Defaults to None.
+    """
+    start_time = time.time()
+
+    def _log_resource_usage():
+        usage = measure_resource_usage(start_time)
+        key = profile_key(task_id, variant)
+        print(
+            f"Resource usage of {key}: {usage['peak_rss_mb']:.0f} MiB peak RSS, "
+            f"{usage['cpu_seconds']:.0f} CPU seconds in {usage['wall_seconds']:.0f} seconds"
+        )
+        try:
+            import mlflow
+
+            mlflow.set_tracking_uri(os.getenv("MLFLOW_TRACKING_URI"))
+            client = mlflow.MlflowClient()
+            experiment = client.get_experiment_by_name(RESOURCE_EXPERIMENT_NAME)
+            experiment_id = (
+                experiment.experiment_id if experiment else client.create_experiment(RESOURCE_EXPERIMENT_NAME)
+            )
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            run = client.create_run(
+                experiment_id,
+                run_name=f"{timestamp}_{key}",
+                tags={"profile_key": key, "image": os.getenv("IMAGE_DIGEST", "")},
+            )
+            for metric, value in usage.items():
+                client.log_metric(run.info.run_id, metric, value)
+            client.set_terminated(run.info.run_id)
+        except Exception as error:
+            # the task itself succeeded, a missing measurement only keeps the previous profile
+            print(f"Could not log the resource usage: {error}")
+
+    atexit.register(_log_resource_usage)
+
+
+def _format_cpu(cores: float) -> str:
+    return f"{max(100, math.ceil(cores * 10) * 100)}m"
+
+
+def _format_memory(megabytes: float) -> str:
+    return f"{max(128, math.ceil(megabytes / 64) * 64)}Mi"
+
+
+def generate_pod_resource_profile(
+    quantile: float = 0.95, memory_headroom: float = 1.25, max_runs_per_task: int = 50
+) -> dict:
+    """
+    Derives the requests and limits of every task from the resource usage logged by previous runs.
+
+    The CPU request is the quantile of the average cores used, so the scheduler reserves the cores a task keeps
+    busy, e.g. for training. No CPU limit is set, tasks may use idle cores of the node beyond their request. The
+    memory request is the quantile of the peak RSS, and the memory limit the largest peak RSS, both with headroom,
+    so pods are packed by their usual peak and only OOM-killed far beyond anything measured.
+
+    Args:
+        quantile (float, optional): The quantile of the runs to request. Defaults to 0.95.
+        memory_headroom (float, optional): The factor applied to the measured memory. Defaults to 1.25.
+        max_runs_per_task (int, optional): The number of most recent runs per task to consider. Defaults to 50.
+
+    Returns:
+        dict: The profiled tasks, mapping every profile key to its "requests", "limits", and measurements.
+    """
+    import mlflow
+    import numpy as np
+
+    mlflow.set_tracking_uri(os.getenv("MLFLOW_TRACKING_URI"))
+    client = mlflow.MlflowClient()
+    experiment = client.get_experiment_by_name(RESOURCE_EXPERIMENT_NAME)
+    if experiment is None:
+        return {}
+
+    usages = defaultdict(list)
+    for run in client.search_runs(
+        experiment_ids=[experiment.experiment_id], order_by=["attributes.start_time DESC"], max_results=5000
+    ):
+        key = run.data.tags.get("profile_key")
+        metrics = run.data.metrics
+        if key and len(usages[key]) < max_runs_per_task and {"peak_rss_mb", "cpu_seconds"} <= set(metrics):
+            usages[key].append(metrics)
+
+    tasks = {}
+    for key, runs in sorted(usages.items()):
+        peak_rss_mb = np.array([run["peak_rss_mb"] for run in runs])
+        cores = np.array([run["cpu_seconds"] / max(run.get("wall_seconds", 0.0), 1.0) for run in runs])
+        tasks[key] = {
+            "requests": {
+                "cpu": _format_cpu(np.quantile(cores, quantile)),
+                "memory": _format_memory(np.quantile(peak_rss_mb, quantile) * memory_headroom),
+            },
+            "limits": {"memory": _format_memory(peak_rss_mb.max() * memory_headroom)},
+            "num_runs": len(runs),
+            "peak_rss_mb_p50": round(float(np.median(peak_rss_mb)), 1),
+            "cores_p50": round(float(np.median(cores)), 2),
+        }
+    return tasks
+
+
+if __name__ == "__main__":
+    # Updates the profile with the tasks measured by previous runs, tasks without runs keep their entries
+    profile = load_pod_resource_profile()
+    tasks = generate_pod_resource_profile(quantile=float(os.getenv("RESOURCE_QUANTILE", "0.95")))
+    profile["tasks"].update(tasks)
+    profile["recorded_at"] = time.strftime("%Y-%m-%d")
+    with open(get_profile_path(), "w") as f:
+        json.dump(profile, f, indent=2)
+        f.write("\n")
+    for key, resources in tasks.items():
+        print(f"Recorded {key} from {resources['num_runs']} runs: {resources['requests']}, {resources['limits']}")
@@ -0,0 +1,254 @@
+import json
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import boto3
+import numpy as np
+
+SCALABLE_DIMENSION = "sagemaker:variant:DesiredInstanceCount"
+
+
+def get_profile_path() -> str:
+    """
+    Get the file path of the recorded load-test profile relative to the current script's location.
+
+    Returns:
+        str: The absolute file path to 'profiles/sagemaker_load_test_profile.json'.
+    """
+    return f"{Path(__file__).parent.parent}/profiles/sagemaker_load_test_profile.json"
+
+
+def load_load_test_profile(profile_path: str = None) -> dict:
+    """
+    Loads a recorded load-test profile of the model.
+
+    Args:
+        profile_path (str, optional): The path to the profile. Defaults to the profile shipped in `profiles/`.
+
+    Returns:
+        dict: The load-test profile, containing the measured capacity per instance type.
+    """
+    with open(profile_path or get_profile_path()) as f:
+        return json.load(f)
+
+
+def choose_endpoint_sizing(
+    profile: dict,
+    expected_peak_invocations_per_minute: float,
+    target_utilization: float = 0.7,
+    min_instances: int = 1,
+) -> dict:
+    """
+    Chooses the cheapest instance type and the instance range to serve the expected peak traffic.
+
+    For every instance type in the profile, the target invocations per instance are its measured capacity at the
+    latency SLO times the target utilization. The number of instances needed at peak follows from that, and the
+    instance type with the lowest hourly cost at peak is chosen. Instance types recorded without a price cannot be
+    compared and are skipped, as are estimated instance types, which were never measured by a load test.
+
+    Args:
+        profile (dict): A load-test profile as returned by `load_load_test_profile`.
+        expected_peak_invocations_per_minute (float): The expected peak traffic of the endpoint.
+        target_utilization (float, optional): The share of the measured capacity to target. Defaults to 0.7.
+        min_instances (int, optional): The minimum number of instances. Defaults to 1.
+
+    Returns:
+        dict: A dictionary containing "instance_type", "min_instances", "max_instances",
+              and "target_invocations_per_instance".
+
+    Raises:
+        ValueError: If no measured instance type in the profile meets the latency SLO.
+    """
+    latency_slo_ms = profile["latency_slo_ms_p95"]
+    best_sizing, best_cost = None, math.inf
+    for instance_type, measurement in profile["instance_types"].items():
+        if measurement.get("estimated"):
+            print(f"Skipping {instance_type}, the profile has only an estimate for it")
+            continue
+        if "price_per_hour" not in measurement:
+            print(f"Skipping {instance_type}, the profile has no price for it")
+            continue
+        if measurement["p95_latency_ms"] > latency_slo_ms:
+            continue
+        target_invocations = measurement["max_invocations_per_minute"] * target_utilization
+        max_instances = max(min_instances, math.ceil(expected_peak_invocations_per_minute / target_invocations))
+        cost = max_instances * measurement["price_per_hour"]
+        if cost < best_cost:
+            best_cost = cost
+            best_sizing = {
+                "instance_type": instance_type,
+                "min_instances": min_instances,
+                "max_instances": max_instances,
+                "target_invocations_per_instance": round(target_invocations, 1),
+            }
+
+    if best_sizing is None:
+        raise ValueError(f"No measured instance type in the profile meets the latency SLO of {latency_slo_ms}ms")
+    print(f"Chosen endpoint sizing: {best_sizing} at {best_cost:.3f}$/h at peak")
+    return best_sizing
+
+
+def apply_autoscaling_policy(
+    endpoint_name: str,
+    min_instances: int,
+    max_instances: int,
+    target_invocations_per_instance: float,
+    region_name: str = None,
+    scale_in_cooldown: int = 300,
+    scale_out_cooldown: int = 60,
+    sage_client=None,
+    autoscaling_client=None,
+) -> str:
+    """
+    Registers the endpoint's production variant with Application Auto Scaling and attaches a target tracking
+    policy on the invocations per instance.
+
+    The endpoint has to be in service. The clients can be passed in, e.g. to stub them in tests.
+
+    Args:
+        endpoint_name (str): The name of the SageMaker endpoint.
+        min_instances (int): The minimum number of instances.
+        max_instances (int): The maximum number of instances.
+        target_invocations_per_instance (float): The invocations per instance and minute to scale on.
+        region_name (str, optional): The AWS region of the endpoint. Defaults to None.
+        scale_in_cooldown (int, optional): Seconds to wait after a scale-in. Defaults to 300.
+        scale_out_cooldown (int, optional): Seconds to wait after a scale-out. Defaults to 60.
+        sage_client (optional): A boto3 SageMaker client. Defaults to None.
+        autoscaling_client (optional): A boto3 Application Auto Scaling client. Defaults to None.
+
+    Returns:
+        str: The ARN of the scaling policy.
+    """
+    sage_client = sage_client or boto3.client("sagemaker", region_name=region_name)
+    autoscaling_client = autoscaling_client or boto3.client("application-autoscaling", region_name=region_name)
+
+    # MLflow generates the variant name, so it is read from the endpoint
+    variant_name = sage_client.describe_endpoint(EndpointName=endpoint_name)["ProductionVariants"][0]["VariantName"]
+    resource_id = f"endpoint/{endpoint_name}/variant/{variant_name}"
+
+    autoscaling_client.register_scalable_target(
+        ServiceNamespace="sagemaker",
+        ResourceId=resource_id,
+        ScalableDimension=SCALABLE_DIMENSION,
+        MinCapacity=min_instances,
+        MaxCapacity=max_instances,
+    )
+    response = autoscaling_client.put_scaling_policy(
+        PolicyName=f"{endpoint_name}-invocations-target-tracking",
+        ServiceNamespace="sagemaker",
+        ResourceId=resource_id,
+        ScalableDimension=SCALABLE_DIMENSION,
+        PolicyType="TargetTrackingScaling",
+        TargetTrackingScalingPolicyConfiguration={
+            "TargetValue": target_invocations_per_instance,
+            "PredefinedMetricSpecification": {"PredefinedMetricType": "SageMakerVariantInvocationsPerInstance"},
+            "ScaleInCooldown": scale_in_cooldown,
+            "ScaleOutCooldown": scale_out_cooldown,
+        },
+    )
+    print(f"Autoscaling {resource_id} between {min_instances} and {max_instances} instances")
+    return response["PolicyARN"]
+
+
+def remove_autoscaling(endpoint_name: str, region_name: str = None, sage_client=None, autoscaling_client=None) -> int:
+    """
+    Deregisters all scalable targets of an endpoint, which is required before its variants are replaced.
+
+    Args:
+        endpoint_name (str): The name of the SageMaker endpoint.
+        region_name (str, optional): The AWS region of the endpoint. Defaults to None.
+        sage_client (optional): A boto3 SageMaker client. Defaults to None.
+        autoscaling_client (optional): A boto3 Application Auto Scaling client. Defaults to None.
+
+    Returns:
+        int: The number of deregistered scalable targets.
+    """
+    sage_client = sage_client or boto3.client("sagemaker", region_name=region_name)
+    autoscaling_client = autoscaling_client or boto3.client("application-autoscaling", region_name=region_name)
+
+    # only the targets of the endpoint's variants are described, instead of all targets of the account
+    production_variants = sage_client.describe_endpoint(EndpointName=endpoint_name)["ProductionVariants"]
+    resource_ids = [f"endpoint/{endpoint_name}/variant/{variant['VariantName']}" for variant in production_variants]
+    removed = 0
+    for page in autoscaling_client.get_paginator("describe_scalable_targets").paginate(
+        ServiceNamespace="sagemaker", ResourceIds=resource_ids
+    ):
+        for target in page["ScalableTargets"]:
+            autoscaling_client.deregister_scalable_target(
+                ServiceNamespace="sagemaker",
+                ResourceId=target["ResourceId"],
+                ScalableDimension=target["ScalableDimension"],
+            )
+            removed += 1
+    return removed
+
+
+def record_load_test(
+    endpoint_name: str,
+    payload: str,
+    concurrency: int = 8,
+    num_requests: int = 400,
+    region_name: str = None,
+    runtime_client=None,
+) -> dict:
+    """
+    Measures the capacity of a single-instance endpoint, to be recorded in the load-test profile.
+
+    Args:
+        endpoint_name (str): The name of the SageMaker endpoint, deployed with one instance.
+        payload (str): A representative request in JSON format.
+        concurrency (int, optional): Number of concurrent clients. Defaults to 8.
+        num_requests (int, optional): Total number of requests to send. Defaults to 400.
+        region_name (str, optional): The AWS region of the endpoint. Defaults to None.
+        runtime_client (optional): A boto3 SageMaker runtime client. Defaults to None.
+
+    Returns:
+        dict: A dictionary containing "max_invocations_per_minute" and "p95_latency_ms".
+    """
+    runtime_client = runtime_client or boto3.client("sagemaker-runtime", region_name=region_name)
+
+    def _invoke(_) -> float:
+        start_time = time.perf_counter()
+        runtime_client.invoke_endpoint(EndpointName=endpoint_name, Body=payload, ContentType="application/json")
+        return time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(_invoke, range(num_requests)))
+    total_time = time.perf_counter() - start_time
+
+    return {
+        "max_invocations_per_minute": round(num_requests / total_time * 60, 1),
+        "p95_latency_ms": round(float(np.percentile(latencies, 95)) * 1000, 1),
+    }
+
+
+if __name__ == "__main__":
+    # Records the capacity of the instance type the endpoint is currently deployed on into the profile
+    sagemaker_endpoint_name = os.getenv("SAGEMAKER_ENDPOINT_NAME")
+    instance_type = os.getenv("SAGEMAKER_INSTANCE_TYPE")
+    price_per_hour = os.getenv("SAGEMAKER_INSTANCE_PRICE_PER_HOUR")
+    payload_path = os.getenv("LOAD_TEST_PAYLOAD_PATH")
+    aws_region = os.getenv("AWS_REGION")
+
+    profile = load_load_test_profile()
+    # the sizing compares instance types by their cost, so every recorded instance type needs a price
+    if price_per_hour is None and "price_per_hour" not in profile["instance_types"].get(instance_type, {}):
+        raise ValueError(f"Set SAGEMAKER_INSTANCE_PRICE_PER_HOUR to record the new instance type {instance_type}")
+
+    with open(payload_path) as f:
+        payload = f.read()
+
+    measurement = record_load_test(endpoint_name=sagemaker_endpoint_name, payload=payload, region_name=aws_region)
+    if price_per_hour is not None:
+        measurement["price_per_hour"] = float(price_per_hour)
+    profile["instance_types"].setdefault(instance_type, {}).update(measurement)
+    profile["instance_types"][instance_type].pop("estimated", None)
+    profile["recorded_at"] = time.strftime("%Y-%m-%d")
+    with open(get_profile_path(), "w") as f:
+        json.dump(profile, f, indent=2)
+        f.write("\n")
+    print(f"Recorded {instance_type}: {measurement}")
@@ -0,0 +1,252 @@
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+import mlflow
+import numpy as np
+from src.model_cache import ModelCache
+from src.prediction_cache import PredictionCache
+
+
+class MicroBatcher:
+    """MicroBatcher coalesces concurrent single-instance requests into batches before calling a predict function.
+
+    A batch is dispatched as soon as it holds `max_batch_size` instances or the first instance in it has waited
+    `max_wait_ms`, whichever comes first. A single worker thread calls the predict function.
+
+    Args:
+        predict_fn (Callable): A function mapping a batch of shape (N, ...) to N predictions.
+        max_batch_size (int, optional): The maximum number of instances per batch. Defaults to 32.
+        max_wait_ms (float, optional): The maximum time an instance waits for a batch to fill up. Defaults to 10.
+
+    Attributes:
+        num_batches (int): The number of batches dispatched so far.
+        num_instances (int): The number of instances predicted so far.
+
+    Methods:
+        submit(instance: np.array) -> Future:
+            Queues a single instance and returns a future of its prediction.
+
+        close():
+            Stops the worker thread after the queued instances have been predicted.
+    """
+
+    def __init__(self, predict_fn: Callable, max_batch_size: int = 32, max_wait_ms: float = 10):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000
+        self.num_batches = 0
+        self.num_instances = 0
+        self.__queue = queue.Queue()
+        self.__worker = threading.Thread(target=self._run, daemon=True)
+        self.__worker.start()
+
+    def submit(self, instance: np.array) -> Future:
+        future = Future()
+        self.__queue.put((instance, future))
+        return future
+
+    def close(self):
+        self.__queue.put(None)
+        self.__worker.join()
+
+    def _collect_batch(self) -> list:
+        """
+        Blocks for the first instance, then collects further instances until the batch is full or the wait
+        time of the first instance is up.
+
+        Returns:
+            list: A list of (instance, future) tuples, or None if the batcher is closed.
+        """
+        first_item = self.__queue.get()
+        if first_item is None:
+            return None
+        batch = [first_item]
+        deadline = time.perf_counter() + self.max_wait_seconds
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = self.__queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                # put the sentinel back, so the loop stops after this batch
+                self.__queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+            instances, futures = zip(*batch)
+            try:
+                predictions = np.asarray(self.predict_fn(np.stack(instances)))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            self.num_batches += 1
+            self.num_instances += len(batch)
+            for future, prediction in zip(futures, predictions):
+                future.set_result(prediction)
+
+
+def load_registered_model(model_name: str, model_stage: str = "Staging") -> Callable:
+    """
+    Loads a registered MLflow model as pyfunc and returns its predict function.
+
+    The artifacts are loaded from the local model cache, so restarts of the server do not download them again.
+
+    Args:
+        model_name (str): The name of the registered model.
+        model_stage (str, optional): The stage or the version of the model to load. Defaults to "Staging".
+
+    Returns:
+        Callable: The predict function of the model.
+    """
+    return ModelCache().load_pyfunc(model_name, model_stage).predict
+
+
+def make_handler(batcher: MicroBatcher, cache: PredictionCache = None, model_version: str = None) -> type:
+    """
+    Creates an HTTP request handler serving the MLflow scoring protocol through the given batcher.
+
+    Args:
+        batcher (MicroBatcher): The batcher to submit instances to.
+        cache (PredictionCache, optional): A cache to answer resubmitted images from. Defaults to None.
+        model_version (str, optional): The served model version, part of the cache keys. Defaults to None.
+
+    Returns:
+        type: A `BaseHTTPRequestHandler` subclass with a `/ping`, a `/metrics`, and an `/invocations` route.
+    """
+
+    class InvocationsHandler(BaseHTTPRequestHandler):
+        def _respond(self, status: int, body: dict):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == "/ping":
+                self._respond(200, {"status": "ok"})
+            elif self.path == "/metrics":
+                metrics = {"num_batches": batcher.num_batches, "num_instances": batcher.num_instances}
+                if cache is not None:
+                    metrics["cache"] = cache.stats()
+                self._respond(200, metrics)
+            else:
+                self._respond(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self):
+            if self.path != "/invocations":
+                self._respond(404, {"error": f"Unknown path {self.path}"})
+                return
+            content_length = int(self.headers.get("Content-Length", 0))
+            instances = json.loads(self.rfile.read(content_length))["instances"]
+            predictions = [None] * len(instances)
+            keys, futures = {}, {}
+            for index, instance in enumerate(instances):
+                if cache is not None:
+                    keys[index] = cache.make_key(model_version, instance)
+                    predictions[index] = cache.get(keys[index])
+                if predictions[index] is None:
+                    # every instance of a request is batched individually, so small requests are coalesced
+                    futures[index] = batcher.submit(np.asarray(instance))
+            try:
+                for index, future in futures.items():
+                    predictions[index] = future.result().tolist()
+                    if cache is not None:
+                        cache.put(keys[index], predictions[index])
+            except Exception as e:
+                self._respond(500, {"error": str(e)})
+                return
+            self._respond(200, {"predictions": predictions})
+
+        def log_message(self, format, *args):
+            # request logging per call would dominate the latency of small requests
+            pass
+
+    return InvocationsHandler
+
+
+def serve(
+    model_name: str,
+    model_stage: str = "Staging",
+    host: str = "0.0.0.0",
+    port: int = 8080,
+    max_batch_size: int = 32,
+    max_wait_ms: float = 10,
+    cache_max_entries: int = 10000,
+    cache_ttl_seconds: float = 3600,
+    cache_dir: str = None,
+):
+    """
+    Serves a registered MLflow model locally with micro-batching, using the same protocol as the SageMaker
+    endpoint, so clients like `query_endpoint` can be tested without AWS.
+
+    Args:
+        model_name (str): The name of the registered model.
+        model_stage (str, optional): The stage of the model to serve. Defaults to "Staging".
+        host (str, optional): The host to bind to. Defaults to "0.0.0.0".
+        port (int, optional): The port to listen on. Defaults to 8080.
+        max_batch_size (int, optional): The maximum number of instances per batch. Defaults to 32.
+        max_wait_ms (float, optional): The maximum time an instance waits for a batch. Defaults to 10.
+        cache_max_entries (int, optional): The maximum number of cached predictions, 0 disables the cache.
+            Defaults to 10000.
+        cache_ttl_seconds (float, optional): The time after which a cached prediction expires. Defaults to 3600.
+        cache_dir (str, optional): A directory to persist cached predictions to. Defaults to None.
+    """
+    mlflow_tracking_uri = os.getenv("MLFLOW_TRACKING_URI")
+    mlflow.set_tracking_uri(mlflow_tracking_uri)
+
+    # The stage is resolved to a version once, which keys the cache to the served model
+    client = mlflow.MlflowClient()
+    model_version = client.get_latest_versions(name=model_name, stages=[model_stage])[0].version
+    batcher = MicroBatcher(
+        predict_fn=load_registered_model(model_name, model_version),
+        max_batch_size=max_batch_size,
+        max_wait_ms=max_wait_ms,
+    )
+    cache = None
+    if cache_max_entries > 0:
+        cache = PredictionCache(max_entries=cache_max_entries, ttl_seconds=cache_ttl_seconds, disk_dir=cache_dir)
+    handler = make_handler(batcher, cache=cache, model_version=f"{model_name}/{model_version}")
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"Serving {model_name}/{model_stage} (version {model_version}) on {host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+        if batcher.num_batches:
+            print(f"Served {batcher.num_instances} instances in {batcher.num_batches} batches")
+        if cache is not None:
+            print(f"Prediction cache: {cache.stats()}")
+
+
+if __name__ == "__main__":
+    serve(
+        model_name=os.getenv("MODEL_NAME"),
+        model_stage=os.getenv("MODEL_STAGE", "Staging"),
+        port=int(os.getenv("PORT", "8080")),
+        max_batch_size=int(os.getenv("MAX_BATCH_SIZE", "32")),
+        max_wait_ms=float(os.getenv("MAX_WAIT_MS", "10")),
+        cache_max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "10000")),
+        cache_ttl_seconds=float(os.getenv("CACHE_TTL_SECONDS", "3600")),
+        cache_dir=os.getenv("CACHE_DIR"),
+    )
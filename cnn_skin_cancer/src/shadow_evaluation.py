@@ -0,0 +1,220 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+import mlflow
+import numpy as np
+from src.compare_models import select_best_model
+from src.deploy_model_to_sagemaker import get_deployed_model
+from src.model_cache import ModelCache
+from src.utils import AWSSession, load_npy_from_volume
+
+
+def load_replay_requests(aws_bucket: str, import_dict: dict, max_requests: int = 200) -> List[np.array]:
+    """
+    Loads the held-out test set as replay requests, each holding a single uint8 image as sent by clients.
+
+    Args:
+        aws_bucket (str): The AWS S3 bucket name for data storage.
+        import_dict (dict): A dictionary containing the "X_test_data_path" and optionally a "shared_volume_dir".
+        max_requests (int, optional): The maximum number of requests to replay. Defaults to 200.
+
+    Returns:
+        List[np.array]: A list of uint8 arrays of shape (1, 224, 224, 3).
+    """
+    file_key = import_dict.get("X_test_data_path")
+    X_test = None
+    if import_dict.get("shared_volume_dir"):
+        X_test = load_npy_from_volume(volume_dir=import_dict["shared_volume_dir"], file_key=file_key)
+    if X_test is None:
+        aws_session = AWSSession()
+        aws_session.set_sessions()
+        X_test = aws_session.download_array_from_s3(s3_bucket=aws_bucket, file_key=file_key)
+
+    # the pyfunc model expects raw pixels, test sets preprocessed before images were stored as uint8 are normalized
+    images = np.asarray(X_test[:max_requests])
+    if images.dtype != np.uint8:
+        images = np.rint(images * 255).astype(np.uint8)
+    return [images[index : index + 1] for index in range(len(images))]
+
+
+def replay_requests(predict_fn: Callable, requests: List[np.array], concurrency: int = 4) -> Tuple[list, np.array]:
+    """
+    Replays requests against a predict function with the given concurrency and measures the latency of each.
+
+    Args:
+        predict_fn (Callable): The predict function of the model.
+        requests (List[np.array]): The requests to replay.
+        concurrency (int, optional): The number of concurrent clients. Defaults to 4.
+
+    Returns:
+        Tuple[list, np.array]: A tuple containing the latencies in seconds and the predicted class per request.
+    """
+    # the first call builds the graph, so it is excluded from the measurement
+    predict_fn(requests[0])
+
+    def _predict(request: np.array) -> Tuple[float, int]:
+        start_time = time.perf_counter()
+        prediction = np.asarray(predict_fn(request))
+        return time.perf_counter() - start_time, int(np.argmax(prediction[0]))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(_predict, requests))
+    latencies, predicted_classes = zip(*results)
+    return list(latencies), np.asarray(predicted_classes)
+
+
+def shadow_evaluate(
+    baseline_predict_fn: Callable,
+    candidate_predict_fn: Callable,
+    requests: List[np.array],
+    concurrency: int = 4,
+    max_p95_latency_regression: float = 0.2,
+    min_agreement: float = 0.9,
+) -> dict:
+    """
+    Replays the same requests against the baseline and the candidate concurrently and compares their latency
+    distributions and predictions.
+
+    Args:
+        baseline_predict_fn (Callable): The predict function of the model currently in production.
+        candidate_predict_fn (Callable): The predict function of the candidate model.
+        requests (List[np.array]): The requests to replay.
+        concurrency (int, optional): The number of concurrent clients per model. Defaults to 4.
+        max_p95_latency_regression (float, optional): The maximum relative increase of the p95 latency.
+            Defaults to 0.2.
+        min_agreement (float, optional): The minimum share of requests with the same predicted class.
+            Defaults to 0.9.
+
+    Returns:
+        dict: A dictionary containing the latency percentiles in ms, the agreement, whether the candidate
+              "passed", and the "reasons" if it did not.
+    """
+    # both models receive the replayed traffic at the same time, as in a shadow deployment
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        baseline_future = executor.submit(replay_requests, baseline_predict_fn, requests, concurrency)
+        candidate_future = executor.submit(replay_requests, candidate_predict_fn, requests, concurrency)
+        baseline_latencies, baseline_classes = baseline_future.result()
+        candidate_latencies, candidate_classes = candidate_future.result()
+
+    report = {
+        "num_requests": len(requests),
+        "baseline_p50_ms": round(float(np.percentile(baseline_latencies, 50)) * 1000, 1),
+        "baseline_p95_ms": round(float(np.percentile(baseline_latencies, 95)) * 1000, 1),
+        "candidate_p50_ms": round(float(np.percentile(candidate_latencies, 50)) * 1000, 1),
+        "candidate_p95_ms": round(float(np.percentile(candidate_latencies, 95)) * 1000, 1),
+        "agreement": round(float(np.mean(baseline_classes == candidate_classes)), 4),
+    }
+
+    reasons = []
+    if report["candidate_p95_ms"] > report["baseline_p95_ms"] * (1 + max_p95_latency_regression):
+        reasons.append(f"p95 latency {report['candidate_p95_ms']}ms vs. {report['baseline_p95_ms']}ms")
+    if report["agreement"] < min_agreement:
+        reasons.append(f"agreement {report['agreement']} below {min_agreement}")
+    report["passed"] = not reasons
+    report["reasons"] = reasons
+    return report
+
+
+def run_shadow_evaluation(
+    mlflow_experiment_id: str,
+    input_dict: dict,
+    import_dict: dict,
+    aws_bucket: str,
+    sagemaker_endpoint_name: str,
+    metric: str = "prediction_accuracy",
+    max_requests: int = 200,
+    concurrency: int = 4,
+    max_p95_latency_regression: float = 0.2,
+    min_agreement: float = 0.9,
+    model_versions: dict = None,
+) -> dict:
+    """
+    Evaluates the best model of a comparison against the model the SageMaker endpoint currently serves, before
+    it is promoted to "Staging". The result is logged as an MLflow run and passed on to `compare_models`.
+
+    Args:
+        mlflow_experiment_id (str): The ID of the MLflow experiment to log the evaluation to.
+        input_dict (dict): A dictionary containing the names and run IDs of the MLflow models to compare.
+        import_dict (dict): A dictionary containing the paths of the preprocessed data.
+        aws_bucket (str): The AWS S3 bucket name for data storage.
+        sagemaker_endpoint_name (str): The name of the SageMaker endpoint serving the baseline.
+        metric (str, optional): The metric to select the candidate by. Defaults to "prediction_accuracy".
+        max_requests (int, optional): The maximum number of requests to replay. Defaults to 200.
+        concurrency (int, optional): The number of concurrent clients per model. Defaults to 4.
+        max_p95_latency_regression (float, optional): The maximum relative increase of the p95 latency.
+            Defaults to 0.2.
+        min_agreement (float, optional): The minimum share of requests with the same predicted class.
+            Defaults to 0.9.
+        model_versions (dict, optional): The registered version per model name, as returned by the training.
+            Defaults to None, in which case the version registered from the run of the best model is used.
+
+    Returns:
+        dict: The shadow report, including the candidate and baseline model names and versions.
+
+    Raises:
+        None
+    """
+    mlflow_tracking_uri = os.getenv("MLFLOW_TRACKING_URI")
+    mlflow.set_tracking_uri(mlflow_tracking_uri)
+
+    candidate_model_name, candidate_model_version = select_best_model(
+        input_dict, metric, mlflow_tracking_uri, model_versions
+    )
+    deployed_model = get_deployed_model(sagemaker_endpoint_name, region_name=os.getenv("AWS_REGION"))
+    report = {
+        "candidate_model_name": candidate_model_name,
+        "candidate_model_version": candidate_model_version,
+        "baseline_model_name": None,
+        "baseline_model_version": None,
+        "passed": True,
+        "reasons": [],
+    }
+    if deployed_model is None or deployed_model["model_name"] is None:
+        print("No model is deployed yet, skipping shadow evaluation")
+        return report
+    report["baseline_model_name"] = deployed_model["model_name"]
+    report["baseline_model_version"] = deployed_model["model_version"]
+    if report["baseline_model_name"] == candidate_model_name and report["baseline_model_version"] == str(
+        candidate_model_version
+    ):
+        print("The candidate is already deployed, skipping shadow evaluation")
+        return report
+
+    print("\n> Loading models...")
+    # the baseline is loaded on every evaluation until it is replaced, so it is kept in the local model cache
+    model_cache = ModelCache()
+    baseline_model = model_cache.load_pyfunc(report["baseline_model_name"], report["baseline_model_version"])
+    candidate_model = model_cache.load_pyfunc(candidate_model_name, candidate_model_version)
+    requests = load_replay_requests(aws_bucket=aws_bucket, import_dict=import_dict, max_requests=max_requests)
+
+    print("\n> Replaying requests...")
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    with mlflow.start_run(experiment_id=mlflow_experiment_id, run_name=f"{timestamp}_ShadowEvaluation"):
+        report.update(
+            shadow_evaluate(
+                baseline_predict_fn=baseline_model.predict,
+                candidate_predict_fn=candidate_model.predict,
+                requests=requests,
+                concurrency=concurrency,
+                max_p95_latency_regression=max_p95_latency_regression,
+                min_agreement=min_agreement,
+            )
+        )
+        mlflow.set_tags(
+            {
+                "candidate_model": f"{candidate_model_name}/{candidate_model_version}",
+                "baseline_model": f"{report['baseline_model_name']}/{report['baseline_model_version']}",
+                "shadow_passed": report["passed"],
+            }
+        )
+        mlflow.log_metrics(
+            {
+                key: report[key]
+                for key in ["baseline_p50_ms", "baseline_p95_ms", "candidate_p50_ms", "candidate_p95_ms", "agreement"]
+            }
+        )
+    print(f"Shadow report: {report}")
+    return report
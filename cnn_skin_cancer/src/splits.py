@@ -0,0 +1,149 @@
+import os
+from typing import List, Tuple
+
+import numpy as np
+
+
+def split_index_path(X_train_data_path: str) -> str:
+    """
+    Get the path of the split index belonging to a preprocessed train set.
+
+    Args:
+        X_train_data_path (str): The path of the preprocessed train images.
+
+    Returns:
+        str: The path of 'split_index.json' next to the train images.
+    """
+    return f"{os.path.dirname(X_train_data_path)}/split_index.json"
+
+
+def compute_class_weights(labels: np.array) -> dict:
+    """
+    Computes class weights inversely proportional to the class frequencies, as in sklearn's "balanced" mode.
+
+    Args:
+        labels (np.array): The labels, either as class indices or one-hot encoded.
+
+    Returns:
+        dict: A dictionary mapping every class index, as string to be JSON serializable, to its weight.
+    """
+    labels = np.asarray(labels)
+    if labels.ndim > 1:
+        labels = np.argmax(labels, axis=1)
+    classes, counts = np.unique(labels, return_counts=True)
+    return {str(label): round(float(len(labels) / (len(classes) * count)), 6) for label, count in zip(classes, counts)}
+
+
+def make_stratified_splits(
+    labels: np.array, validation_fraction: float = 0.2, num_folds: int = 3, seed: int = 11
+) -> Tuple[np.array, dict]:
+    """
+    Creates a seeded, stratified split of a train set into folds and a validation set, laid out contiguously.
+
+    The returned order arranges the rows as [fold 0 | fold 1 | ... | validation]. Applied once during
+    preprocessing, every split is a contiguous range of rows afterwards, which training reads as slices or from
+    a memory map without copying the data. Every class is split by the same fractions.
+
+    Args:
+        labels (np.array): The labels of the train set, either as class indices or one-hot encoded.
+        validation_fraction (float, optional): The share of every class held out for validation. Defaults to 0.2.
+        num_folds (int, optional): The number of cross-validation folds of the remaining rows. Defaults to 3.
+        seed (int, optional): The seed of the split. Defaults to 11.
+
+    Returns:
+        Tuple[np.array, dict]: The order to apply to the train set, and the split index containing the row ranges
+            of "train", "validation", and "folds" as [start, end), and the "class_weights" of the train rows.
+    """
+    labels = np.asarray(labels)
+    if labels.ndim > 1:
+        labels = np.argmax(labels, axis=1)
+    rng = np.random.default_rng(seed)
+
+    # one group per fold and a last group for validation
+    groups = [[] for _ in range(num_folds + 1)]
+    for label in np.unique(labels):
+        members = rng.permutation(np.flatnonzero(labels == label))
+        num_validation = int(round(len(members) * validation_fraction))
+        groups[-1].append(members[:num_validation])
+        for fold, fold_members in enumerate(np.array_split(members[num_validation:], num_folds)):
+            groups[fold].append(fold_members)
+
+    # classes are mixed within every group, so batches read in order are not sorted by class
+    parts = [rng.permutation(np.concatenate(group)) for group in groups]
+    order = np.concatenate(parts).astype(np.int64)
+    bounds = np.cumsum([0] + [len(part) for part in parts]).tolist()
+
+    return order, split_index_from_bounds(bounds, labels[order], validation_fraction=validation_fraction, seed=seed)
+
+
+def split_index_from_bounds(bounds: List[int], labels: np.array, validation_fraction: float, seed: int) -> dict:
+    """
+    Creates the split index of a train set laid out as [fold 0 | fold 1 | ... | validation].
+
+    Args:
+        bounds (List[int]): The first row of every fold, the first row of the validation set, and the number of
+            rows.
+        labels (np.array): The labels of the train set in its stored order, as class indices.
+        validation_fraction (float): The share of every class held out for validation.
+        seed (int): The seed of the split.
+
+    Returns:
+        dict: The split index containing the row ranges of "train", "validation", and "folds" as [start, end),
+            and the "class_weights" of the train rows.
+    """
+    num_folds = len(bounds) - 2
+    return {
+        "seed": seed,
+        "validation_fraction": validation_fraction,
+        "num_folds": num_folds,
+        "num_samples": bounds[-1],
+        "train": [0, bounds[num_folds]],
+        "validation": [bounds[num_folds], bounds[-1]],
+        "folds": [[bounds[fold], bounds[fold + 1]] for fold in range(num_folds)],
+        "class_weights": compute_class_weights(labels[: bounds[num_folds]]),
+    }
+
+
+def contiguous_split_index(
+    num_samples: int, validation_fraction: float = 0.2, num_folds: int = 3, seed: int = 11
+) -> dict:
+    """
+    Creates a split index over rows in their stored order, for train sets preprocessed without a split index.
+
+    Like Keras' `validation_split`, the last rows are held out for validation.
+
+    Args:
+        num_samples (int): The number of rows of the train set.
+        validation_fraction (float, optional): The share of rows held out for validation. Defaults to 0.2.
+        num_folds (int, optional): The number of cross-validation folds of the remaining rows. Defaults to 3.
+        seed (int, optional): The seed of the row order during training. Defaults to 11.
+
+    Returns:
+        dict: A split index like the one returned by `make_stratified_splits`.
+    """
+    num_train = num_samples - int(round(num_samples * validation_fraction))
+    bounds = np.linspace(0, num_train, num_folds + 1).astype(int).tolist()
+    return {
+        "seed": seed,
+        "validation_fraction": validation_fraction,
+        "num_folds": num_folds,
+        "num_samples": num_samples,
+        "train": [0, num_train],
+        "validation": [num_train, num_samples],
+        "folds": [[bounds[fold], bounds[fold + 1]] for fold in range(num_folds)],
+    }
+
+
+def fold_ranges(split_index: dict, fold: int) -> Tuple[List[list], list]:
+    """
+    Get the row ranges to train and evaluate on for a cross-validation fold.
+
+    Args:
+        split_index (dict): A split index as returned by `make_stratified_splits`.
+        fold (int): The fold held out for evaluation.
+
+    Returns:
+        Tuple[List[list], list]: The ranges of the other folds to train on and the range of the held-out fold.
+    """
+    folds = split_index["folds"]
+    return [folds[index] for index in range(len(folds)) if index != fold], folds[fold]
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+
+import mlflow
+
+
+def get_code_version() -> str:
+    """
+    Returns the version of the pipeline code, baked into the images at build time.
+
+    Returns:
+        str: The code version, e.g. a git commit SHA, or "unknown" if not set.
+    """
+    return os.getenv("CODE_VERSION", "unknown")
+
+
+def get_image_digest() -> str:
+    """
+    Returns the reference of the image the stage runs in, as passed on by the DAG pinned by its digest.
+
+    Returns:
+        str: The pinned image reference, or "unknown" if not set.
+    """
+    return os.getenv("IMAGE_DIGEST", "unknown")
+
+
+def compute_fingerprint(stage: str, **inputs) -> str:
+    """
+    Computes a fingerprint of a pipeline stage from everything that determines its outputs.
+
+    The code version and image digest are always included, so a new image invalidates all cached stages.
+
+    Args:
+        stage (str): The name of the stage, e.g. "preprocessing".
+        **inputs: The inputs of the stage, e.g. a data manifest or the model params. Must be JSON serializable.
+
+    Returns:
+        str: The SHA-256 hex digest of the stage inputs.
+    """
+    payload = {
+        "stage": stage,
+        "code_version": get_code_version(),
+        "image_digest": get_image_digest(),
+        "inputs": inputs,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def lookup_stage_cache(mlflow_experiment_id: str, stage: str, fingerprint: str) -> dict:
+    """
+    Looks up the outputs of the latest finished run of a stage with the same fingerprint.
+
+    Args:
+        mlflow_experiment_id (str): The MLflow experiment ID to search in.
+        stage (str): The name of the stage.
+        fingerprint (str): The fingerprint of the stage inputs.
+
+    Returns:
+        dict: The outputs recorded by the previous run, or None on a cache miss.
+
+    Raises:
+        None
+    """
+    runs = mlflow.search_runs(
+        experiment_ids=[mlflow_experiment_id],
+        filter_string=(
+            f"tags.stage = '{stage}' and tags.stage_fingerprint = '{fingerprint}' and attributes.status = 'FINISHED'"
+        ),
+        order_by=["attributes.start_time DESC"],
+        max_results=1,
+        output_format="list",
+    )
+    if not runs:
+        print(f"Stage cache miss for {stage}: {fingerprint}")
+        return None
+
+    run = runs[0]
+    print(f"Stage cache hit for {stage}: reusing outputs of run {run.info.run_id}")
+    return json.loads(run.data.tags["stage_outputs"])
+
+
+def record_stage_cache(stage: str, fingerprint: str, outputs: dict) -> None:
+    """
+    Records the fingerprint and outputs of a stage on the active MLflow run.
+
+    The run only becomes a cache entry once it has finished successfully.
+
+    Args:
+        stage (str): The name of the stage.
+        fingerprint (str): The fingerprint of the stage inputs.
+        outputs (dict): The outputs of the stage. Must be JSON serializable.
+
+    Returns:
+        None
+
+    Raises:
+        None
+    """
+    mlflow.set_tags(
+        {
+            "stage": stage,
+            "stage_fingerprint": fingerprint,
+            "stage_outputs": json.dumps(outputs, default=str),
+        }
+    )
@@ -0,0 +1,247 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Set, Tuple
+
+import numpy as np
+from src.chunked_dataset import ChunkedArrayWriter, S3ChunkStore
+from src.deduplication import DuplicateFilter
+from src.splits import make_stratified_splits, split_index_from_bounds
+from src.utils import AWSSession, NpyVolumeWriter, timeit
+
+
+def rows_per_batch(
+    memory_budget_mb: int,
+    image_shape: Tuple[int, ...],
+    chunk_bytes: int = 8 * 1024 * 1024,
+    compression_workers: int = 8,
+) -> int:
+    """
+    Derives the number of images per batch of the streaming preprocessing from a memory budget.
+
+    Per image, the decoded list and the batch array of the current and the prefetched batch are held, and the
+    deduplication converts the batch to float32 once. The writer holds up to two chunks per compression thread,
+    raw and compressed. Labels, hashes, and the interpreter are not accounted for and are covered by the headroom
+    of the pod limit above the budget.
+
+    Args:
+        memory_budget_mb (int): The memory the image data may use, in MiB.
+        image_shape (Tuple[int, ...]): The shape of an image, e.g. (224, 224, 3).
+        chunk_bytes (int, optional): The uncompressed size of a chunk of the writer. Defaults to 8 MiB.
+        compression_workers (int, optional): The number of compression threads of the writer. Defaults to 8.
+
+    Returns:
+        int: The number of images per batch.
+
+    Raises:
+        ValueError: If the budget does not even cover the writer.
+    """
+    image_bytes = int(np.prod(image_shape))
+    writer_bytes = (2 * compression_workers + 1) * chunk_bytes * 2
+    available_bytes = memory_budget_mb * 1024 * 1024 - writer_bytes
+    if available_bytes <= 0:
+        raise ValueError(f"A memory budget of {memory_budget_mb} MiB does not cover the writer's {writer_bytes} bytes")
+    # uint8 list and array of the current and the prefetched batch, and a float32 copy for the hashes
+    return max(1, available_bytes // (image_bytes * (2 + 2 + 4)))
+
+
+def iter_image_batches(
+    aws_session: AWSSession,
+    aws_bucket: str,
+    imnames: List[str],
+    batch_size: int,
+    image_shape: Tuple[int, ...],
+    max_workers: int = 16,
+    s3_client=None,
+) -> Iterator[Tuple[int, np.array]]:
+    """
+    Reads images in batches, while the next batch is downloaded by the parallel loader.
+
+    Args:
+        aws_session (AWSSession): The session to read the images with.
+        aws_bucket (str): The AWS S3 bucket name of the images.
+        imnames (List[str]): The names of the image files in the order to read them.
+        batch_size (int): The number of images per batch.
+        image_shape (Tuple[int, ...]): The shape of every image.
+        max_workers (int, optional): The number of concurrent downloads. Defaults to 16.
+        s3_client (botocore.client.S3, optional): The S3 client shared by all downloads. Defaults to None, in which
+            case a client with a connection per worker is created.
+
+    Returns:
+        Iterator[Tuple[int, np.array]]: The position of the first image of a batch in `imnames` and the batch
+            as uint8 array of shape (N, *image_shape).
+    """
+    # the client is created here and not per batch in the prefetch thread, as the boto3 session is not thread-safe
+    s3_client = s3_client or aws_session.get_s3_client(max_pool_connections=max_workers)
+
+    def _read_batch(batch_imnames: List[str]) -> np.array:
+        batch = np.empty((len(batch_imnames), *image_shape), dtype=np.uint8)
+        images = aws_session.read_images_from_s3(aws_bucket, batch_imnames, max_workers, s3_client=s3_client)
+        for index, image in enumerate(images):
+            batch[index] = image
+        return batch
+
+    starts = list(range(0, len(imnames), batch_size))
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        if starts:
+            next_batch = prefetcher.submit(_read_batch, imnames[:batch_size])
+        for batch_index, start in enumerate(starts):
+            batch = next_batch.result()
+            if batch_index + 1 < len(starts):
+                next_start = starts[batch_index + 1]
+                next_batch = prefetcher.submit(_read_batch, imnames[next_start : next_start + batch_size])
+            yield start, batch
+
+
+@timeit
+def stream_preprocessing(
+    aws_session: AWSSession,
+    aws_bucket: str,
+    path_raw_data: str,
+    class_names: List[str],
+    X_train_data_path: str,
+    X_test_data_path: str,
+    shared_volume_dir: str = None,
+    memory_budget_mb: int = 2048,
+    deduplicate: bool = True,
+    max_hash_distance: int = 3,
+    validation_fraction: float = 0.2,
+    num_folds: int = 3,
+    split_seed: int = 11,
+    codec: str = "zstd",
+    max_workers: int = 16,
+    valid_imnames: Set[str] = None,
+) -> dict:
+    """
+    Preprocesses data sets larger than the memory of the pod, writing the images as chunked arrays batch by batch.
+
+    Only the keys and labels are held for the whole data set. The stratified split is drawn from the labels
+    upfront, so the train images are read directly in their stored order [fold 0 | ... | validation], and the
+    test images in a seeded shuffle. Every batch is deduplicated against all images seen before and appended to
+    the writers, which compress and write full chunks as they go. The row ranges of the split index are counted
+    from the kept images, so duplicates shrink the folds like in the in-memory preprocessing.
+
+    Args:
+        aws_session (AWSSession): The session to read and write with.
+        aws_bucket (str): S3 Bucket to read raw data from and write preprocessed data.
+        path_raw_data (str): The S3 path of the raw data, containing a "train" and a "test" folder per class.
+        class_names (List[str]): The sorted class names, their position is the label.
+        X_train_data_path (str): The key to write the train images to.
+        X_test_data_path (str): The key to write the test images to.
+        shared_volume_dir (str, optional): Mount path of a shared volume to additionally write the images to as
+            .npy files. Defaults to None.
+        memory_budget_mb (int, optional): The memory the image data may use, in MiB. Defaults to 2048.
+        deduplicate (bool, optional): Whether to drop duplicates, see `data_preprocessing`. Defaults to True.
+        max_hash_distance (int, optional): The maximum Hamming distance of near duplicates. Defaults to 3.
+        validation_fraction (float, optional): The share of every class held out for validation. Defaults to 0.2.
+        num_folds (int, optional): The number of cross-validation folds of the train set. Defaults to 3.
+        split_seed (int, optional): The seed of the shuffles and the split. Defaults to 11.
+        codec (str, optional): The compression codec of the chunked arrays. Defaults to "zstd".
+        max_workers (int, optional): The number of concurrent downloads. Defaults to 16.
+        valid_imnames (Set[str], optional): The file names of the images passing the validation, others are
+            skipped. Defaults to None, which keeps all images.
+
+    Returns:
+        dict: The uint8 labels "y_train" and "y_test" in stored order, the "split_index", the "metrics" of the
+            deduplication, and the "class_sizes" of the kept train and test images per class.
+    """
+    # Only the keys are listed upfront, the labels follow from the class folders
+    train_imnames, test_imnames, train_labels, test_labels = [], [], [], []
+    for class_index, class_name in enumerate(class_names):
+        class_train_imnames, class_test_imnames = [
+            [
+                imname
+                for imname in aws_session.list_files_in_bucket(f"{path_raw_data}{split}/{class_name}")
+                if valid_imnames is None or imname in valid_imnames
+            ]
+            for split in ["train", "test"]
+        ]
+        train_imnames += class_train_imnames
+        test_imnames += class_test_imnames
+        train_labels += [class_index] * len(class_train_imnames)
+        test_labels += [class_index] * len(class_test_imnames)
+    train_labels = np.array(train_labels, dtype=np.uint8)
+    test_labels = np.array(test_labels, dtype=np.uint8)
+
+    train_order, planned_split_index = make_stratified_splits(
+        train_labels, validation_fraction=validation_fraction, num_folds=num_folds, seed=split_seed
+    )
+    segments = planned_split_index["folds"] + [planned_split_index["validation"]]
+    test_order = np.random.default_rng(split_seed).permutation(len(test_imnames))
+
+    s3_client = aws_session.get_s3_client(max_pool_connections=max_workers)
+    image_shape = aws_session.read_image_from_s3(aws_bucket, train_imnames[train_order[0]], s3_client).shape
+    batch_size = rows_per_batch(memory_budget_mb, image_shape)
+    print(f"Streaming {len(train_imnames)} train and {len(test_imnames)} test images in batches of {batch_size}")
+
+    store = S3ChunkStore(s3_client, aws_bucket)
+    train_filter = DuplicateFilter(max_distance=max_hash_distance) if deduplicate else None
+    test_filter = DuplicateFilter(max_distance=max_hash_distance) if deduplicate else None
+    train_test_overlap = 0
+
+    def _stream(file_key: str, order: np.array, labels: np.array, is_test: bool, bounds: List[int] = None) -> list:
+        """Streams the images in the given order into the writers and returns the labels of the kept images."""
+        nonlocal train_test_overlap
+        writer = ChunkedArrayWriter(store, file_key, image_shape, np.uint8, codec=codec)
+        volume_writer = None
+        if shared_volume_dir:
+            volume_writer = NpyVolumeWriter(shared_volume_dir, file_key, image_shape, np.uint8)
+        kept_labels = [np.empty(0, dtype=np.uint8)]
+        for start, end in segments if not is_test else [[0, len(order)]]:
+            segment_order = order[start:end]
+            imnames = [(test_imnames if is_test else train_imnames)[index] for index in segment_order]
+            for batch_start, batch in iter_image_batches(
+                aws_session, aws_bucket, imnames, batch_size, image_shape, max_workers, s3_client
+            ):
+                batch_labels = labels[segment_order[batch_start : batch_start + len(batch)]]
+                if deduplicate:
+                    if is_test:
+                        is_duplicate = train_filter.find_duplicates(batch, insert=False)
+                        train_test_overlap += int(is_duplicate.sum())
+                        is_duplicate[~is_duplicate] = test_filter.find_duplicates(batch[~is_duplicate])
+                    else:
+                        is_duplicate = train_filter.find_duplicates(batch)
+                    batch, batch_labels = batch[~is_duplicate], batch_labels[~is_duplicate]
+                writer.append(batch)
+                if volume_writer:
+                    volume_writer.append(batch)
+                kept_labels.append(batch_labels)
+            if bounds is not None:
+                bounds.append(writer.num_rows)
+        writer.close()
+        if volume_writer:
+            volume_writer.close()
+        return kept_labels
+
+    print("\n> Streaming train images...")
+    bounds = [0]
+    y_train = np.concatenate(_stream(X_train_data_path, train_order, train_labels, is_test=False, bounds=bounds))
+    metrics = {}
+    if deduplicate:
+        # the overlap check of the test images counts into the train filter as well
+        metrics = {
+            "train_exact_duplicates": train_filter.num_exact_duplicates,
+            "train_near_duplicates": train_filter.num_near_duplicates,
+        }
+
+    print("\n> Streaming test images...")
+    y_test = np.concatenate(_stream(X_test_data_path, test_order, test_labels, is_test=True))
+    if deduplicate:
+        metrics.update(
+            {
+                "test_exact_duplicates": test_filter.num_exact_duplicates,
+                "test_near_duplicates": test_filter.num_near_duplicates,
+                "train_test_overlap": train_test_overlap,
+            }
+        )
+        print(f"Removed {train_test_overlap} test images overlapping with the train set")
+
+    split_index = split_index_from_bounds(bounds, y_train, validation_fraction=validation_fraction, seed=split_seed)
+    return {
+        "y_train": y_train,
+        "y_test": y_test,
+        "split_index": split_index,
+        "metrics": metrics,
+        "class_sizes": {
+            class_name: (int((y_train == index).sum()), int((y_test == index).sum()))
+            for index, class_name in enumerate(class_names)
+        },
+    }
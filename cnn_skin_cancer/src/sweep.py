@@ -0,0 +1,123 @@
+import itertools
+import os
+import random
+from typing import List
+
+import mlflow
+
+
+class Sweep_Strategy:
+    """This class includes the supported strategies to expand a search space."""
+
+    Grid = "grid"
+    Random = "random"
+    Halving = "halving"
+
+
+def expand_search_space(
+    base_params: dict,
+    search_space: dict,
+    strategy: str = Sweep_Strategy.Grid,
+    num_trials: int = 8,
+    seed: int = 11,
+) -> List[dict]:
+    """
+    Expands a search space into a list of trials, each containing a full set of model params.
+
+    For the "grid" strategy every combination of the search space is returned. The "random" and "halving"
+    strategies sample `num_trials` combinations. For "halving", the trials are pruned at rung epochs during
+    training (see `src.model.callbacks.PruningCallback`), so all of them are started with the full epoch budget.
+
+    Args:
+        base_params (dict): The default model params every trial starts from.
+        search_space (dict): A dictionary mapping a model param to a list of candidate values.
+        strategy (str, optional): One of "grid", "random", or "halving". Defaults to "grid".
+        num_trials (int, optional): Number of trials to sample for "random" and "halving". Defaults to 8.
+        seed (int, optional): Seed used to sample trials. Defaults to 11.
+
+    Returns:
+        List[dict]: A list of trials of the form {"trial_id": str, "model_params": dict}.
+
+    Raises:
+        ValueError: If the strategy is unknown.
+    """
+    keys = sorted(search_space)
+    combinations = [dict(zip(keys, values)) for values in itertools.product(*(search_space[key] for key in keys))]
+
+    match strategy:
+        case Sweep_Strategy.Grid:
+            selected = combinations
+        case Sweep_Strategy.Random | Sweep_Strategy.Halving:
+            rng = random.Random(seed)
+            selected = rng.sample(combinations, k=min(num_trials, len(combinations)))
+        case _:
+            raise ValueError(f"Unknown sweep strategy: {strategy}")
+
+    trials = []
+    for index, overrides in enumerate(selected):
+        trials.append(
+            {
+                "trial_id": f"trial_{index:03d}",
+                "model_params": {**base_params, **overrides},
+            }
+        )
+    return trials
+
+
+def halving_rungs(max_epochs: int, min_epochs: int = 1, reduction_factor: int = 3) -> List[int]:
+    """
+    Computes the epochs at which trials are compared when using successive halving.
+
+    Args:
+        max_epochs (int): The epoch budget of a single trial.
+        min_epochs (int, optional): The epoch of the first rung. Defaults to 1.
+        reduction_factor (int, optional): Factor by which the budget grows between rungs. Defaults to 3.
+
+    Returns:
+        List[int]: The rung epochs, e.g. [1, 3, 9] for max_epochs=10.
+    """
+    rungs = []
+    epoch = min_epochs
+    while epoch < max_epochs:
+        rungs.append(epoch)
+        epoch *= reduction_factor
+    return rungs
+
+
+def select_sweep_winners(trial_results: List[dict], metric: str = "prediction_accuracy") -> dict:
+    """
+    Selects the best non-pruned trial per model class and registers it in the MLflow Registry.
+
+    Args:
+        trial_results (List[dict]): The results of the trainings, each containing "run_id", "model_name"
+            and "pruned".
+        metric (str, optional): The metric to rank trials. Defaults to "prediction_accuracy".
+
+    Returns:
+        dict: A dictionary containing the names and run IDs of the winning models, as used by `compare_models`.
+
+    Raises:
+        ValueError: If all trials have been pruned.
+    """
+    mlflow_tracking_uri = os.getenv("MLFLOW_TRACKING_URI")
+    mlflow.set_tracking_uri(mlflow_tracking_uri)
+    client = mlflow.MlflowClient(tracking_uri=mlflow_tracking_uri)
+
+    best_trials = {}
+    for result in trial_results:
+        if result.get("pruned"):
+            continue
+        value = client.get_run(result["run_id"]).data.metrics[metric]
+        model_name = result["model_name"]
+        if model_name not in best_trials or value > best_trials[model_name][1]:
+            best_trials[model_name] = (result["run_id"], value)
+
+    if not best_trials:
+        raise ValueError("All trials of the sweep have been pruned")
+
+    winners = {}
+    for model_name, (run_id, value) in best_trials.items():
+        print(f"Sweep winner {model_name}: run {run_id} with {metric}={value}")
+        mlflow.register_model(f"runs:/{run_id}/{model_name}", model_name)
+        winners[model_name] = run_id
+    return winners
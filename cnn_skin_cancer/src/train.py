@@ -1,18 +1,157 @@
 import json
 import os
+import tempfile
 from datetime import datetime
 from enum import Enum
-from typing import Tuple
+from typing import List, Tuple
 
 import mlflow
-import mlflow.keras
+import mlflow.pyfunc
 import numpy as np
 from keras import backend as K
 from keras.callbacks import ReduceLROnPlateau
-from sklearn.metrics import accuracy_score
-from sklearn.model_selection import KFold
+from sklearn.metrics import accuracy_score, recall_score
+from src.mlflow_logging import AsyncMlflowLogger
+from src.model.callbacks import MlflowMetricsCallback
+from src.model.pyfunc_wrapper import SkinCancerImageModel
+from src.model.sequences import SliceSequence
 from src.model.utils import Model_Class, get_model
-from src.utils import AWSSession
+from src.splits import (
+    compute_class_weights,
+    contiguous_split_index,
+    fold_ranges,
+    split_index_path,
+)
+from src.stage_cache import compute_fingerprint, lookup_stage_cache, record_stage_cache
+from src.utils import AWSSession, load_npy_from_volume
+
+
+def log_test_metrics(model, X_test: np.array, y_test: np.array, class_names: List[str], batch_size: int = 64) -> float:
+    """
+    Evaluates a model on the test set and logs its accuracy and recall per class to the active MLflow run.
+
+    Args:
+        model (keras.Model): The trained model.
+        X_test (np.array): The test images.
+        y_test (np.array): The test labels as class indices.
+        class_names (List[str]): The names of the classes, in the order of the class indices.
+        batch_size (int, optional): The number of images scaled and predicted at once. Defaults to 64.
+
+    Returns:
+        float: The prediction accuracy on the test set.
+    """
+    y_pred = model.predict(SliceSequence(X_test, y_test, [[0, len(X_test)]], batch_size, shuffle=False))
+    y_test_labels, y_pred_labels = np.asarray(y_test), np.argmax(y_pred, axis=1)
+    prediction_accuracy = accuracy_score(y_test_labels, y_pred_labels)
+    mlflow.log_metric("prediction_accuracy", prediction_accuracy)
+    print(f"Prediction Accuracy: {prediction_accuracy}")
+
+    # Recall per class, as the accuracy hides a poor recall on the smaller malignant class
+    labels = list(range(len(class_names)))
+    recalls = recall_score(y_test_labels, y_pred_labels, labels=labels, average=None, zero_division=0)
+    mlflow.log_metrics({f"recall_{class_name}": recall for class_name, recall in zip(class_names, recalls)})
+    print(f"Recall per class: {dict(zip(class_names, recalls.round(4)))}")
+    return prediction_accuracy
+
+
+def log_pyfunc_model(model, model_class: str, input_shape: Tuple[int, int, int]):
+    """
+    Logs a Keras model wrapped with its preprocessing as pyfunc model to the active MLflow run, so clients send
+    raw JPEG bytes instead of float tensors.
+
+    Args:
+        model (keras.Model): The trained model.
+        model_class (str): The class of the model, used as artifact path.
+        input_shape (Tuple[int, int, int]): The input shape of the model.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        keras_model_path = os.path.join(tmp_dir, "keras_model")
+        model.save(keras_model_path)
+        mlflow.pyfunc.log_model(
+            artifact_path=model_class,
+            python_model=SkinCancerImageModel(input_shape=input_shape),
+            artifacts={"keras_model": keras_model_path},
+            code_path=[os.path.dirname(__file__)],
+            extra_pip_requirements=["pillow", "tensorflow-cpu==2.12.0"],
+        )
+
+
+def load_training_data(
+    import_dict: dict, aws_bucket: str, model_params: dict
+) -> Tuple[np.array, np.array, np.array, np.array, dict]:
+    """
+    Loads the preprocessed train and test sets and the split index of the train set.
+
+    Args:
+        import_dict (dict): A dictionary containing paths for importing data. If it contains a
+            "shared_volume_dir", the data is memory-mapped from the shared volume and only downloaded from S3 if
+            it is missing there.
+        aws_bucket (str): The AWS S3 bucket name for data storage.
+        model_params (dict): A dictionary containing the parameters for the model.
+
+    Returns:
+        Tuple[np.array, np.array, np.array, np.array, dict]: The train images and labels, the test images and
+            labels, and the split index of the train set.
+    """
+    shared_volume_dir = import_dict.get("shared_volume_dir")
+    X_train_data_path = import_dict.get("X_train_data_path")
+
+    # Instantiate aws session based on AWS Access Key
+    # AWS Access Key is fetched within AWS Session by os.getenv
+    aws_session = AWSSession()
+    aws_session.set_sessions()
+
+    def _load_array(file_key: str) -> np.array:
+        """
+        Loads a preprocessed array from the shared volume if available, otherwise from S3.
+
+        Args:
+            file_key (str): The S3 key of the array.
+
+        Returns:
+            np.array: The loaded NumPy array.
+        """
+        if shared_volume_dir:
+            data = load_npy_from_volume(volume_dir=shared_volume_dir, file_key=file_key)
+            if data is not None:
+                return data
+            print(f"{file_key} not found on shared volume, falling back to S3")
+        return aws_session.download_array_from_s3(s3_bucket=aws_bucket, file_key=file_key)
+
+    X_train = _load_array(X_train_data_path)
+    y_train = _load_array(import_dict.get("y_train_data_path"))
+    X_test = _load_array(import_dict.get("X_test_data_path"))
+    y_test = _load_array(import_dict.get("y_test_data_path"))
+
+    # The split is persisted by the preprocessing, so every split is a contiguous range of rows of X_train
+    split_index = aws_session.download_json_from_s3(s3_bucket=aws_bucket, file_key=split_index_path(X_train_data_path))
+    if split_index is None:
+        print("No split index found, splitting the rows in their stored order")
+        split_index = contiguous_split_index(len(X_train), validation_fraction=model_params.get("validation_split"))
+    return X_train, y_train, X_test, y_test, split_index
+
+
+def resolve_class_balancing(model_params: dict, split_index: dict, y_train: np.array) -> Tuple[bool, dict]:
+    """
+    Resolves the class balancing of the model params.
+
+    "resample" draws all classes equally often per epoch, "class_weight" weights the loss per class instead.
+
+    Args:
+        model_params (dict): A dictionary containing the parameters for the model.
+        split_index (dict): The split index of the train set.
+        y_train (np.array): The train labels.
+
+    Returns:
+        Tuple[bool, dict]: Whether to resample the classes, and the class weights passed to `fit` or None.
+    """
+    class_balancing = model_params.get("class_balancing", "resample")
+    class_weight = None
+    if class_balancing == "class_weight":
+        train_start, train_end = split_index["train"]
+        class_weights = split_index.get("class_weights") or compute_class_weights(y_train[train_start:train_end])
+        class_weight = {int(label): weight for label, weight in class_weights.items()}
+    return class_balancing == "resample", class_weight
 
 
 def train_model(
@@ -21,19 +160,36 @@ def train_model(
     model_params: dict,
     aws_bucket: str,
     import_dict: dict = {},
+    callbacks: list = None,
+    run_tags: dict = None,
+    register_model: bool = True,
+    use_cache: bool = True,
 ) -> Tuple[str, str, int, str]:
     """
     Trains a machine learning model and logs the results to MLflow.
 
+    The training is fingerprinted by the model class, the model params, the preprocessed data paths (which are
+    unique per preprocessing fingerprint), the code version, and the image. If a previous run with the same
+    fingerprint finished, its results are returned without training again.
+
     Args:
         mlflow_experiment_id (str): The ID of the MLflow experiment to log the results.
         model_class (Enum): The class of the model to train.
         model_params (dict): A dictionary containing the parameters for the model.
         aws_bucket (str): The AWS S3 bucket name for data storage.
-        import_dict (dict, optional): A dictionary containing paths for importing data. Defaults to {}.
+        import_dict (dict, optional): A dictionary containing paths for importing data. If it contains a
+            "shared_volume_dir", the data is memory-mapped from the shared volume and only downloaded from S3 if
+            it is missing there. Defaults to {}.
+        callbacks (list, optional): Additional Keras callbacks passed to `fit`, e.g. for pruning. Defaults to None.
+        run_tags (dict, optional): Tags to set on the MLflow run, e.g. a sweep ID. Defaults to None.
+        register_model (bool, optional): Whether to register the model in the MLflow Registry. Sweep trials are
+            only registered if they win. Defaults to True.
+        use_cache (bool, optional): Whether to reuse the results of a previous run with the same fingerprint.
+            Defaults to True.
 
     Returns:
         Tuple[str, str, int, str]: A tuple containing the run ID, model name, model version, and current stage.
+            Model version and stage are None if the model is not registered.
 
     Raises:
         None
@@ -47,73 +203,122 @@ def train_model(
     X_test_data_path = import_dict.get("X_test_data_path")
     y_test_data_path = import_dict.get("y_test_data_path")
 
-    # Instantiate aws session based on AWS Access Key
-    # AWS Access Key is fetched within AWS Session by os.getenv
-    aws_session = AWSSession()
-    aws_session.set_sessions()
+    fingerprint = compute_fingerprint(
+        stage="training",
+        model_class=model_class,
+        model_params=model_params,
+        data_paths=[X_train_data_path, y_train_data_path, X_test_data_path, y_test_data_path],
+        register_model=register_model,
+    )
+    if use_cache:
+        cached_outputs = lookup_stage_cache(mlflow_experiment_id, stage="training", fingerprint=fingerprint)
+        if cached_outputs is not None:
+            return (
+                cached_outputs["run_id"],
+                cached_outputs["model_name"],
+                cached_outputs["model_version"],
+                cached_outputs["model_stage"],
+            )
+
+    X_train, y_train, X_test, y_test, split_index = load_training_data(import_dict, aws_bucket, model_params)
+    batch_size = model_params.get("batch_size")
 
-    # Read NumPy Arrays from S3
-    X_train = aws_session.download_npy_from_s3(s3_bucket=aws_bucket, file_key=X_train_data_path)
-    y_train = aws_session.download_npy_from_s3(s3_bucket=aws_bucket, file_key=y_train_data_path)
-    X_test = aws_session.download_npy_from_s3(s3_bucket=aws_bucket, file_key=X_test_data_path)
-    y_test = aws_session.download_npy_from_s3(s3_bucket=aws_bucket, file_key=y_test_data_path)
+    # The classes are derived from the data folders, labels are stored as uint8 class indices
+    class_names = split_index.get("class_names") or [str(label) for label in range(model_params.get("num_classes"))]
+    model_params = {**model_params, "num_classes": len(class_names)}
+    class_balanced, class_weight = resolve_class_balancing(model_params, split_index, y_train)
 
     print("\n> Training model...")
     print(model_class)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     with mlflow.start_run(experiment_id=mlflow_experiment_id, run_name=f"{timestamp}-{model_class}") as run:
-        mlflow.log_params(model_params)
+        # params and metrics are sent in batches from a background thread, so fit never waits for the server
+        metrics_logger = AsyncMlflowLogger(run.info.run_id)
+        metrics_logger.log_params(model_params)
+        metrics_logger.log_params({"split_seed": split_index["seed"], "split_num_folds": split_index["num_folds"]})
+        if run_tags:
+            metrics_logger.set_tags(run_tags)
         learning_rate_reduction = ReduceLROnPlateau(monitor="accuracy", patience=5, verbose=1, factor=0.5, min_lr=1e-7)
 
         # If CrossVal is selected, train BasicNet as Cross-Validated Model
         if model_class == Model_Class.CrossVal.value:
-            kfold = KFold(n_splits=3, shuffle=True, random_state=11)
             cvscores = []
-            for train, test in kfold.split(X_train, y_train):
+            for fold in range(split_index["num_folds"]):
+                train_ranges, test_range = fold_ranges(split_index, fold)
                 model = get_model(Model_Class.Basic.value, model_params)
-                # TODO: autolog kfold ???
                 # Train Model
                 model.fit(
-                    X_train[train],
-                    y_train[train],
+                    SliceSequence(
+                        X_train,
+                        y_train,
+                        train_ranges,
+                        batch_size,
+                        seed=split_index["seed"] + fold,
+                        class_balanced=class_balanced,
+                    ),
+                    class_weight=class_weight,
                     epochs=model_params.get("epochs"),
-                    batch_size=model_params.get("batch_size"),
                     verbose=model_params.get("verbose"),
+                    callbacks=[MlflowMetricsCallback(metrics_logger, key_prefix=f"fold_{fold}_")] + (callbacks or []),
+                )
+                scores = model.evaluate(
+                    SliceSequence(X_train, y_train, [test_range], batch_size, shuffle=False), verbose=0
                 )
-                scores = model.evaluate(X_train[test], y_train[test], verbose=0)
                 print("%s: %.2f%%" % (model.metrics_names[1], scores[1] * 100))
+                metrics_logger.log_metric(f"fold_{fold}_eval_{model.metrics_names[1]}", scores[1])
                 cvscores.append(scores[1] * 100)
                 K.clear_session()
         # TODO: not very safe, create if-else on other Enums
         else:
             model = get_model(model_class, model_params)
-            mlflow.keras.autolog()
             # Train Model
             model.fit(
-                X_train,
-                y_train,
-                validation_split=model_params.get("validation_split"),
+                SliceSequence(
+                    X_train,
+                    y_train,
+                    [split_index["train"]],
+                    batch_size,
+                    seed=split_index["seed"],
+                    class_balanced=class_balanced,
+                ),
+                class_weight=class_weight,
+                validation_data=SliceSequence(X_train, y_train, [split_index["validation"]], batch_size, shuffle=False),
                 epochs=model_params.get("epochs"),
-                batch_size=model_params.get("batch_size"),
                 verbose=model_params.get("verbose"),
-                callbacks=[learning_rate_reduction],
+                callbacks=[learning_rate_reduction, MlflowMetricsCallback(metrics_logger)] + (callbacks or []),
             )
-            mlflow.keras.autolog(disable=True)
+
+        metrics_logger.close()
 
         run_id = run.info.run_id
         model_uri = f"runs:/{run_id}/{model_class}"
 
         # Testing model on test data to evaluate
         print("\n> Testing model...")
-        y_pred = model.predict(X_test)
-        prediction_accuracy = accuracy_score(np.argmax(y_test, axis=1), np.argmax(y_pred, axis=1))
-        mlflow.log_metric("prediction_accuracy", prediction_accuracy)
-        print(f"Prediction Accuracy: {prediction_accuracy}")
+        log_test_metrics(model, X_test, y_test, class_names, batch_size=batch_size)
+
+        print("\n> Logging pyfunc model...")
+        log_pyfunc_model(model, model_class, input_shape=model_params.get("input_shape"))
+
+        if register_model:
+            print("\n> Register model...")
+            mv = mlflow.register_model(model_uri, model_class)
+            model_name, model_version, model_stage = mv.name, mv.version, mv.current_stage
+        else:
+            model_name, model_version, model_stage = model_class, None, None
 
-        print("\n> Register model...")
-        mv = mlflow.register_model(model_uri, model_class)
+        record_stage_cache(
+            stage="training",
+            fingerprint=fingerprint,
+            outputs={
+                "run_id": run_id,
+                "model_name": model_name,
+                "model_version": model_version,
+                "model_stage": model_stage,
+            },
+        )
 
-    return run_id, mv.name, mv.version, mv.current_stage
+    return run_id, model_name, model_version, model_stage
 
 
 if __name__ == "__main__":
@@ -129,7 +334,7 @@ if __name__ == "__main__":
         "kernel_initializer_glob": "glorot_uniform",
         "kernel_initializer_norm": "normal",
         "optimizer": "adam",
-        "loss": "binary_crossentropy",
+        "loss": "sparse_categorical_crossentropy",
         "metrics": ["accuracy"],
         "validation_split": 0.2,
         "epochs": 2,
@@ -137,6 +342,14 @@ if __name__ == "__main__":
         "learning_rate": 1e-5,
         "pooling": "avg",  # needed for resnet50
         "verbose": 2,
+        "class_balancing": "resample",
+        "augmentation": {
+            "flip": "horizontal_and_vertical",
+            "rotation": 0.1,
+            "crop_fraction": 0.9,
+            "brightness": 0.1,
+            "contrast": 0.1,
+        },
     }
 
     train_model(
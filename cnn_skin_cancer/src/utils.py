@@ -1,14 +1,15 @@
+import json
 import os
 import pickle
+import shutil
 import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
-from typing import Any, Callable, Tuple
+from typing import Any, Callable, List, Tuple
 
 import boto3
 import numpy as np
-import s3fs
 from boto3.session import Session
-from PIL import Image
 
 
 def timeit(func) -> Callable[..., Any]:
@@ -37,6 +38,113 @@ def timeit(func) -> Callable[..., Any]:
     return timeit_wrapper
 
 
+def shared_volume_path(volume_dir: str, file_key: str) -> str:
+    """
+    Maps an S3 file key of a preprocessed array to its location on a shared volume.
+
+    Args:
+        volume_dir (str): The mount path of the shared volume.
+        file_key (str): The S3 key of the array, e.g. "preprocessed/X_train.pkl".
+
+    Returns:
+        str: The path of the array on the shared volume, e.g. "<volume_dir>/preprocessed/X_train.npy".
+    """
+    return os.path.join(volume_dir, f"{os.path.splitext(file_key)[0]}.npy")
+
+
+@timeit
+def save_npy_to_volume(data: np.array, volume_dir: str, file_key: str) -> str:
+    """
+    Saves a NumPy array to a shared volume so it can be memory-mapped by other pods.
+
+    The array is written to a temporary file first and moved into place afterwards, so pods reading the volume
+    never see a partially written array.
+
+    Args:
+        data (np.array): The NumPy array to be saved.
+        volume_dir (str): The mount path of the shared volume.
+        file_key (str): The S3 key of the array, used to derive the path on the volume.
+
+    Returns:
+        str: The path of the saved array.
+
+    Raises:
+        None
+    """
+    path = shared_volume_path(volume_dir, file_key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, data, allow_pickle=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+class NpyVolumeWriter:
+    """NpyVolumeWriter writes an array to a shared volume row batch by row batch, without holding it in memory.
+
+    The number of rows is only known once all rows are appended, so the rows are written to a temporary file,
+    which is prefixed by the .npy header on `close` and moved into place.
+
+    Args:
+        volume_dir (str): The mount path of the shared volume.
+        file_key (str): The S3 key of the array, used to derive the path on the volume.
+        row_shape (Tuple[int, ...]): The shape of a row, e.g. (224, 224, 3) for images.
+        dtype (np.dtype): The dtype of the array.
+
+    Methods:
+        append(rows: np.array):
+            Appends rows.
+
+        close() -> str:
+            Writes the .npy file and returns its path.
+    """
+
+    def __init__(self, volume_dir: str, file_key: str, row_shape: Tuple[int, ...], dtype: np.dtype):
+        self.path = shared_volume_path(volume_dir, file_key)
+        self.row_shape = tuple(row_shape)
+        self.dtype = np.dtype(dtype)
+        self.num_rows = 0
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.__rows_file = open(f"{self.path}.rows.tmp", "wb")
+
+    def append(self, rows: np.array):
+        self.__rows_file.write(np.ascontiguousarray(rows, dtype=self.dtype).data)
+        self.num_rows += len(rows)
+
+    def close(self) -> str:
+        self.__rows_file.close()
+        tmp_path = f"{self.path}.tmp"
+        header = {"descr": self.dtype.str, "fortran_order": False, "shape": (self.num_rows, *self.row_shape)}
+        with open(tmp_path, "wb") as f, open(f"{self.path}.rows.tmp", "rb") as rows_file:
+            np.lib.format.write_array_header_1_0(f, header)
+            shutil.copyfileobj(rows_file, f, length=64 * 1024 * 1024)
+        os.remove(f"{self.path}.rows.tmp")
+        os.replace(tmp_path, self.path)
+        return self.path
+
+
+@timeit
+def load_npy_from_volume(volume_dir: str, file_key: str) -> np.array:
+    """
+    Memory-maps a NumPy array from a shared volume in read-only mode.
+
+    Args:
+        volume_dir (str): The mount path of the shared volume.
+        file_key (str): The S3 key of the array, used to derive the path on the volume.
+
+    Returns:
+        np.array: The memory-mapped NumPy array, or None if it does not exist on the volume.
+
+    Raises:
+        None
+    """
+    path = shared_volume_path(volume_dir, file_key)
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode="r")
+
+
 class AWSSession:
     """
     A class for managing AWS sessions and performing S3 operations.
@@ -54,7 +162,19 @@ class AWSSession:
         set_sessions(): Sets up the AWS sessions with the assumed role.
         upload_npy_to_s3(data: np.array, s3_bucket: str, file_key: str) -> None: Uploads a NumPy array to S3.
         download_npy_from_s3(s3_bucket: str, file_key: str) -> np.array: Downloads a NumPy array from S3.
-        read_image_from_s3(s3_bucket: str, imname: str) -> np.array: Reads an image from S3.
+        upload_chunked_array_to_s3(data: np.array, s3_bucket: str, file_key: str, codec: str) -> dict: Uploads a
+            NumPy array as compressed chunks to S3.
+        download_array_from_s3(s3_bucket: str, file_key: str, max_workers: int) -> np.array: Downloads a chunked
+            or pickled NumPy array from S3.
+        get_s3_client(max_pool_connections: int): Returns an S3 client of the assumed role.
+        read_image_from_s3(s3_bucket: str, imname: str, s3_client) -> np.array: Reads an image from S3.
+        read_images_from_s3(s3_bucket: str, imnames: List[str], max_workers: int, s3_client) -> List[np.array]:
+            Reads images from S3 in parallel with a shared client.
+        upload_parquet_to_s3(data: pd.DataFrame, s3_bucket: str, file_key: str) -> None: Uploads a DataFrame as
+            Parquet to S3.
+        upload_json_to_s3(data: dict, s3_bucket: str, file_key: str) -> None: Uploads a dictionary as JSON to S3.
+        download_json_from_s3(s3_bucket: str, file_key: str) -> dict: Downloads a JSON file from S3.
+        get_data_manifest(path: str) -> dict: Lists files below a path with their ETags.
         list_files_in_bucket(path: str) -> list: Lists files in a bucket.
 
     """
@@ -107,6 +227,9 @@ class AWSSession:
         Raises:
             None
         """
+        # imported lazily, so pods that only use the boto3 session do not pay for it
+        import s3fs
+
         print("Set Sessions")
         user_session = boto3.Session(
             region_name=self.__region_name,
@@ -170,13 +293,116 @@ class AWSSession:
             allow_pickle=True,
         )
 
-    def read_image_from_s3(self, s3_bucket: str, imname: str) -> np.array:
+    def get_s3_client(self, max_pool_connections: int = 32):
+        """
+        Returns an S3 client of the assumed role, sized for parallel requests.
+
+        Args:
+            max_pool_connections (int, optional): The size of the connection pool. Defaults to 32.
+
+        Returns:
+            botocore.client.S3: The S3 client.
+
+        Raises:
+            None
+        """
+        from botocore.config import Config
+
+        return self.__boto3_role_session.client("s3", config=Config(max_pool_connections=max_pool_connections))
+
+    @timeit
+    def upload_chunked_array_to_s3(self, data: np.array, s3_bucket: str, file_key: str, codec: str = "zstd") -> dict:
+        """
+        Uploads a NumPy array as fixed-size compressed chunks with an index to an S3 bucket.
+
+        Args:
+            data (np.array): The NumPy array to be uploaded.
+            s3_bucket (str): The name of the S3 bucket.
+            file_key (str): The key of the chunked array, ending with ".chunked".
+            codec (str, optional): The compression codec, "zstd", "lz4", or "zlib". Defaults to "zstd".
+
+        Returns:
+            dict: The index of the chunked array.
+
+        Raises:
+            None
+        """
+        from src.chunked_dataset import S3ChunkStore, write_chunked_array
+
+        return write_chunked_array(data, S3ChunkStore(self.get_s3_client(), s3_bucket), file_key, codec=codec)
+
+    @timeit
+    def download_array_from_s3(self, s3_bucket: str, file_key: str, max_workers: int = 16) -> np.array:
+        """
+        Downloads a NumPy array from an S3 bucket, either chunked or pickled depending on its key.
+
+        Chunked arrays are fetched with parallel range requests and decompressed into a preallocated array.
+
+        Args:
+            s3_bucket (str): The name of the S3 bucket.
+            file_key (str): The key of the array.
+            max_workers (int, optional): The number of chunks fetched in parallel. Defaults to 16.
+
+        Returns:
+            np.array: The downloaded NumPy array.
+
+        Raises:
+            None
+        """
+        from src.chunked_dataset import S3ChunkStore, is_chunked, read_chunked_array
+
+        if not is_chunked(file_key):
+            return self.download_npy_from_s3(s3_bucket=s3_bucket, file_key=file_key)
+        store = S3ChunkStore(self.get_s3_client(max_pool_connections=max_workers), s3_bucket)
+        return read_chunked_array(store, file_key, max_workers=max_workers)
+
+    def upload_json_to_s3(self, data: dict, s3_bucket: str, file_key: str) -> None:
+        """
+        Uploads a dictionary as JSON file to an S3 bucket.
+
+        Args:
+            data (dict): The dictionary to be uploaded.
+            s3_bucket (str): The name of the S3 bucket.
+            file_key (str): The key to use for the uploaded file.
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        with self.__s3fs_session.open(f"{s3_bucket}/{file_key}", "w") as f:
+            json.dump(data, f)
+
+    def download_json_from_s3(self, s3_bucket: str, file_key: str) -> dict:
+        """
+        Downloads a JSON file from an S3 bucket.
+
+        Args:
+            s3_bucket (str): The name of the S3 bucket.
+            file_key (str): The key of the file to be downloaded.
+
+        Returns:
+            dict: The content of the file, or None if the file does not exist.
+
+        Raises:
+            None
+        """
+        try:
+            with self.__s3fs_session.open(f"{s3_bucket}/{file_key}", "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def read_image_from_s3(self, s3_bucket: str, imname: str, s3_client=None) -> np.array:
         """
         Reads an image from an S3 bucket.
 
         Args:
             s3_bucket (str): The name of the S3 bucket.
             imname (str): The name of the image file.
+            s3_client (botocore.client.S3, optional): The S3 client to read with, which must be passed when
+                reading from several threads. Defaults to None, in which case a client is created.
 
         Returns:
             np.array: The image data as a NumPy array.
@@ -184,12 +410,95 @@ class AWSSession:
         Raises:
             None
         """
-        s3client = self.__boto3_role_session.client("s3")
+        from PIL import Image
+
+        s3client = s3_client or self.__boto3_role_session.client("s3")
         keyname = imname.split(f"{s3_bucket}/", 1)[1]
         file_stream = s3client.get_object(Bucket=s3_bucket, Key=keyname)["Body"]
         np_image = Image.open(file_stream).convert("RGB")
         return np.asarray(np_image)
 
+    def read_bytes_from_s3(self, s3_bucket: str, imname: str, s3_client=None) -> bytes:
+        """
+        Reads the raw bytes of a file from an S3 bucket.
+
+        Args:
+            s3_bucket (str): The name of the S3 bucket.
+            imname (str): The name of the file.
+            s3_client (botocore.client.S3, optional): The S3 client to read with, which must be passed when
+                reading from several threads. Defaults to None, in which case a client is created.
+
+        Returns:
+            bytes: The content of the file.
+
+        Raises:
+            None
+        """
+        s3client = s3_client or self.__boto3_role_session.client("s3")
+        keyname = imname.split(f"{s3_bucket}/", 1)[1]
+        return s3client.get_object(Bucket=s3_bucket, Key=keyname)["Body"].read()
+
+    def read_images_from_s3(
+        self, s3_bucket: str, imnames: List[str], max_workers: int = 16, s3_client=None
+    ) -> List[np.array]:
+        """
+        Reads images from an S3 bucket in parallel, keeping their order.
+
+        Reading an image is dominated by the S3 round trip, and PIL releases the GIL while decoding, so threads
+        scale almost linearly here. All threads share one client, as clients are thread-safe but creating them
+        from the shared boto3 session is not.
+
+        Args:
+            s3_bucket (str): The name of the S3 bucket.
+            imnames (List[str]): The names of the image files.
+            max_workers (int, optional): The number of concurrent downloads. Defaults to 16.
+            s3_client (botocore.client.S3, optional): The S3 client to read with. Defaults to None, in which case
+                a client with a connection per worker is created.
+
+        Returns:
+            List[np.array]: The image data as NumPy arrays.
+
+        Raises:
+            None
+        """
+        s3_client = s3_client or self.get_s3_client(max_pool_connections=max_workers)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda imname: self.read_image_from_s3(s3_bucket, imname, s3_client), imnames))
+
+    def upload_parquet_to_s3(self, data, s3_bucket: str, file_key: str) -> None:
+        """
+        Uploads a pandas DataFrame as Parquet file to an S3 bucket.
+
+        Args:
+            data (pd.DataFrame): The DataFrame to be uploaded.
+            s3_bucket (str): The name of the S3 bucket.
+            file_key (str): The key to use for the uploaded file.
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        with self.__s3fs_session.open(f"{s3_bucket}/{file_key}", "wb") as f:
+            data.to_parquet(f, index=False)
+
+    def get_data_manifest(self, path: str) -> dict:
+        """
+        Lists all files below a path in an S3 bucket together with their ETags.
+
+        Args:
+            path (str): The path in the S3 bucket.
+
+        Returns:
+            dict: A dictionary mapping each file name to its ETag, sorted by file name.
+
+        Raises:
+            None
+        """
+        files = self.__s3fs_session.find(path, detail=True)
+        return {name: files[name].get("ETag") for name in sorted(files)}
+
     def list_files_in_bucket(self, path: str) -> list:
         """
         Lists files in an S3 bucket.
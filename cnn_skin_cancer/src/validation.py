@@ -0,0 +1,133 @@
+import io
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Set, Tuple
+
+from src.utils import AWSSession, timeit
+
+# images of other modes would lose or invent channels when converted to RGB
+ALLOWED_MODES = ("RGB",)
+
+
+def inspect_image(data: bytes) -> dict:
+    """
+    Decodes an image completely and records the properties it is validated by.
+
+    The properties do not depend on the validation settings, so they can be cached per ETag and judged again
+    with other settings.
+
+    Args:
+        data (bytes): The encoded image.
+
+    Returns:
+        dict: The decoding "error", or None if the image decoded, and its "size" as [width, height] and "mode".
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # opening only parses the header, loading decodes the pixels and fails on truncated files
+            image.load()
+            return {"error": None, "size": list(image.size), "mode": image.mode}
+    except Exception as error:
+        # the decoders of PIL raise OSError, ValueError, SyntaxError, or DecompressionBombError on corrupt files
+        return {"error": f"{type(error).__name__}: {error}", "size": None, "mode": None}
+
+
+def judge_image(properties: dict, expected_size: Tuple[int, int], allowed_modes: Tuple[str, ...]) -> str:
+    """
+    Judges an image by the properties recorded by `inspect_image`.
+
+    Args:
+        properties (dict): The properties of the image.
+        expected_size (Tuple[int, int]): The size all images must have, as (width, height).
+        allowed_modes (Tuple[str, ...]): The PIL modes an image may have.
+
+    Returns:
+        str: The reason to quarantine the image, or None if it is valid.
+    """
+    if properties["error"]:
+        return f"not decodable: {properties['error']}"
+    if properties["mode"] not in allowed_modes:
+        return f"mode {properties['mode']}, expected one of {list(allowed_modes)}"
+    if tuple(properties["size"]) != tuple(expected_size):
+        return f"size {properties['size'][0]}x{properties['size'][1]}, expected {expected_size[0]}x{expected_size[1]}"
+    return None
+
+
+@timeit
+def validate_images(
+    aws_session: AWSSession,
+    aws_bucket: str,
+    data_manifest: dict,
+    cache_file_key: str,
+    expected_size: Tuple[int, int] = None,
+    allowed_modes: Tuple[str, ...] = ALLOWED_MODES,
+    max_workers: int = 16,
+) -> Tuple[Set[str], dict]:
+    """
+    Checks that all images of a manifest decode and have the same size and an allowed mode, in parallel threads.
+
+    The properties of every image are cached on S3 by its ETag, so later runs only download and decode new or
+    changed images. Images failing the check are quarantined, i.e. listed in the report with their reason and
+    left out of the preprocessing.
+
+    Args:
+        aws_session (AWSSession): The session to read the images and the cache with.
+        aws_bucket (str): The AWS S3 bucket name of the images and the cache.
+        data_manifest (dict): The manifest of the images, mapping each file name to its ETag.
+        cache_file_key (str): The key of the JSON file caching the properties per ETag.
+        expected_size (Tuple[int, int], optional): The size all images must have, as (width, height). Defaults
+            to None, which expects the most common size of the decodable images.
+        allowed_modes (Tuple[str, ...], optional): The PIL modes an image may have. Defaults to ("RGB",).
+        max_workers (int, optional): The number of concurrent downloads. Defaults to 16.
+
+    Returns:
+        Tuple[Set[str], dict]: The file names of the valid images, and the report of the validation containing
+            the "quarantined" file names with their reason.
+    """
+    cache = aws_session.download_json_from_s3(s3_bucket=aws_bucket, file_key=cache_file_key) or {}
+    properties = {name: cache[etag] for name, etag in data_manifest.items() if etag in cache}
+    unchecked = [name for name in data_manifest if name not in properties]
+    print(f"Validating {len(unchecked)} images, {len(properties)} are cached")
+
+    # one client for all threads, as clients are thread-safe but creating them from the boto3 session is not
+    s3_client = aws_session.get_s3_client(max_pool_connections=max_workers)
+
+    def _inspect(name: str) -> dict:
+        return inspect_image(aws_session.read_bytes_from_s3(aws_bucket, name, s3_client))
+
+    # PIL releases the GIL while decoding, so threads decode in parallel while others wait for S3
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for name, image_properties in zip(unchecked, executor.map(_inspect, unchecked)):
+            properties[name] = image_properties
+            if data_manifest[name]:
+                cache[data_manifest[name]] = image_properties
+    if unchecked:
+        aws_session.upload_json_to_s3(data=cache, s3_bucket=aws_bucket, file_key=cache_file_key)
+
+    if expected_size is None:
+        sizes = Counter(
+            tuple(image_properties["size"])
+            for image_properties in properties.values()
+            if not image_properties["error"] and image_properties["mode"] in allowed_modes
+        )
+        expected_size = sizes.most_common(1)[0][0] if sizes else (0, 0)
+
+    quarantined = {}
+    for name, image_properties in properties.items():
+        reason = judge_image(image_properties, expected_size, allowed_modes)
+        if reason:
+            quarantined[name] = reason
+            print(f"Quarantined {name}: {reason}")
+
+    report = {
+        "num_images": len(properties),
+        "num_checked": len(unchecked),
+        "num_cached": len(properties) - len(unchecked),
+        "num_quarantined": len(quarantined),
+        "expected_size": list(expected_size),
+        "allowed_modes": list(allowed_modes),
+        "quarantined": quarantined,
+    }
+    return set(properties) - set(quarantined), report
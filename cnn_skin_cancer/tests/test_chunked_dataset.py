@@ -0,0 +1,133 @@
+import sys
+
+import numpy as np
+import pytest
+from src.chunked_dataset import (
+    ChunkedArrayWriter,
+    get_codec,
+    read_chunked_array,
+    read_chunked_index,
+    write_chunked_array,
+)
+
+FILE_KEY = "preprocessed/X_train.chunked"
+ROW_SHAPE = (4, 4, 3)
+
+
+class InMemoryChunkStore:
+    """A chunk store keeping its objects in a dict, with the interface of LocalChunkStore and S3ChunkStore."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_file(self, key: str, path: str):
+        with open(path, "rb") as f:
+            self.objects[key] = f.read()
+
+    def get(self, key: str) -> bytes:
+        return self.objects[key]
+
+    def get_range(self, key: str, start: int, end: int) -> bytes:
+        return self.objects[key][start:end]
+
+    def exists(self, key: str) -> bool:
+        return key in self.objects
+
+
+@pytest.fixture
+def store() -> InMemoryChunkStore:
+    return InMemoryChunkStore()
+
+
+@pytest.fixture
+def data() -> np.array:
+    return np.random.default_rng(0).integers(0, 256, size=(100, *ROW_SHAPE), dtype=np.uint8)
+
+
+def _chunk_bytes(rows_per_chunk: int) -> int:
+    return rows_per_chunk * int(np.prod(ROW_SHAPE))
+
+
+def test_round_trip_of_full_array(store, data):
+    index = write_chunked_array(data, store, FILE_KEY, chunk_bytes=_chunk_bytes(16), codec="zlib", max_workers=2)
+
+    assert index["shape"] == [100, *ROW_SHAPE]
+    assert index["rows_per_chunk"] == 16
+    assert len(index["chunks"]) == 7
+    assert read_chunked_index(store, FILE_KEY) == index
+    np.testing.assert_array_equal(read_chunked_array(store, FILE_KEY, max_workers=3), data)
+
+
+def test_read_row_range_spanning_chunk_boundaries(store, data):
+    write_chunked_array(data, store, FILE_KEY, chunk_bytes=_chunk_bytes(16), codec="zlib")
+    fetched_ranges = []
+    get_range = store.get_range
+    store.get_range = lambda key, start, end: fetched_ranges.append((start, end)) or get_range(key, start, end)
+
+    rows = read_chunked_array(store, FILE_KEY, rows=(10, 40))
+
+    np.testing.assert_array_equal(rows, data[10:40])
+    # only the chunks of rows [0, 16), [16, 32), and [32, 48) are fetched
+    assert len(fetched_ranges) == 3
+
+
+def test_read_into_preallocated_buffer(store, data):
+    write_chunked_array(data, store, FILE_KEY, chunk_bytes=_chunk_bytes(16), codec="zlib")
+    out = np.zeros((20, *ROW_SHAPE), dtype=np.uint8)
+
+    result = read_chunked_array(store, FILE_KEY, rows=(80, 100), out=out)
+
+    assert result is out
+    np.testing.assert_array_equal(out, data[80:100])
+
+
+def test_writer_with_uneven_appends(store, data):
+    writer = ChunkedArrayWriter(store, FILE_KEY, ROW_SHAPE, np.uint8, chunk_bytes=_chunk_bytes(16), codec="zlib")
+    for start, end in [(0, 1), (1, 30), (30, 30), (30, 95), (95, 100)]:
+        writer.append(data[start:end])
+    index = writer.close()
+
+    assert writer.num_rows == 100
+    assert [chunk["num_rows"] for chunk in index["chunks"]] == [16, 16, 16, 16, 16, 16, 4]
+    assert [chunk["start_row"] for chunk in index["chunks"]] == list(range(0, 100, 16))
+    np.testing.assert_array_equal(read_chunked_array(store, FILE_KEY), data)
+
+
+def test_writer_rejects_rows_of_other_shape(store):
+    writer = ChunkedArrayWriter(store, FILE_KEY, ROW_SHAPE, np.uint8, codec="zlib")
+
+    with pytest.raises(ValueError):
+        writer.append(np.zeros((2, 4, 4, 1), dtype=np.uint8))
+
+
+def test_round_trip_of_empty_array(store):
+    data = np.empty((0, *ROW_SHAPE), dtype=np.float32)
+
+    index = write_chunked_array(data, store, FILE_KEY, codec="zlib")
+    result = read_chunked_array(store, FILE_KEY)
+
+    assert index["chunks"] == []
+    assert result.shape == (0, *ROW_SHAPE)
+    assert result.dtype == np.float32
+
+
+def test_corrupt_chunk_raises(store, data):
+    write_chunked_array(data, store, FILE_KEY, chunk_bytes=_chunk_bytes(16), codec="zlib")
+    data_key = f"{FILE_KEY}/data.bin"
+    store.objects[data_key] = b"\x00" + store.objects[data_key][1:]
+
+    with pytest.raises(IOError):
+        read_chunked_array(store, FILE_KEY)
+
+
+def test_missing_codec_raises_instead_of_falling_back(monkeypatch):
+    # a None entry in sys.modules makes the import fail
+    monkeypatch.setitem(sys.modules, "zstandard", None)
+
+    with pytest.raises(ImportError):
+        get_codec("zstd")
+
+
+def test_unknown_codec_raises():
+    with pytest.raises(ValueError):
+        get_codec("brotli")
@@ -0,0 +1,84 @@
+import mlflow
+import pytest
+from src.compare_models import compare_models, select_best_model
+
+
+@pytest.fixture
+def tracking_uri(tmp_path, monkeypatch) -> str:
+    tracking_uri = (tmp_path / "mlruns").as_uri()
+    # newer MLflow versions only use a file store if explicitly allowed
+    monkeypatch.setenv("MLFLOW_ALLOW_FILE_STORE", "true")
+    monkeypatch.setenv("MLFLOW_TRACKING_URI", tracking_uri)
+    monkeypatch.setenv("MODEL_CACHE_DIR", str(tmp_path / "model_cache"))
+    mlflow.set_tracking_uri(tracking_uri)
+    return tracking_uri
+
+
+def _log_run(client: mlflow.MlflowClient, experiment_id: str, accuracy: float) -> str:
+    run = client.create_run(experiment_id)
+    client.log_metric(run.info.run_id, "prediction_accuracy", accuracy)
+    client.set_terminated(run.info.run_id)
+    return run.info.run_id
+
+
+def _register(client: mlflow.MlflowClient, model_name: str, run_id: str) -> str:
+    if not client.search_registered_models(f"name = '{model_name}'"):
+        client.create_registered_model(model_name)
+    return client.create_model_version(model_name, f"runs:/{run_id}/{model_name}", run_id=run_id).version
+
+
+def test_select_best_model_uses_version_of_compared_run(tracking_uri):
+    client = mlflow.MlflowClient(tracking_uri=tracking_uri)
+    experiment_id = client.create_experiment("compare")
+    basic_run_id = _log_run(client, experiment_id, 0.7)
+    resnet_run_id = _log_run(client, experiment_id, 0.9)
+    cached_version = _register(client, "ResNet50", resnet_run_id)
+    # a later run registered a newer version, and the version of the compared run already left the stage "None"
+    _register(client, "ResNet50", _log_run(client, experiment_id, 0.5))
+    client.transition_model_version_stage("ResNet50", cached_version, "Staging")
+
+    model_name, model_version = select_best_model({"Basic": basic_run_id, "ResNet50": resnet_run_id})
+
+    assert (model_name, model_version) == ("ResNet50", cached_version)
+
+
+def test_select_best_model_prefers_given_versions(tracking_uri):
+    client = mlflow.MlflowClient(tracking_uri=tracking_uri)
+    experiment_id = client.create_experiment("compare")
+    run_id = _log_run(client, experiment_id, 0.9)
+
+    assert select_best_model({"Basic": run_id}, model_versions={"Basic": "3"}) == ("Basic", "3")
+
+
+def test_select_best_model_raises_without_registered_version(tracking_uri):
+    client = mlflow.MlflowClient(tracking_uri=tracking_uri)
+    run_id = _log_run(client, client.create_experiment("compare"), 0.9)
+
+    with pytest.raises(ValueError):
+        select_best_model({"Basic": run_id})
+
+
+def test_compare_cache_ignores_measured_latencies(tracking_uri):
+    client = mlflow.MlflowClient(tracking_uri=tracking_uri)
+    experiment_id = client.create_experiment("compare")
+    run_id = _log_run(client, experiment_id, 0.9)
+    version = _register(client, "Basic", run_id)
+    shadow_report = {
+        "passed": True,
+        "candidate_model_name": "Basic",
+        "candidate_model_version": version,
+        "baseline_model_name": None,
+        "baseline_model_version": None,
+        "candidate_p95_latency_ms": 120.0,
+    }
+
+    first = compare_models({"Basic": run_id}, mlflow_experiment_id=experiment_id, shadow_report=shadow_report)
+    second = compare_models(
+        {"Basic": run_id},
+        mlflow_experiment_id=experiment_id,
+        shadow_report={**shadow_report, "candidate_p95_latency_ms": 135.0},
+    )
+
+    assert first == second == ("Basic", "models:/Basic/Staging", version)
+    # the second comparison is answered from the stage cache and logs no run
+    assert len(client.search_runs([experiment_id], "tags.stage = 'compare'")) == 1
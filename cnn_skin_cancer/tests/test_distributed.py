@@ -0,0 +1,117 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+# the module imports keras and mlflow, which are only installed in the train image
+tf = pytest.importorskip("tensorflow")
+pytest.importorskip("mlflow")
+
+from src.distributed import build_tf_config, shard_ranges  # noqa: E402
+
+PROJECT_DIRECTORY = Path(__file__).parent.parent
+# tf.keras is Keras 3 from tensorflow 2.16 on, unless TF_USE_LEGACY_KERAS selects tf_keras
+KERAS_3 = str(getattr(tf.keras, "__version__", "")).startswith("3.")
+
+# Trains a tiny model on the worker's shard of random images and prints the sum of its weights and the number of
+# rows a worker consumed per step
+WORKER_SCRIPT = """
+import json
+import os
+import sys
+
+import numpy as np
+from src.distributed import build_tf_config, make_shard_dataset, shard_ranges
+
+worker_hosts, worker_index = sys.argv[1].split(","), int(sys.argv[2])
+os.environ["TF_CONFIG"] = json.dumps(build_tf_config(worker_hosts, worker_index))
+import tensorflow as tf
+
+strategy = tf.distribute.MultiWorkerMirroredStrategy()
+rng = np.random.default_rng(11)
+X = rng.integers(0, 256, size=(64, 4, 4, 3), dtype=np.uint8)
+y = (X.mean(axis=(1, 2, 3)) > 127).astype(np.uint8)
+# a global batch of 16 rows, i.e. 8 rows per worker and step
+shard = shard_ranges([[0, 64]], len(worker_hosts), worker_index)
+dataset = make_shard_dataset(X, y, shard, 8 * len(worker_hosts), seed=worker_index)
+
+
+class RowCountingModel(tf.keras.Sequential):
+    def train_step(self, data):
+        tf.print("rows", tf.shape(data[0])[0], output_stream=sys.stdout)
+        return super().train_step(data)
+
+
+with strategy.scope():
+    model = RowCountingModel([tf.keras.Input(shape=(4, 4, 3)), tf.keras.layers.Flatten(), tf.keras.layers.Dense(2)])
+    model.compile(optimizer="sgd", loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True))
+model.fit(dataset, steps_per_epoch=2, epochs=2, verbose=0)
+print(json.dumps(float(sum(np.abs(weights).sum() for weights in model.get_weights()))))
+"""
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def test_build_tf_config_marks_the_worker():
+    tf_config = build_tf_config(["host-0:2222", "host-1:2222"], worker_index=1)
+
+    assert tf_config == {
+        "cluster": {"worker": ["host-0:2222", "host-1:2222"]},
+        "task": {"type": "worker", "index": 1},
+    }
+
+
+def test_shard_ranges_split_every_range_into_contiguous_disjoint_shards():
+    ranges = [[0, 10], [20, 27]]
+
+    shards = [shard_ranges(ranges, num_workers=3, worker_index=index) for index in range(3)]
+
+    assert shards == [[[0, 3], [20, 22]], [[3, 6], [22, 24]], [[6, 10], [24, 27]]]
+    rows = sorted(row for shard in shards for start, end in shard for row in range(start, end))
+    assert rows == list(range(0, 10)) + list(range(20, 27))
+
+
+def test_shard_ranges_skip_empty_shards():
+    assert shard_ranges([[0, 2]], num_workers=4, worker_index=0) == []
+    assert shard_ranges([[0, 2]], num_workers=4, worker_index=1) == [[0, 1]]
+
+
+def test_shard_ranges_of_a_single_worker_are_the_ranges():
+    assert shard_ranges([[0, 10], [20, 27]], num_workers=1, worker_index=0) == [[0, 10], [20, 27]]
+
+
+@pytest.mark.skipif(
+    KERAS_3,
+    reason="MultiWorkerMirroredStrategy needs Keras 2, as pinned with tensorflow 2.12 in the train image, "
+    "set TF_USE_LEGACY_KERAS=1 with tf_keras installed for newer TensorFlow versions",
+)
+def test_two_local_workers_train_in_sync():
+    worker_hosts = ",".join(f"localhost:{_free_port()}" for _ in range(2))
+    env = {**os.environ, "PYTHONPATH": str(PROJECT_DIRECTORY), "TF_CPP_MIN_LOG_LEVEL": "2"}
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-c", WORKER_SCRIPT, worker_hosts, str(index)],
+            cwd=PROJECT_DIRECTORY,
+            env=env,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        for index in range(2)
+    ]
+    outputs = [process.communicate(timeout=300)[0] for process in processes]
+
+    assert [process.returncode for process in processes] == [0, 0]
+    for output in outputs:
+        # Keras splits every global batch of a worker's dataset across the replicas of both workers
+        assert [line for line in output.splitlines() if line.startswith("rows")] == ["rows 8"] * 4
+    weight_sums = [json.loads(output.strip().splitlines()[-1]) for output in outputs]
+    # gradients are all-reduced after every step, so both workers end with the same weights
+    assert weight_sums[0] == pytest.approx(weight_sums[1])
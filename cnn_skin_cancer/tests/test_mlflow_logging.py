@@ -0,0 +1,98 @@
+import json
+import threading
+
+import pytest
+
+pytest.importorskip("mlflow")
+
+from src.mlflow_logging import AsyncMlflowLogger  # noqa: E402
+
+
+class RecordingLogger(AsyncMlflowLogger):
+    """A logger recording the sent batches instead of sending them, failing while `reachable` is cleared."""
+
+    def __init__(self, *args, **kwargs):
+        self.sent = []
+        self.reachable = threading.Event()
+        self.reachable.set()
+        self.fail_after = None
+        self.on_failure = None
+        super().__init__(*args, **kwargs)
+
+    def _send(self, run_id: str, batch: dict):
+        if not self.reachable.is_set() or (self.fail_after is not None and len(self.sent) >= self.fail_after):
+            if self.on_failure:
+                self.on_failure()
+            raise ConnectionError("tracking server unreachable")
+        self.sent.append(batch["metrics"][0]["step"])
+
+
+def _batch(step: int) -> dict:
+    return {"metrics": [{"key": "loss", "value": 1.0, "timestamp": 0, "step": step}], "params": [], "tags": []}
+
+
+@pytest.fixture
+def logger(tmp_path, monkeypatch):
+    # newer MLflow versions only use a file store if explicitly allowed, no request reaches it
+    monkeypatch.setenv("MLFLOW_ALLOW_FILE_STORE", "true")
+    logger = RecordingLogger(
+        "run",
+        flush_interval_seconds=3600,
+        spool_dir=str(tmp_path / "spool"),
+        tracking_uri=(tmp_path / "mlruns").as_uri(),
+    )
+    yield logger
+    logger.reachable.set()
+    logger.fail_after = None
+    logger.close(timeout=5)
+
+
+def _spooled_steps(logger: AsyncMlflowLogger) -> list:
+    with open(logger._spool_path("run")) as f:
+        return [json.loads(line)["metrics"][0]["step"] for line in f]
+
+
+def test_failed_replay_keeps_the_order_of_the_spool(logger):
+    logger.reachable.clear()
+    for step in range(3):
+        logger._send_or_spool("run", _batch(step))
+    logger.reachable.set()
+    logger.fail_after = 1
+    # a batch is spooled by another thread while the replay fails
+    spooling = threading.Thread(target=logger._spool, args=("run", _batch(3)))
+    logger.on_failure = lambda: spooling.start() or spooling.join(timeout=0.5)
+
+    logger._replay_spool()
+    spooling.join()
+
+    assert logger.sent == [0]
+    assert _spooled_steps(logger) == [1, 2, 3]
+
+    logger.fail_after = None
+    logger.on_failure = None
+    logger._replay_spool()
+
+    assert logger.sent == [0, 1, 2, 3]
+
+
+def test_close_replays_the_spool_once_the_thread_exited(logger):
+    logger.reachable.clear()
+    logger.log_metric("loss", 1.0, step=0)
+    logger.flush(wait=True, timeout=5)
+    assert _spooled_steps(logger) == [0]
+
+    logger.reachable.set()
+    logger.close(timeout=10)
+
+    assert logger.sent == [0]
+    assert logger.num_spooled == 1
+
+
+def test_close_raises_on_unsent_entries(logger):
+    logger.reachable.clear()
+    logger.log_metric("loss", 1.0, step=0)
+
+    with pytest.raises(RuntimeError):
+        logger.close(timeout=0.5)
+
+    assert _spooled_steps(logger) == [0]
@@ -0,0 +1,169 @@
+import boto3
+import pytest
+from botocore.stub import ANY, Stubber
+from src.sagemaker_autoscaling import (
+    SCALABLE_DIMENSION,
+    apply_autoscaling_policy,
+    choose_endpoint_sizing,
+    remove_autoscaling,
+)
+
+ENDPOINT_NAME = "cnn-skin-cancer"
+RESOURCE_ID = f"endpoint/{ENDPOINT_NAME}/variant/variant-1"
+
+
+@pytest.fixture
+def profile() -> dict:
+    return {
+        "latency_slo_ms_p95": 500,
+        "instance_types": {
+            "ml.t2.large": {"max_invocations_per_minute": 180.0, "p95_latency_ms": 460.0, "price_per_hour": 0.13},
+            "ml.c5.large": {"max_invocations_per_minute": 300.0, "p95_latency_ms": 330.0, "price_per_hour": 0.119},
+            "ml.m5.large": {"max_invocations_per_minute": 900.0, "p95_latency_ms": 620.0, "price_per_hour": 0.1},
+        },
+    }
+
+
+@pytest.fixture
+def sage_client():
+    return boto3.client("sagemaker", region_name="eu-central-1", aws_access_key_id="x", aws_secret_access_key="x")
+
+
+@pytest.fixture
+def autoscaling_client():
+    return boto3.client(
+        "application-autoscaling", region_name="eu-central-1", aws_access_key_id="x", aws_secret_access_key="x"
+    )
+
+
+def _describe_endpoint_response() -> dict:
+    return {
+        "EndpointName": ENDPOINT_NAME,
+        "EndpointArn": f"arn:aws:sagemaker:eu-central-1:123456789012:endpoint/{ENDPOINT_NAME}",
+        "EndpointConfigName": f"{ENDPOINT_NAME}-config",
+        "ProductionVariants": [{"VariantName": "variant-1"}],
+        "EndpointStatus": "InService",
+        "CreationTime": "2023-07-01T00:00:00Z",
+        "LastModifiedTime": "2023-07-01T00:00:00Z",
+    }
+
+
+def test_choose_endpoint_sizing_picks_cheapest_instance_type_at_peak(profile):
+    # ml.m5.large is the cheapest, but misses the latency SLO
+    sizing = choose_endpoint_sizing(profile, expected_peak_invocations_per_minute=1000, target_utilization=0.7)
+
+    assert sizing == {
+        "instance_type": "ml.c5.large",
+        "min_instances": 1,
+        "max_instances": 5,
+        "target_invocations_per_instance": 210.0,
+    }
+
+
+def test_choose_endpoint_sizing_skips_instance_types_without_price(profile):
+    del profile["instance_types"]["ml.c5.large"]["price_per_hour"]
+
+    sizing = choose_endpoint_sizing(profile, expected_peak_invocations_per_minute=1000)
+
+    assert sizing["instance_type"] == "ml.t2.large"
+
+
+def test_choose_endpoint_sizing_raises_if_no_instance_type_meets_the_slo(profile):
+    profile["latency_slo_ms_p95"] = 100
+
+    with pytest.raises(ValueError):
+        choose_endpoint_sizing(profile, expected_peak_invocations_per_minute=1000)
+
+
+def test_apply_autoscaling_policy_registers_the_variant_and_tracks_invocations(sage_client, autoscaling_client):
+    with Stubber(sage_client) as sage_stubber, Stubber(autoscaling_client) as autoscaling_stubber:
+        sage_stubber.add_response("describe_endpoint", _describe_endpoint_response(), {"EndpointName": ENDPOINT_NAME})
+        autoscaling_stubber.add_response(
+            "register_scalable_target",
+            {},
+            {
+                "ServiceNamespace": "sagemaker",
+                "ResourceId": RESOURCE_ID,
+                "ScalableDimension": SCALABLE_DIMENSION,
+                "MinCapacity": 1,
+                "MaxCapacity": 4,
+            },
+        )
+        autoscaling_stubber.add_response(
+            "put_scaling_policy",
+            {"PolicyARN": "arn:policy"},
+            {
+                "PolicyName": ANY,
+                "ServiceNamespace": "sagemaker",
+                "ResourceId": RESOURCE_ID,
+                "ScalableDimension": SCALABLE_DIMENSION,
+                "PolicyType": "TargetTrackingScaling",
+                "TargetTrackingScalingPolicyConfiguration": {
+                    "TargetValue": 210.0,
+                    "PredefinedMetricSpecification": {"PredefinedMetricType": "SageMakerVariantInvocationsPerInstance"},
+                    "ScaleInCooldown": 300,
+                    "ScaleOutCooldown": 60,
+                },
+            },
+        )
+
+        policy_arn = apply_autoscaling_policy(
+            ENDPOINT_NAME,
+            min_instances=1,
+            max_instances=4,
+            target_invocations_per_instance=210.0,
+            sage_client=sage_client,
+            autoscaling_client=autoscaling_client,
+        )
+
+        assert policy_arn == "arn:policy"
+        sage_stubber.assert_no_pending_responses()
+        autoscaling_stubber.assert_no_pending_responses()
+
+
+def test_remove_autoscaling_deregisters_only_the_targets_of_the_endpoint(sage_client, autoscaling_client):
+    with Stubber(sage_client) as sage_stubber, Stubber(autoscaling_client) as autoscaling_stubber:
+        sage_stubber.add_response("describe_endpoint", _describe_endpoint_response(), {"EndpointName": ENDPOINT_NAME})
+        autoscaling_stubber.add_response(
+            "describe_scalable_targets",
+            {
+                "ScalableTargets": [
+                    {
+                        "ServiceNamespace": "sagemaker",
+                        "ResourceId": RESOURCE_ID,
+                        "ScalableDimension": SCALABLE_DIMENSION,
+                        "MinCapacity": 1,
+                        "MaxCapacity": 4,
+                        "RoleARN": "arn:role",
+                        "CreationTime": "2023-07-01T00:00:00Z",
+                    }
+                ]
+            },
+            {"ServiceNamespace": "sagemaker", "ResourceIds": [RESOURCE_ID]},
+        )
+        autoscaling_stubber.add_response(
+            "deregister_scalable_target",
+            {},
+            {"ServiceNamespace": "sagemaker", "ResourceId": RESOURCE_ID, "ScalableDimension": SCALABLE_DIMENSION},
+        )
+
+        removed = remove_autoscaling(ENDPOINT_NAME, sage_client=sage_client, autoscaling_client=autoscaling_client)
+
+        assert removed == 1
+        autoscaling_stubber.assert_no_pending_responses()
+
+
+def test_choose_endpoint_sizing_skips_estimated_instance_types(profile):
+    profile["instance_types"]["ml.c5.large"]["estimated"] = True
+
+    sizing = choose_endpoint_sizing(profile, expected_peak_invocations_per_minute=100, target_utilization=0.7)
+
+    assert sizing["instance_type"] == "ml.t2.large"
+
+
+def test_choose_endpoint_sizing_refuses_a_profile_of_estimates(profile):
+    for measurement in profile["instance_types"].values():
+        measurement["estimated"] = True
+
+    with pytest.raises(ValueError):
+        choose_endpoint_sizing(profile, expected_peak_invocations_per_minute=100)
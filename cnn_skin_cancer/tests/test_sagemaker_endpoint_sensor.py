@@ -0,0 +1,38 @@
+import pytest
+
+pytest.importorskip("airflow")
+
+from sagemaker_endpoint_sensor import check_endpoint  # noqa: E402
+
+
+def _endpoint(status: str, endpoint_config_name: str, failure_reason: str = None) -> dict:
+    endpoint = {"EndpointStatus": status, "EndpointConfigName": endpoint_config_name}
+    if failure_reason:
+        endpoint["FailureReason"] = failure_reason
+    return endpoint
+
+
+def test_endpoint_in_service_with_deployed_config_succeeds():
+    status, _ = check_endpoint(_endpoint("InService", "config-2"), "config-2")
+
+    assert status == "success"
+
+
+def test_endpoint_rolled_back_to_previous_config_fails():
+    endpoint = _endpoint("InService", "config-1", failure_reason="The primary container did not pass the ping check")
+
+    status, message = check_endpoint(endpoint, "config-2")
+
+    assert status == "error"
+    assert "did not pass the ping check" in message
+
+
+def test_endpoint_being_updated_is_pending():
+    assert check_endpoint(_endpoint("Updating", "config-1"), "config-2")[0] is None
+
+
+def test_failed_endpoint_fails_with_reason():
+    status, message = check_endpoint(_endpoint("Failed", "config-2", failure_reason="No capacity"), "config-2")
+
+    assert status == "error"
+    assert "No capacity" in message